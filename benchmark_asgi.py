@@ -0,0 +1,183 @@
+"""WSGI与ASGI吞吐量对比
+
+在同一进程内分别通过Django的WSGI处理器和ASGI应用执行相同的请求，
+比较相同并发数下的吞吐量和延迟。不经过网络和应用服务器，
+测到的是Django处理请求本身（中间件、视图、数据库查询、模板渲染）的差异。
+
+    WSGI: 线程池中的N个线程同时调用WSGI处理器，每个线程占用一个数据库连接
+    ASGI: 一个事件循环上同时运行N个请求，同步中间件、异步视图中的查询和模板渲染
+          都交给sync_to_async（thread_sensitive）的同一个同步线程依次执行
+
+用法:
+    python benchmark_asgi.py
+    python benchmark_asgi.py --requests 500 --concurrency 20
+    python benchmark_asgi.py --path /products/ --path "/products/search/?q=手机"
+    python benchmark_asgi.py --cookie "sessionid=..."   # 以登录用户访问购物车
+"""
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# 设置Django环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'user_auth_system.settings')
+import django
+
+django.setup()
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+
+# 默认的请求路径: 商品列表（含排序）、搜索和购物车
+DEFAULT_PATHS = ['/products/', '/products/?sort=price_asc', '/products/search/?q=a', '/cart/']
+# 请求使用的主机名，DEBUG模式下ALLOWED_HOSTS为空时允许127.0.0.1
+HOST = '127.0.0.1'
+
+
+def wsgi_request(application, path, cookie):
+    """通过WSGI处理器执行一次GET请求，返回(状态码, 耗时秒数)"""
+    url = urlsplit(path)
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'SERVER_NAME': HOST,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': HOST,
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if cookie:
+        environ['HTTP_COOKIE'] = cookie
+    status = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append(int(status_line.split()[0]))
+
+    started = time.perf_counter()
+    response = application(environ, start_response)
+    try:
+        for _ in response:
+            pass
+    finally:
+        # close()触发request_finished信号，与真实服务器一样释放数据库连接
+        if hasattr(response, 'close'):
+            response.close()
+    return status[0], time.perf_counter() - started
+
+
+async def asgi_request(application, path, cookie):
+    """通过ASGI应用执行一次GET请求，返回(状态码, 耗时秒数)"""
+    url = urlsplit(path)
+    headers = [(b'host', HOST.encode())]
+    if cookie:
+        headers.append((b'cookie', cookie.encode()))
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': url.path,
+        'raw_path': url.path.encode(),
+        'query_string': url.query.encode(),
+        'headers': headers,
+        'server': (HOST, 80),
+        'client': ('127.0.0.1', 50000),
+    }
+    status = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    started = time.perf_counter()
+    await application(scope, receive, send)
+    return status[0], time.perf_counter() - started
+
+
+def run_wsgi(paths, total, concurrency, cookie):
+    """用线程池并发执行WSGI请求"""
+    application = get_wsgi_application()
+    urls = [paths[index % len(paths)] for index in range(total)]
+
+    def worker(path):
+        try:
+            return wsgi_request(application, path, cookie)
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, urls))
+    return results, time.perf_counter() - started
+
+
+def run_asgi(paths, total, concurrency, cookie):
+    """在一个事件循环上并发执行ASGI请求，同时进行的请求数不超过concurrency"""
+    application = get_asgi_application()
+    urls = [paths[index % len(paths)] for index in range(total)]
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(path):
+            async with semaphore:
+                return await asgi_request(application, path, cookie)
+
+        return await asyncio.gather(*[limited(path) for path in urls])
+
+    started = time.perf_counter()
+    results = asyncio.run(main())
+    return results, time.perf_counter() - started
+
+
+def report(name, results, elapsed):
+    """输出一组请求的吞吐量和延迟"""
+    latencies = sorted(duration * 1000 for _, duration in results)
+    errors = sum(1 for status, _ in results if status >= 400)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(
+        f'{name}: {len(results) / elapsed:8.1f} 请求/秒  '
+        f'平均 {statistics.mean(latencies):7.1f} ms  p50 {statistics.median(latencies):7.1f} ms  '
+        f'p95 {p95:7.1f} ms  错误 {errors}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比WSGI与ASGI的吞吐量')
+    parser.add_argument('--requests', type=int, default=200, help='每种模式的请求总数')
+    parser.add_argument('--concurrency', type=int, default=10, help='同时进行的请求数')
+    parser.add_argument('--path', action='append', dest='paths', help='请求路径，可重复指定')
+    parser.add_argument('--cookie', default='', help='请求携带的Cookie，例如登录后的会话Cookie')
+    parser.add_argument('--warmup', type=int, default=20, help='正式计时前的预热请求数')
+    args = parser.parse_args()
+    paths = args.paths or DEFAULT_PATHS
+
+    print(f'路径: {", ".join(paths)}')
+    print(f'请求数: {args.requests}  并发数: {args.concurrency}\n')
+
+    # 预热: 填充分类、分面等缓存，两种模式在相同的缓存状态下计时
+    run_wsgi(paths, args.warmup, 1, args.cookie)
+    run_asgi(paths, args.warmup, 1, args.cookie)
+
+    report('WSGI', *run_wsgi(paths, args.requests, args.concurrency, args.cookie))
+    report('ASGI', *run_asgi(paths, args.requests, args.concurrency, args.cookie))
+
+
+if __name__ == '__main__':
+    main()
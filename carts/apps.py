@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CartsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'carts'
+
+    def ready(self):
+        # 注册信号处理器（登录时合并会话购物车）
+        from . import signals  # noqa: F401
@@ -0,0 +1,527 @@
+"""购物车接口
+
+视图通过 get_cart(request) 获取当前请求的购物车，登录用户和匿名访客使用相同的方法:
+    add(product)                 加入1件商品
+    update(line_id, quantity)    修改数量（<=0 时移除）
+    remove(line_id)              移除一行
+    clear()                      清空
+    items()                      购物车行列表（提供 id、product、quantity、line_total）
+    total_price()                总金额
+    aitems() / atotal_price()    上面两个方法的异步版本，供异步视图使用
+    count()                      行数
+    summary()                    导航栏使用的摘要（行数、件数、总金额），缓存在会话或购物车Cookie中
+    apply_operations(operations) 批量执行 add/update/remove 操作（全部成功或全部不生效）
+
+- DatabaseCart: 登录用户，数据保存在CartItem表，库存通过StockReservation预留
+- SessionCart: 匿名访客，数据只保存在单独的签名Cookie（CartCookie）中，不写数据库也不占用库存；
+  登录时由 merge_session_cart 一次批量写入CartItem。会话仍使用数据库后端，匿名访客不会因购物车产生会话
+
+购物车摘要在每次修改购物车后重新计算并写入会话（匿名访客写入购物车Cookie），页面渲染时只读这份缓存，不查询数据库。
+同一用户在其他设备上的修改无法通知到本会话，摘要因此带有效期，过期后重新计算一次。
+"""
+# 导入functools保留被装饰方法的名称和文档
+import functools
+# 导入time计算摘要的有效期
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+# 导入signing对匿名购物车Cookie签名
+from django.core import signing
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from products.inventory import release_stock_many, reserve_stock_many
+from products.models import Product, StockMovement
+from products.movements import stock_movements
+from .models import LINE_TOTAL, CartItem, StockReservation
+from .reservations import hold_stock, release_holds, reservation_expiry
+
+
+def replay_operations(quantities, operations):
+    """在当前数量上依次重放批量操作
+
+    参数:
+        quantities: 当前购物车中各商品的数量 {商品ID: 数量}
+        operations: [(操作, 商品ID, 数量), ...]，操作为 add / update / remove
+
+    返回:
+        操作涉及的商品的最终数量 {商品ID: 数量}，<=0 表示移除
+    """
+    targets = {}
+    for operation, product_id, quantity in operations:
+        current = targets.get(product_id, quantities.get(product_id, 0))
+        if operation == 'add':
+            targets[product_id] = current + quantity
+        elif operation == 'update':
+            targets[product_id] = quantity
+        else:
+            targets[product_id] = 0
+    return targets
+
+
+# 购物车摘要在会话中的键
+SUMMARY_SESSION_KEY = 'cart_summary'
+# 购物车摘要的有效期（秒）
+SUMMARY_TTL = 5 * 60
+
+# 匿名访客购物车Cookie的名称、签名盐值和有效期（秒）
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_SALT = 'carts.cart_cookie'
+CART_COOKIE_AGE = 30 * 24 * 60 * 60
+
+
+class CartCookie:
+    """匿名访客购物车的签名Cookie，提供与会话相同的 get / [] / pop 接口
+
+    数据经过签名防篡改但未加密，与签名Cookie会话后端使用相同的格式；
+    由 carts.middleware.CartCookieMiddleware 在请求开始时创建（request.cart_cookie），修改过时在响应中写回
+    """
+
+    def __init__(self, value=None):
+        self.data = {}
+        self.modified = False
+        self.accessed = False
+        if value:
+            try:
+                self.data = signing.loads(value, salt=CART_COOKIE_SALT, max_age=CART_COOKIE_AGE)
+            except signing.BadSignature:
+                # 签名无效或已过期的Cookie在响应中删除
+                self.modified = True
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return self.data.get(key, default)
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def pop(self, key, default=None):
+        if key in self.data:
+            self.modified = True
+        return self.data.pop(key, default)
+
+    def save(self, response):
+        """把修改写回响应的Cookie，数据为空时删除Cookie"""
+        if not self.modified:
+            return
+        if self.data:
+            response.set_cookie(
+                CART_COOKIE_NAME,
+                signing.dumps(self.data, salt=CART_COOKIE_SALT, compress=True),
+                max_age=CART_COOKIE_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite='Lax',
+            )
+        else:
+            response.delete_cookie(CART_COOKIE_NAME, samesite='Lax')
+
+
+class CartSummaryMixin:
+    """购物车摘要的缓存，子类需提供 self.store（会话或购物车Cookie）和 _compute_summary()"""
+    # 是否缓存空购物车的摘要
+    CACHE_EMPTY_SUMMARY = True
+
+    def summary(self):
+        """读取摘要: {'lines': 行数, 'items': 商品件数, 'total': 总金额字符串}"""
+        cached = self.store.get(SUMMARY_SESSION_KEY)
+        if cached and cached['expires'] > time.time():
+            return cached
+        return self.refresh_summary()
+
+    def refresh_summary(self):
+        """重新计算摘要并写入缓存（每次修改购物车后调用）"""
+        lines, items, total = self._compute_summary()
+        summary = {
+            'lines': lines,
+            'items': items,
+            # 会话和购物车Cookie使用JSON序列化，金额保存为字符串
+            'total': f'{total:.2f}',
+            'expires': time.time() + SUMMARY_TTL,
+        }
+        if lines or self.CACHE_EMPTY_SUMMARY:
+            self.store[SUMMARY_SESSION_KEY] = summary
+        else:
+            self.store.pop(SUMMARY_SESSION_KEY, None)
+        return summary
+
+
+def _cart_transaction(method):
+    """DatabaseCart修改方法的装饰器: 在事务中执行，本次修改的库存流水在事务提交前批量写入"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with transaction.atomic(), stock_movements(StockMovement.REASON_CART, ref_id=self.user.id):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class DatabaseCart(CartSummaryMixin):
+    """登录用户的购物车"""
+
+    def __init__(self, user, session):
+        self.user = user
+        self.store = session
+
+    def _compute_summary(self):
+        """一条聚合查询计算行数、件数和总金额"""
+        row = CartItem.objects.filter(user=self.user).order_by().aggregate(
+            lines=Count('id'),
+            items=Sum('quantity'),
+            total=Sum(LINE_TOTAL),
+        )
+        return row['lines'], row['items'] or 0, row['total'] or 0
+
+    @_cart_transaction
+    def add(self, product):
+        """加入1件商品，库存不足时返回False且不做任何修改"""
+        # 尝试获取已存在的购物车项，如果不存在则创建
+        cart_item, created = CartItem.objects.get_or_create(
+            user=self.user,
+            product=product,
+            defaults={'quantity': 1}
+        )
+        quantity = 1 if created else cart_item.quantity + 1
+
+        # 按新数量占用库存，由数据库判断库存是否足够
+        if not hold_stock(cart_item, quantity):
+            if created:
+                cart_item.delete()
+            return False
+
+        if not created:
+            cart_item.quantity = quantity
+            # 只更新数量和更新时间两列
+            cart_item.save(update_fields=['quantity', 'updated_at'])
+        self.refresh_summary()
+        return True
+
+    @_cart_transaction
+    def update(self, line_id, quantity):
+        """修改购物车项数量，数量<=0时移除；库存不足时返回False且不做任何修改"""
+        cart_item = get_object_or_404(CartItem, id=line_id, user=self.user)
+        if quantity <= 0:
+            self._delete(CartItem.objects.filter(id=cart_item.id))
+            return True
+
+        # 按新数量占用库存，库存不足时不做任何修改
+        if not hold_stock(cart_item, quantity):
+            return False
+        cart_item.quantity = quantity
+        cart_item.save(update_fields=['quantity', 'updated_at'])
+        self.refresh_summary()
+        return True
+
+    @_cart_transaction
+    def remove(self, line_id):
+        """移除购物车项并归还库存"""
+        cart_item = get_object_or_404(CartItem, id=line_id, user=self.user)
+        self._delete(CartItem.objects.filter(id=cart_item.id))
+
+    @_cart_transaction
+    def clear(self):
+        """清空购物车并归还库存"""
+        self._delete(CartItem.objects.filter(user=self.user))
+
+    def _delete(self, cart_items):
+        """归还预留占用的库存后删除购物车项"""
+        release_holds(cart_items)
+        cart_items.delete()
+        self.refresh_summary()
+
+    @_cart_transaction
+    def apply_operations(self, operations):
+        """在一个事务中批量执行购物车操作
+
+        先在内存中重放全部操作得到每个商品的最终数量，再统一写入:
+        库存差额用一条条件UPDATE扣减、按数量分组归还，购物车项和预留用
+        bulk_create / bulk_update 写入，查询数量与操作条数无关。
+
+        参数:
+            operations: [(操作, 商品ID, 数量), ...]
+
+        返回:
+            无法满足的商品ID列表（不存在、已下架或库存不足），为空表示全部成功；
+            不为空时购物车和库存都不做任何修改
+        """
+        product_ids = {product_id for _, product_id, _ in operations}
+        # 锁定涉及的购物车项和它们的预留
+        cart_items = {
+            item.product_id: item
+            for item in CartItem.objects.select_for_update().filter(user=self.user, product_id__in=product_ids)
+        }
+        reservations = {
+            reservation.cart_item_id: reservation
+            for reservation in StockReservation.objects.select_for_update().filter(
+                cart_item_id__in=[item.id for item in cart_items.values()]
+            )
+        }
+        targets = replay_operations({product_id: item.quantity for product_id, item in cart_items.items()}, operations)
+
+        # 最终数量大于0的商品必须存在且上架
+        wanted = {product_id for product_id, quantity in targets.items() if quantity > 0}
+        available = set(Product.objects.filter(id__in=wanted, is_active=True).values_list('id', flat=True))
+        if wanted - available:
+            return sorted(wanted - available)
+
+        # 按最终数量与已预留数量的差额调整库存
+        to_reserve, to_release = {}, {}
+        for product_id, quantity in targets.items():
+            item = cart_items.get(product_id)
+            reservation = reservations.get(item.id) if item else None
+            difference = max(quantity, 0) - (reservation.quantity if reservation else 0)
+            if difference > 0:
+                to_reserve[product_id] = difference
+            elif difference < 0:
+                to_release[product_id] = -difference
+        if not reserve_stock_many(to_reserve):
+            # Product.stock只用于指出哪些商品不足: 并发修改或分片商品的展示值滞后时可能一个也找不出，
+            # 此时返回全部需要扣减的商品，失败必须以非空列表告知调用方
+            stock = dict(Product.objects.filter(id__in=to_reserve).values_list('id', 'stock'))
+            short = [product_id for product_id, quantity in to_reserve.items() if stock.get(product_id, 0) < quantity]
+            return sorted(short or to_reserve)
+        release_stock_many(to_release)
+
+        # 写入购物车项: 删除数量<=0的行（预留级联删除），批量更新和创建其余行
+        now = timezone.now()
+        removed, changed, created = [], [], []
+        for product_id, quantity in targets.items():
+            item = cart_items.get(product_id)
+            if quantity <= 0:
+                if item:
+                    removed.append(item.id)
+            elif item is None:
+                created.append(CartItem(user=self.user, product_id=product_id, quantity=quantity))
+            elif item.quantity != quantity:
+                item.quantity = quantity
+                # bulk_update不会自动更新auto_now字段
+                item.updated_at = now
+                changed.append(item)
+        CartItem.objects.filter(id__in=removed).delete()
+        CartItem.objects.bulk_update(changed, ['quantity', 'updated_at'])
+        CartItem.objects.bulk_create(created)
+
+        # 写入预留: MySQL的bulk_create不返回自增ID，新建购物车项的ID需要再查一次
+        expires_at = reservation_expiry()
+        item_ids = CartItem.objects.filter(user=self.user, product_id__in=wanted).values_list('product_id', 'id')
+        new_reservations, changed_reservations = [], []
+        for product_id, item_id in item_ids:
+            reservation = reservations.get(item_id)
+            if reservation is None:
+                new_reservations.append(StockReservation(
+                    cart_item_id=item_id, product_id=product_id, quantity=targets[product_id], expires_at=expires_at,
+                ))
+            else:
+                reservation.quantity = targets[product_id]
+                reservation.expires_at = expires_at
+                changed_reservations.append(reservation)
+        StockReservation.objects.bulk_update(changed_reservations, ['quantity', 'expires_at'])
+        StockReservation.objects.bulk_create(new_reservations)
+
+        self.refresh_summary()
+        return []
+
+    def items(self):
+        """购物车项列表，一条查询取回商品和数据库计算的小计"""
+        return CartItem.objects.filter(user=self.user).with_totals()
+
+    def total_price(self):
+        """购物车总金额，在数据库中聚合"""
+        return CartItem.objects.filter(user=self.user).total_price()
+
+    async def aitems(self):
+        """items的异步版本，异步迭代查询集"""
+        return [item async for item in self.items()]
+
+    async def atotal_price(self):
+        """total_price的异步版本"""
+        result = await CartItem.objects.filter(user=self.user).order_by().aaggregate(total=Sum(LINE_TOTAL))
+        return result['total'] or 0
+
+    def count(self):
+        """购物车行数（读取会话中的摘要）"""
+        return self.summary()['lines']
+
+
+class SessionCartLine:
+    """会话购物车中的一行，提供与CartItem相同的模板接口（行ID即商品ID）"""
+
+    def __init__(self, product, quantity):
+        self.id = product.id
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def line_total(self):
+        """小计金额"""
+        return self.quantity * self.product.get_final_price()
+
+
+class SessionCart(CartSummaryMixin):
+    """匿名访客的购物车
+
+    购物车Cookie中保存 {商品ID字符串: 数量}，行数有上限以控制Cookie大小。
+    库存只做只读检查，不做预留。
+    """
+    SESSION_KEY = 'cart'
+    # 最多保存的行数（Cookie大小限制约4KB）
+    MAX_LINES = 50
+    # 空购物车的摘要无需查询，也不写入Cookie，只浏览不加购的访客不会收到购物车Cookie
+    CACHE_EMPTY_SUMMARY = False
+
+    def __init__(self, cart_cookie):
+        self.store = cart_cookie
+        self.lines = cart_cookie.get(self.SESSION_KEY, {})
+
+    def _save(self):
+        """写回购物车Cookie并更新摘要"""
+        if self.lines:
+            self.store[self.SESSION_KEY] = self.lines
+        else:
+            self.store.pop(self.SESSION_KEY, None)
+        self.refresh_summary()
+
+    def _compute_summary(self):
+        """件数直接来自会话，总金额需要一条查询读取商品实际售价"""
+        if not self.lines:
+            return 0, 0, 0
+        prices = Product.objects.filter(id__in=[int(key) for key in self.lines], is_active=True).values_list('id', 'final_price')
+        total = sum(price * self.lines[str(product_id)] for product_id, price in prices)
+        return len(self.lines), sum(self.lines.values()), total
+
+    def add(self, product):
+        """加入1件商品，库存不足或超过行数上限时返回False"""
+        key = str(product.id)
+        quantity = self.lines.get(key, 0) + 1
+        if quantity > product.stock or (key not in self.lines and len(self.lines) >= self.MAX_LINES):
+            return False
+        self.lines[key] = quantity
+        self._save()
+        return True
+
+    def update(self, line_id, quantity):
+        """修改数量，数量<=0时移除；库存不足时返回False"""
+        key = str(line_id)
+        if key not in self.lines:
+            raise Http404('购物车中没有该商品')
+        if quantity <= 0:
+            self.remove(line_id)
+            return True
+        product = get_object_or_404(Product, id=line_id, is_active=True)
+        if quantity > product.stock:
+            return False
+        self.lines[key] = quantity
+        self._save()
+        return True
+
+    def remove(self, line_id):
+        """移除一行"""
+        self.lines.pop(str(line_id), None)
+        self._save()
+
+    def clear(self):
+        """清空购物车"""
+        self.lines = {}
+        self._save()
+
+    def apply_operations(self, operations):
+        """批量执行购物车操作，库存只做只读检查
+
+        返回:
+            无法满足的商品ID列表，为空表示全部成功；不为空时购物车不做任何修改
+        """
+        current = {int(key): quantity for key, quantity in self.lines.items()}
+        targets = replay_operations(current, operations)
+        wanted = {product_id: quantity for product_id, quantity in targets.items() if quantity > 0}
+        stock = dict(Product.objects.filter(id__in=wanted, is_active=True).values_list('id', 'stock'))
+        unavailable = [product_id for product_id, quantity in wanted.items() if stock.get(product_id, 0) < quantity]
+        if unavailable:
+            return sorted(unavailable)
+
+        lines = {key: quantity for key, quantity in self.lines.items() if int(key) not in targets}
+        lines.update({str(product_id): quantity for product_id, quantity in wanted.items()})
+        # 超过行数上限时拒绝本次新增的商品
+        if len(lines) > self.MAX_LINES:
+            return sorted(set(wanted) - set(current))
+        self.lines = lines
+        self._save()
+        return []
+
+    def items(self):
+        """购物车行列表，一条查询取回全部商品，已下架或删除的商品不显示"""
+        products = Product.objects.filter(id__in=[int(key) for key in self.lines], is_active=True)
+        return [SessionCartLine(product, self.lines[str(product.id)]) for product in products]
+
+    def total_price(self):
+        """购物车总金额"""
+        return sum(line.line_total for line in self.items())
+
+    async def aitems(self):
+        """items的异步版本"""
+        products = Product.objects.filter(id__in=[int(key) for key in self.lines], is_active=True)
+        return [SessionCartLine(product, self.lines[str(product.id)]) async for product in products]
+
+    async def atotal_price(self):
+        """total_price的异步版本"""
+        return sum(line.line_total for line in await self.aitems())
+
+    def count(self):
+        """购物车行数"""
+        return len(self.lines)
+
+
+def get_cart(request):
+    """获取当前请求的购物车"""
+    if request.user.is_authenticated:
+        return DatabaseCart(request.user, request.session)
+    return SessionCart(request.cart_cookie)
+
+
+async def aget_cart(request):
+    """get_cart的异步版本
+
+    首次访问request.user会按会话查询用户，异步上下文中不能直接执行，交给同步线程
+    """
+    return await sync_to_async(get_cart)(request)
+
+
+def merge_session_cart(cart_cookie, user):
+    """登录时把匿名访客的购物车（购物车Cookie）合并到用户的CartItem
+
+    已有的购物车项数量与会话中的数量相加，所有行用一条批量upsert写入；
+    读取已有数量和upsert在同一事务中并锁定这些行，避免覆盖并发加入购物车的数量。
+    合并后新增的数量不占用库存，下次修改购物车或结算时再扣减。
+
+    返回:
+        合并的行数
+    """
+    cart = SessionCart(cart_cookie)
+    if not cart.lines:
+        return 0
+    quantities = {int(key): quantity for key, quantity in cart.lines.items()}
+    # 只合并仍然上架的商品
+    product_ids = Product.objects.filter(id__in=quantities, is_active=True).values_list('id', flat=True)
+
+    options = {'update_conflicts': True, 'update_fields': ['quantity', 'updated_at']}
+    # MySQL的 ON DUPLICATE KEY UPDATE 不能指定冲突列，由(user, product)唯一约束触发
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = ['user', 'product']
+    with transaction.atomic():
+        # 锁定已有的购物车项直到upsert提交；InnoDB对(user, product)唯一索引上不存在的键加间隙锁，
+        # 并发插入同一商品的请求也会等待本事务结束
+        existing = dict(
+            CartItem.objects.select_for_update()
+            .filter(user=user, product_id__in=quantities)
+            .values_list('product_id', 'quantity')
+        )
+        items = [
+            CartItem(user=user, product_id=product_id, quantity=existing.get(product_id, 0) + quantities[product_id])
+            for product_id in product_ids
+        ]
+        CartItem.objects.bulk_create(items, **options)
+    cart.clear()
+    return len(items)
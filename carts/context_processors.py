@@ -1,6 +1,5 @@
-from .models import CartItem
+from .cart import get_cart
 def cart_item_count(request):
-    """购物车商品数量上下文处理器"""
-    if request.user.is_authenticated:
-        return {'cart_item_count': CartItem.objects.filter(user=request.user).count()}
-    return {'cart_item_count': 0}
\ No newline at end of file
+    """购物车摘要上下文处理器，只读取会话中缓存的摘要"""
+    summary = get_cart(request).summary()
+    return {'cart_summary': summary, 'cart_item_count': summary['lines']}
@@ -0,0 +1,37 @@
+# 导入time用于循环模式的间隔等待
+import time
+
+# 导入管理命令基类
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from carts.reservations import DEFAULT_BATCH_SIZE, release_expired_reservations
+
+
+class Command(BaseCommand):
+    """归还已到期的购物车库存预留
+
+    可以由cron定时执行一次，也可以用--loop作为常驻进程运行。
+
+    用法:
+        python manage.py release_expired_reservations
+        python manage.py release_expired_reservations --loop --interval 60
+    """
+    help = '归还已到期的购物车库存预留'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='每批处理的预留数量')
+        parser.add_argument('--loop', action='store_true', help='循环执行，直到进程被终止')
+        parser.add_argument('--interval', type=int, default=60, help='循环模式下两次清理的间隔（秒）')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            released = release_expired_reservations(batch_size=batch_size)
+            if released or not options['loop']:
+                self.stdout.write(f'已归还 {released} 个到期预留')
+            if not options['loop']:
+                break
+            # 常驻进程中定期关闭失效的数据库连接，避免连接被服务端断开后报错
+            close_old_connections()
+            time.sleep(options['interval'])
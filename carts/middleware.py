@@ -0,0 +1,22 @@
+from django.utils.cache import patch_vary_headers
+
+from .cart import CART_COOKIE_NAME, CartCookie
+
+
+class CartCookieMiddleware:
+    """匿名访客购物车Cookie中间件
+
+    请求开始时读取购物车Cookie为 request.cart_cookie，购物车被修改时在响应中写回或删除。
+    读取过购物车的响应按Cookie区分缓存（Vary: Cookie）。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.cart_cookie = CartCookie(request.COOKIES.get(CART_COOKIE_NAME))
+        response = self.get_response(request)
+        if request.cart_cookie.accessed:
+            patch_vary_headers(response, ('Cookie',))
+        request.cart_cookie.save(response)
+        return response
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:59
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def reserve_existing_cart_items(apps, schema_editor):
+    """已有购物车项占用的库存在加入购物车时已扣减，为它们补建预留，到期后由清理任务归还"""
+    CartItem = apps.get_model('carts', 'CartItem')
+    StockReservation = apps.get_model('carts', 'StockReservation')
+    expires_at = timezone.now() + timedelta(minutes=getattr(settings, 'CART_RESERVATION_MINUTES', 30))
+    items = CartItem.objects.values_list('id', 'product_id', 'quantity').order_by('id')
+    StockReservation.objects.bulk_create(
+        (
+            StockReservation(cart_item_id=item_id, product_id=product_id, quantity=quantity, expires_at=expires_at)
+            for item_id, product_id, quantity in items.iterator(chunk_size=2000)
+        ),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_final_price'),
+        ('carts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='预留数量')),
+                ('expires_at', models.DateTimeField(verbose_name='到期时间')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('cart_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reservation', to='carts.cartitem', verbose_name='购物车项目')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.product', verbose_name='商品')),
+            ],
+            options={
+                'verbose_name': '库存预留',
+                'verbose_name_plural': '库存预留',
+                'indexes': [models.Index(fields=['expires_at'], name='reservation_expires_at')],
+            },
+        ),
+        migrations.RunPython(reserve_existing_cart_items, migrations.RunPython.noop),
+    ]
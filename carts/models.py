@@ -4,6 +4,26 @@ from django.db import models
 from django.contrib.auth.models import User
 # 导入Product模型用于关联商品
 from products.models import Product
+# 导入表达式和聚合函数，在数据库中计算小计和总金额
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+
+# 小计表达式: 数量 x 商品实际售价（final_price为商品表中维护的冗余列，有折扣时为折扣价）
+LINE_TOTAL = ExpressionWrapper(
+    F('quantity') * F('product__final_price'),
+    output_field=DecimalField(max_digits=12, decimal_places=2),
+)
+
+
+class CartItemQuerySet(models.QuerySet):
+    """购物车项查询集，小计和总金额都在数据库中计算"""
+
+    def with_totals(self):
+        """预加载商品，并为每行标注小计 line_total"""
+        return self.select_related('product').annotate(line_total=LINE_TOTAL)
+
+    def total_price(self):
+        """购物车总金额（一条聚合查询）"""
+        return self.order_by().aggregate(total=Sum(LINE_TOTAL))['total'] or 0
 
 class CartItem(models.Model):
     """购物车项目模型
@@ -23,6 +43,8 @@ class CartItem(models.Model):
     # 更新时间，自动更新
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         # 模型的单数和复数名称
         verbose_name = "购物车项目"
@@ -40,4 +62,35 @@ class CartItem(models.Model):
         """计算商品项的小计金额
         数量乘以商品的最终价格（考虑折扣）
         """
-        return self.quantity * self.product.get_final_price()
\ No newline at end of file
+        return self.quantity * self.product.get_final_price()
+
+class StockReservation(models.Model):
+    """库存预留模型
+    记录购物车项当前占用的库存数量和预留的到期时间。
+    加入购物车时库存即被扣减并记录在这里，到期后由清理任务
+    (python manage.py release_expired_reservations) 把库存归还给商品并删除预留；
+    购物车项本身保留，结算时再按需重新扣减库存。
+    """
+    # 对应的购物车项，一个购物车项最多一条预留
+    cart_item = models.OneToOneField(CartItem, on_delete=models.CASCADE, related_name='reservation', verbose_name="购物车项目")
+    # 冗余商品外键，清理任务按商品汇总归还数量时不需要关联购物车表
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="商品")
+    # 占用的库存数量
+    quantity = models.PositiveIntegerField(default=0, verbose_name="预留数量")
+    # 预留到期时间
+    expires_at = models.DateTimeField(verbose_name="到期时间")
+    # 创建时间，自动添加
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    class Meta:
+        # 模型的单数和复数名称
+        verbose_name = "库存预留"
+        verbose_name_plural = "库存预留"
+        indexes = [
+            # 清理任务按到期时间范围扫描: WHERE expires_at <= now
+            models.Index(fields=['expires_at'], name='reservation_expires_at'),
+        ]
+
+    def __str__(self):
+        """对象的字符串表示"""
+        return f"{self.product_id} 预留 {self.quantity} 件，{self.expires_at} 到期"
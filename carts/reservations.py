@@ -0,0 +1,122 @@
+"""购物车库存预留
+
+购物车项通过StockReservation占用库存，每次修改购物车都会刷新到期时间。
+长时间未操作的购物车由清理任务归还库存:
+- release_expired_reservations() 分批处理所有已到期的预留
+- python manage.py release_expired_reservations [--loop] 命令行入口
+
+预留被清理后购物车项仍然保留，下次修改购物车或结算时重新扣减库存。
+"""
+# 导入defaultdict按商品汇总归还数量
+from collections import defaultdict
+# 导入timedelta计算到期时间
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from products.inventory import adjust_reserved_stock, release_stock_many
+from products.models import StockMovement
+from products.movements import stock_movements
+from .models import StockReservation
+
+# 清理任务每批处理的预留数量
+DEFAULT_BATCH_SIZE = 500
+
+
+def reservation_expiry():
+    """计算从现在开始的预留到期时间（settings.CART_RESERVATION_MINUTES，默认30分钟）"""
+    return timezone.now() + timedelta(minutes=getattr(settings, 'CART_RESERVATION_MINUTES', 30))
+
+
+def hold_stock(cart_item, quantity):
+    """使购物车项占用quantity件库存，并刷新预留到期时间
+
+    按已占用数量与目标数量的差额扣减或归还库存，需要在事务中调用。
+
+    参数:
+        cart_item: 已保存的购物车项
+        quantity: 购物车项需要占用的库存数量
+
+    返回:
+        成功返回True，库存不足返回False（此时库存和预留都不变）
+    """
+    # 锁定预留行，防止与清理任务同时归还同一份库存
+    reservation = StockReservation.objects.select_for_update().filter(cart_item=cart_item).first()
+    held = reservation.quantity if reservation else 0
+    if not adjust_reserved_stock(cart_item.product_id, held, quantity):
+        return False
+
+    if reservation is None:
+        StockReservation.objects.create(
+            cart_item=cart_item,
+            product_id=cart_item.product_id,
+            quantity=quantity,
+            expires_at=reservation_expiry(),
+        )
+    else:
+        reservation.quantity = quantity
+        reservation.expires_at = reservation_expiry()
+        reservation.save(update_fields=['quantity', 'expires_at'])
+    return True
+
+
+def _release(reservations):
+    """归还一组预留占用的库存并删除这些预留
+
+    参数:
+        reservations: 已加锁的预留 (id, 商品ID, 数量) 列表
+    """
+    quantities = defaultdict(int)
+    for _, product_id, quantity in reservations:
+        quantities[product_id] += quantity
+    release_stock_many(quantities)
+    StockReservation.objects.filter(id__in=[reservation_id for reservation_id, _, _ in reservations]).delete()
+
+
+def release_holds(cart_items):
+    """归还购物车项占用的库存，在删除购物车项之前调用（需在事务中调用）
+
+    参数:
+        cart_items: 购物车项查询集
+    """
+    reservations = list(
+        StockReservation.objects.select_for_update()
+        .filter(cart_item__in=cart_items)
+        .values_list('id', 'product_id', 'quantity')
+    )
+    _release(reservations)
+
+
+def release_expired_reservations(batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """分批归还所有已到期预留占用的库存
+
+    每批在一个短事务中完成: 按到期时间索引范围扫描并锁定一批预留
+    (已被用户请求锁定的行直接跳过，下次清理时再处理)，
+    按商品汇总后用分组UPDATE归还库存，再批量删除这批预留。
+
+    参数:
+        batch_size: 每批处理的预留数量
+        now: 到期判断的时间点，默认为当前时间
+
+    返回:
+        本次归还的预留数量
+    """
+    now = now or timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic(), stock_movements(StockMovement.REASON_RESERVATION_EXPIRED):
+            reservations = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('id', 'product_id', 'quantity')[:batch_size]
+            )
+            if not reservations:
+                break
+            _release(reservations)
+        total += len(reservations)
+        if len(reservations) < batch_size:
+            break
+    return total
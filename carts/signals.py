@@ -0,0 +1,14 @@
+# 导入登录信号
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .cart import DatabaseCart, merge_session_cart
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """登录时把匿名访客的购物车Cookie合并到用户购物车，并用用户购物车重新计算摘要"""
+    if request is None or not hasattr(request, 'cart_cookie'):
+        return
+    merge_session_cart(request.cart_cookie, user)
+    DatabaseCart(user, request.session).refresh_summary()
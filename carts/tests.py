@@ -1,3 +1,109 @@
+from decimal import Decimal
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from products.models import Category, Product, StockShard
+from .cart import CART_COOKIE_NAME
+from .models import CartItem
+
+
+class CartBatchTests(TestCase):
+    """批量修改购物车接口 /cart/batch/"""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='手机', slug='phones', is_active=True)
+        self.product = Product.objects.create(
+            name='手机A', slug='phone-a', category=category,
+            price=Decimal('999.00'), stock=3, is_active=True,
+        )
+        self.user = User.objects.create_user('buyer', password='password')
+        self.client.force_login(self.user)
+
+    def batch(self, *operations):
+        return self.client.post(
+            '/cart/batch/', json.dumps({'operations': list(operations)}), content_type='application/json',
+        )
+
+    def test_batch_applies_operations(self):
+        response = self.batch({'op': 'add', 'product_id': self.product.id, 'quantity': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['unavailable'], [])
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+
+    def test_insufficient_stock_returns_409(self):
+        response = self.batch({'op': 'add', 'product_id': self.product.id, 'quantity': 4})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['unavailable'], [self.product.id])
+        self.assertFalse(CartItem.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_stale_sharded_stock_still_returns_409(self):
+        # 分片已空，但Product.stock展示值尚未同步
+        Product.objects.filter(id=self.product.id).update(stock=100, stock_shard_count=2)
+        StockShard.objects.bulk_create([StockShard(product=self.product, shard=shard, stock=0) for shard in range(2)])
+        response = self.batch({'op': 'add', 'product_id': self.product.id, 'quantity': 1})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['unavailable'], [self.product.id])
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_rejects_boolean_values(self):
+        response = self.batch({'op': 'add', 'product_id': True, 'quantity': 1})
+        self.assertEqual(response.status_code, 400)
+        response = self.batch({'op': 'add', 'product_id': self.product.id, 'quantity': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_rejects_empty_operations(self):
+        response = self.batch()
+        self.assertEqual(response.status_code, 400)
+
+
+class AnonymousCartTests(TestCase):
+    """匿名访客的购物车保存在单独的签名Cookie中"""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='手机', slug='phones', is_active=True)
+        self.product = Product.objects.create(
+            name='手机A', slug='phone-a', category=category,
+            price=Decimal('999.00'), stock=3, is_active=True,
+        )
+
+    def test_browsing_sets_no_cookies(self):
+        response = self.client.get('/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(dict(response.cookies), {})
+
+    def test_cart_kept_in_cookie_and_merged_on_login(self):
+        self.client.post(f'/cart/add/{self.product.id}/')
+        self.assertIn(CART_COOKIE_NAME, self.client.cookies)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+        response = self.client.get('/cart/')
+        self.assertEqual([item.quantity for item in response.context['cart_items']], [1])
+
+        User.objects.create_user('buyer', password='password')
+        self.client.post('/accounts/login/', {'username': 'buyer', 'password': 'password'})
+        self.assertEqual(CartItem.objects.get(user__username='buyer').quantity, 1)
+        # 合并后删除购物车Cookie
+        self.assertEqual(self.client.cookies[CART_COOKIE_NAME].value, '')
+
+    def test_merge_adds_to_existing_items(self):
+        user = User.objects.create_user('buyer', password='password')
+        CartItem.objects.create(user=user, product=self.product, quantity=2)
+        self.client.post(f'/cart/add/{self.product.id}/')
+        self.client.post('/accounts/login/', {'username': 'buyer', 'password': 'password'})
+        self.assertEqual(CartItem.objects.get(user=user).quantity, 3)
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.cookies[CART_COOKIE_NAME] = 'tampered'
+        response = self.client.get('/cart/')
+        self.assertEqual(list(response.context['cart_items']), [])
+        self.assertEqual(response.cookies[CART_COOKIE_NAME].value, '')
@@ -9,4 +9,5 @@ urlpatterns = [
     path('update/<int:item_id>/', views.cart_update, name='cart_update'),
     path('remove/<int:item_id>/', views.cart_remove, name='cart_remove'),
     path('clear/', views.cart_clear, name='cart_clear'),
+    path('batch/', views.cart_batch, name='cart_batch'),
 ]
\ No newline at end of file
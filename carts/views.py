@@ -1,19 +1,26 @@
 from django.shortcuts import render
-from django.db import transaction 
 # Create your views here.
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
 from products.models import Product
-from .models import CartItem
+from asgiref.sync import sync_to_async
+from .cart import aget_cart, get_cart
+import json
 import logging
 logger = logging.getLogger(__name__)
 
-@login_required
-def cart_detail(request):
+# 批量接口支持的操作
+BATCH_OPERATIONS = ('add', 'update', 'remove')
+# 单次批量请求最多包含的操作数
+MAX_BATCH_OPERATIONS = 100
+
+async def cart_detail(request):
     """购物车详情视图
 
-    显示当前登录用户的购物车内容和总金额
+    显示当前购物车内容和总金额，登录用户和匿名访客都可访问
+    异步视图: 查询和模板渲染在Django的同步线程中依次执行，等待期间不占用事件循环
 
     参数:
         request: HTTP请求对象
@@ -21,29 +28,27 @@ def cart_detail(request):
     返回:
         渲染后的购物车详情页面
     """
-    # 获取当前用户的所有购物车项
-    cart_items = CartItem.objects.filter(user=request.user)
-    # 计算购物车总金额
-    total_price = sum(item.get_total_price() for item in cart_items)
+    cart = await aget_cart(request)
+    # 获取购物车的所有行（已预加载商品并算好小计）和总金额
+    cart_items = await cart.aitems()
+    total_price = await cart.atotal_price()
 
     # 准备上下文数据
     context = {
         'cart_items': cart_items,   # 购物车项列表
         'total_price': total_price  # 购物车总金额
     }
-    # 渲染模板并返回响应
-    return render(request, 'carts_detail.html', context)
+    # 渲染模板并返回响应（上下文处理器会读取会话中的摘要，在同步线程中执行）
+    return await sync_to_async(render)(request, 'carts_detail.html', context)
 
 
 
 
-@login_required
-@transaction.atomic
 def cart_add(request, product_id):
     """添加商品到购物车视图
 
-    将指定商品添加到当前登录用户的购物车
-    包含库存检查和事务处理
+    将指定商品添加到当前购物车
+    登录用户的购物车项通过库存预留占用库存，库存不足时不做任何修改
 
     参数:
         request: HTTP请求对象
@@ -55,38 +60,12 @@ def cart_add(request, product_id):
     # 获取指定ID的商品，如果不存在或未激活则返回404错误
     product = get_object_or_404(Product, id=product_id, is_active=True)
 
-    # 检查商品库存
-    if product.stock <= 0:
+    if not get_cart(request).add(product):
         messages.error(request, '该商品暂时缺货')
         return redirect('product_detail', id=product.id, slug=product.slug)
 
-    # 尝试获取已存在的购物车项，如果不存在则创建
-    cart_item, created = CartItem.objects.get_or_create(
-        user=request.user,
-        product=product,
-        defaults={'quantity': 1}
-    )
-
-    # 如果购物车项已存在，则增加数量
-    if not created:
-        # 检查是否超过库存限制
-        if cart_item.quantity + 1 > product.stock:
-            messages.error(request, f'超过库存限制，当前库存: {product.stock}')
-        else:
-            # 增加购物车项数量
-            cart_item.quantity += 1
-            cart_item.save()
-            # 减少商品库存
-            product.stock -= 1
-            product.save()
-            messages.success(request, '商品已添加到购物车')
-            logger.info(f'用户 {request.user.username} 添加商品 {product.name} 到购物车，库存从 {product.stock+1} 减少到 {product.stock}')
-    # 如果是新创建的购物车项
-    else:
-        # 减少商品库存
-        product.stock -= 1
-        product.save()
-        messages.success(request, '商品已添加到购物车')
+    messages.success(request, '商品已添加到购物车')
+    logger.info(f'用户 {request.user.username or "匿名"} 添加商品 {product.name} 到购物车')
 
     # 重定向到购物车详情页面
     return redirect('cart_detail')
@@ -94,82 +73,48 @@ def cart_add(request, product_id):
 
 
 
-@login_required
-@transaction.atomic
 def cart_update(request, item_id):
     """更新购物车商品数量视图
 
-    更新当前登录用户购物车中指定商品的数量
-    包含库存检查和事务处理
+    更新当前购物车中指定行的数量
+    数量增加时按差额条件扣减库存，减少时归还差额
 
     参数:
         request: HTTP请求对象
-        item_id: 购物车项ID
+        item_id: 购物车项ID（匿名购物车为商品ID）
 
     返回:
         重定向到购物车详情页面
     """
-    # 获取指定ID的购物车项，如果不存在则返回404错误
-    cart_item = get_object_or_404(CartItem, id=item_id, user=request.user)
     # 获取请求中的新数量，默认为1
     quantity = int(request.POST.get('quantity', 1))
-    # 记录旧数量
-    old_quantity = cart_item.quantity
-
-    # 检查库存是否足够
-    # 公式解释: 新数量 <= 现有库存 + (旧数量 - 新数量)
-    # 即: 新数量 - (旧数量 - 新数量) <= 现有库存
-    # 即: 2*新数量 - 旧数量 <= 现有库存
-    if quantity > cart_item.product.stock + (old_quantity - quantity):
-        messages.error(request, f'超过库存限制，当前库存: {cart_item.product.stock}')
-        return redirect('cart_detail')
-
-    # 如果数量小于等于0，则移除该商品
-    if quantity <= 0:
-        # 恢复商品库存
-        cart_item.product.stock += cart_item.quantity
-        cart_item.product.save()
-        # 删除购物车项
-        cart_item.delete()
+
+    if not get_cart(request).update(item_id, quantity):
+        messages.error(request, '超过库存限制，请减少购买数量')
+    elif quantity <= 0:
         messages.success(request, '商品已从购物车移除')
-    # 更新商品数量
     else:
-        # 更新库存: 增加 (旧数量 - 新数量) 的库存
-        cart_item.product.stock += (old_quantity - quantity)
-        cart_item.product.save()
-        # 更新购物车项数量
-        cart_item.quantity = quantity
-        cart_item.save()
         messages.success(request, '购物车已更新')
-        logger.info(f'用户 {request.user.username} 更新商品 {cart_item.product.name} 数量从 {old_quantity} 到 {quantity}，库存从 {cart_item.product.stock - (old_quantity - quantity)} 调整为 {cart_item.product.stock}')
+        logger.info(f'用户 {request.user.username or "匿名"} 更新购物车行 {item_id} 数量为 {quantity}')
 
     # 重定向到购物车详情页面
     return redirect('cart_detail')
 
 
 
-@login_required
-@transaction.atomic
 def cart_remove(request, item_id):
     """从购物车移除商品视图
 
-    从当前登录用户的购物车中移除指定商品
-    包含库存恢复和事务处理
+    从当前购物车中移除指定行，登录用户的预留库存同时归还
 
     参数:
         request: HTTP请求对象
-        item_id: 购物车项ID
+        item_id: 购物车项ID（匿名购物车为商品ID）
 
     返回:
         重定向到购物车详情页面
     """
-    # 获取指定ID的购物车项，如果不存在则返回404错误
-    cart_item = get_object_or_404(CartItem, id=item_id, user=request.user)
-    # 恢复商品库存
-    cart_item.product.stock += cart_item.quantity
-    cart_item.product.save()
-    # 删除购物车项
-    cart_item.delete()
+    get_cart(request).remove(item_id)
     messages.success(request, '商品已从购物车移除')
     # 重定向到购物车详情页面
     return redirect('cart_detail')
@@ -177,13 +122,10 @@ def cart_remove(request, item_id):
 
 
 
-@login_required
-@transaction.atomic
 def cart_clear(request):
     """清空购物车视图
 
-    清空当前登录用户的购物车
-    包含批量库存恢复和事务处理
+    清空当前购物车，登录用户的预留库存同时批量归还
 
     参数:
         request: HTTP请求对象
@@ -191,14 +133,92 @@ def cart_clear(request):
     返回:
         重定向到购物车详情页面
     """
-    # 获取当前用户的所有购物车项
-    cart_items = CartItem.objects.filter(user=request.user)
-    # 恢复所有商品库存
-    for item in cart_items:
-        item.product.stock += item.quantity
-        item.product.save()
-    # 批量删除购物车项
-    cart_items.delete()
+    get_cart(request).clear()
     messages.success(request, '购物车已清空')
     # 重定向到购物车详情页面
-    return redirect('cart_detail')
\ No newline at end of file
+    return redirect('cart_detail')
+
+
+
+
+def _parse_operations(payload):
+    """校验批量请求体并转换为 [(操作, 商品ID, 数量), ...]，格式错误时抛出ValueError"""
+    if not isinstance(payload, dict):
+        raise ValueError('请求体必须是JSON对象')
+    operations = payload.get('operations')
+    if not isinstance(operations, list) or not 0 < len(operations) <= MAX_BATCH_OPERATIONS:
+        raise ValueError(f'operations 必须是包含1到{MAX_BATCH_OPERATIONS}个操作的数组')
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise ValueError('每个操作必须是JSON对象')
+        op = operation.get('op')
+        product_id = operation.get('product_id')
+        quantity = operation.get('quantity', 1 if op == 'add' else 0)
+        if op not in BATCH_OPERATIONS:
+            raise ValueError(f'不支持的操作: {op}')
+        # bool是int的子类，JSON的true/false不能当作整数
+        if type(product_id) is not int or type(quantity) is not int or quantity < 0:
+            raise ValueError('product_id 和 quantity 必须是非负整数')
+        parsed.append((op, product_id, quantity))
+    return parsed
+
+
+def _cart_state(cart):
+    """购物车当前状态，供JSON接口返回"""
+    summary = cart.summary()
+    return {
+        'items': [
+            {
+                'id': item.id,
+                'product_id': item.product.id,
+                'name': item.product.name,
+                'price': item.product.get_final_price(),
+                'quantity': item.quantity,
+                'line_total': item.line_total,
+            }
+            for item in cart.items()
+        ],
+        'summary': {key: summary[key] for key in ('lines', 'items', 'total')},
+    }
+
+
+@require_POST
+def cart_batch(request):
+    """批量修改购物车的JSON接口
+
+    供离线同步的客户端一次提交多个操作，全部操作在一个事务中执行，
+    任一商品不可购买（不存在、已下架或库存不足）时全部不生效。
+
+    请求体:
+        {"operations": [
+            {"op": "add", "product_id": 1, "quantity": 2},
+            {"op": "update", "product_id": 5, "quantity": 1},
+            {"op": "remove", "product_id": 7}
+        ]}
+
+    返回:
+        200 {"ok": true, "items": [...], "summary": {...}}
+        409 {"ok": false, "unavailable": [商品ID, ...], "items": [...], "summary": {...}}
+        400 {"ok": false, "error": "..."}
+    """
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': '请求体不是有效的JSON'}, status=400, json_dumps_params={'ensure_ascii': False})
+    try:
+        operations = _parse_operations(payload)
+    except ValueError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400, json_dumps_params={'ensure_ascii': False})
+
+    cart = get_cart(request)
+    unavailable = cart.apply_operations(operations)
+    if unavailable:
+        logger.info(f'用户 {request.user.username or "匿名"} 批量修改购物车失败，不可购买的商品: {unavailable}')
+    else:
+        logger.info(f'用户 {request.user.username or "匿名"} 批量修改购物车，共 {len(operations)} 个操作')
+    return JsonResponse(
+        {'ok': not unavailable, 'unavailable': unavailable, **_cart_state(cart)},
+        status=409 if unavailable else 200,
+        json_dumps_params={'ensure_ascii': False},
+    )
@@ -5,42 +5,35 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'user_auth_system.settings')
 django.setup()
 
-from products.models import Product
+from django.db import transaction
+from products.models import Product, StockMovement
+from products.movements import record_movements, stock_movements
 from carts.models import CartItem
-from django.db.models import Sum
+from carts.reservations import release_expired_reservations
 
-# 1. 检查所有商品的库存
-print("检查商品库存...")
-all_products = Product.objects.all()
-for product in all_products:
-    # 计算该商品在所有购物车中的总数量
-    cart_quantity = CartItem.objects.filter(product=product).aggregate(Sum('quantity'))['quantity__sum'] or 0
+# 1. 归还已到期的购物车预留
+# 购物车项通过库存预留占用库存，到期的预留按商品汇总后用一条UPDATE归还
+print("归还到期的购物车预留...")
+released = release_expired_reservations()
+print(f"已归还 {released} 个到期预留")
 
-    # 如果购物车中的数量大于库存，调整库存
-    if cart_quantity > product.stock:
-        print(f"调整商品 '{product.name}' 的库存: 原库存 {product.stock}, 购物车总数量 {cart_quantity}")
-        product.stock = cart_quantity
-        product.save()
-        print(f"已将 '{product.name}' 的库存更新为 {product.stock}")
-    elif product.stock < 0:
-        print(f"修复商品 '{product.name}' 的负库存: {product.stock}")
-        product.stock = 0
-        product.save()
-        print(f"已将 '{product.name}' 的库存设置为 0")
-    else:
-        print(f"商品 '{product.name}' 库存正常: {product.stock}, 购物车总数量 {cart_quantity}")
+# 2. 修复负库存（库存服务使用条件UPDATE，正常情况下不会出现负库存）
+print("\n检查负库存...")
+# 锁定负库存的商品行，修正库存和对应的库存调整流水在同一事务中写入
+with transaction.atomic(), stock_movements(StockMovement.REASON_ADJUSTMENT):
+    corrections = {}
+    for product_id, name, stock in Product.objects.select_for_update().filter(stock__lt=0).values_list('id', 'name', 'stock'):
+        print(f"修复商品 '{name}' 的负库存: {stock}")
+        corrections[product_id] = -stock
+    fixed = Product.objects.filter(id__in=corrections).update(stock=0)
+    record_movements(corrections)
+print(f"已将 {fixed} 个商品的库存设置为 0")
 
-# 2. 检查购物车项是否超过库存
-print("\n检查购物车项是否超过库存...")
-all_cart_items = CartItem.objects.all()
-for item in all_cart_items:
-    if item.quantity > item.product.stock:
-        print(f"购物车项 '{item.product.name}' 数量 {item.quantity} 超过库存 {item.product.stock}")
-        # 调整购物车数量
-        item.quantity = item.product.stock
-        item.save()
-        print(f"已将 '{item.product.name}' 的购物车数量调整为 {item.product.stock}")
-    else:
-        print(f"购物车项 '{item.product.name}' 数量 {item.quantity} 正常")
+# 3. 列出未占用库存的购物车项
+# 预留已被归还（或登录时从匿名购物车合并）的购物车项不占用库存，结算时会重新扣减
+print("\n检查未占用库存的购物车项...")
+unreserved = CartItem.objects.filter(reservation__isnull=True).select_related('product')
+for item in unreserved:
+    print(f"购物车项 '{item.product.name}' 数量 {item.quantity} 未占用库存，当前库存 {item.product.stock}")
 
-print("\n库存检查和修复完成！")
\ No newline at end of file
+print("\n库存检查和修复完成！")
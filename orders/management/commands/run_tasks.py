@@ -0,0 +1,62 @@
+# 导入time用于空闲时的轮询等待
+import time
+# 导入线程池
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+# 导入管理命令基类
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+# 导入autodiscover_modules加载各应用tasks模块中注册的任务
+from django.utils.module_loading import autodiscover_modules
+
+from orders.tasks import claim_tasks, run_task
+
+
+class Command(BaseCommand):
+    """后台任务工作进程
+
+    循环领取到期的后台任务，在线程池中并发执行；可以同时运行多个进程。
+    --once 处理完当前到期的任务后退出，适合由cron定时执行。
+
+    用法:
+        python manage.py run_tasks
+        python manage.py run_tasks --workers 8 --interval 2
+        python manage.py run_tasks --once
+    """
+    help = '执行后台任务队列中的任务'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=getattr(settings, 'TASK_WORKERS', 4), help='执行任务的线程数',
+        )
+        parser.add_argument('--interval', type=float, default=1.0, help='没有任务时的轮询间隔（秒）')
+        parser.add_argument('--once', action='store_true', help='处理完当前到期的任务后退出')
+
+    def handle(self, *args, **options):
+        autodiscover_modules('tasks')
+        workers = max(options['workers'], 1)
+        succeeded = failed = 0
+        running = set()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='task') as executor:
+            try:
+                while True:
+                    # 只领取空闲线程能立即执行的数量，其余任务留给其他工作进程
+                    tasks = claim_tasks(workers - len(running)) if len(running) < workers else []
+                    running.update(executor.submit(run_task, task) for task in tasks)
+                    if not running:
+                        if options['once']:
+                            break
+                        # 常驻进程中定期关闭失效的数据库连接，避免连接被服务端断开后报错
+                        close_old_connections()
+                        time.sleep(options['interval'])
+                        continue
+                    done, running = wait(running, timeout=options['interval'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.result():
+                            succeeded += 1
+                        else:
+                            failed += 1
+            except KeyboardInterrupt:
+                self.stdout.write('正在等待执行中的任务完成...')
+        self.stdout.write(f'成功 {succeeded} 个任务，失败 {failed} 个任务')
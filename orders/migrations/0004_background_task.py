@@ -0,0 +1,33 @@
+# Generated by Django 4.2.11 on 2026-10-18 05:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_user_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='任务名称')),
+                ('payload', models.JSONField(default=dict, verbose_name='参数')),
+                ('status', models.CharField(choices=[('pending', '等待执行'), ('running', '执行中'), ('failed', '已失败')], default='pending', max_length=10, verbose_name='状态')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='执行次数')),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5, verbose_name='最多执行次数')),
+                ('run_at', models.DateTimeField(verbose_name='执行时间')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='领取时间')),
+                ('last_error', models.TextField(blank=True, verbose_name='错误信息')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '后台任务',
+                'verbose_name_plural': '后台任务',
+                'indexes': [models.Index(fields=['status', 'run_at'], name='task_status_run_at')],
+            },
+        ),
+    ]
@@ -43,6 +43,10 @@ class Order(models.Model):
         verbose_name_plural = "订单"
         # 按创建时间降序排序（最新的订单在前）
         ordering = ['-created_at']
+        indexes = [
+            # 订单历史按用户筛选、按 (created_at, id) 键集分页
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created'),
+        ]
 
     def __str__(self):
         """对象的字符串表示
@@ -87,4 +91,75 @@ class OrderItem(models.Model):
         """计算订单项目的小计金额
         数量乘以购买价格
         """
-        return self.quantity * self.price
\ No newline at end of file
+        return self.quantity * self.price
+
+class CheckoutRequest(models.Model):
+    """结算请求记录
+    结算表单携带一次性的请求键，订单创建时在同一事务中写入本表。
+    重复提交（双击、客户端重试）时按 (用户, 请求键) 唯一索引查到已创建的订单直接返回，不再执行结算事务
+    """
+    # 提交结算的用户
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='checkout_requests', verbose_name="用户")
+    # 结算页面生成的请求键
+    key = models.CharField(max_length=64, verbose_name="请求键")
+    # 该请求创建的订单，订单删除时记录随之删除
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='checkout_request', verbose_name="订单")
+    # 创建时间
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    class Meta:
+        verbose_name = "结算请求"
+        verbose_name_plural = "结算请求"
+        # 同一用户的请求键唯一，同时作为重放查询的索引
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        """对象的字符串表示"""
+        return f"{self.key} -> 订单 {self.order_id}"
+
+
+class BackgroundTask(models.Model):
+    """后台任务队列
+    事务提交后由 orders.tasks.enqueue 写入，python manage.py run_tasks 工作进程
+    用 SELECT ... FOR UPDATE SKIP LOCKED 领取后在线程池中执行，失败时按退避时间重试
+    """
+    # 任务状态（执行成功的任务直接删除）
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, '等待执行'),
+        (STATUS_RUNNING, '执行中'),
+        (STATUS_FAILED, '已失败'),
+    )
+
+    # 任务名称，对应 orders.tasks.register_task 注册的处理函数
+    name = models.CharField(max_length=100, verbose_name="任务名称")
+    # 任务参数，作为关键字参数传给处理函数
+    payload = models.JSONField(default=dict, verbose_name="参数")
+    # 任务状态
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="状态")
+    # 已执行次数
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="执行次数")
+    # 最多执行次数，达到后不再重试
+    max_attempts = models.PositiveSmallIntegerField(default=5, verbose_name="最多执行次数")
+    # 最早可执行时间，重试时推迟
+    run_at = models.DateTimeField(verbose_name="执行时间")
+    # 被工作进程领取的时间，用于回收崩溃进程遗留的任务
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name="领取时间")
+    # 最近一次失败的错误信息
+    last_error = models.TextField(blank=True, verbose_name="错误信息")
+    # 创建时间
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    class Meta:
+        verbose_name = "后台任务"
+        verbose_name_plural = "后台任务"
+        indexes = [
+            # 工作进程按状态和执行时间领取任务
+            models.Index(fields=['status', 'run_at'], name='task_status_run_at'),
+        ]
+
+    def __str__(self):
+        """对象的字符串表示"""
+        return f"{self.name}#{self.id} ({self.status})"
@@ -0,0 +1,158 @@
+"""订单服务
+
+place_order() 把已加锁的购物车转为订单，执行的SQL语句数量与购物车行数无关:
+    1. 一条查询锁定购物车项的库存预留
+    2. 按商品ID升序锁定需要修改库存的商品行，再把预留已到期归还的购物车项的差额
+       用一条分组条件UPDATE扣减（全部足够才生效）
+    3. 一条INSERT创建订单（带请求键时再写入一条结算请求记录），一条bulk_create创建全部订单项
+    4. 删除购物车项（预留随之级联删除），库存流水一次批量写入
+订单日志等后续工作在事务提交后作为后台任务（orders.tasks）执行，行锁的持有时间不随购物车大小增长。
+
+并发结算仍可能因数据库检测到死锁或锁等待超时而失败，
+retry_on_deadlock 在整个事务外层按指数退避加随机抖动有限次重试。
+"""
+# 导入functools保留被装饰函数的名称和文档
+import functools
+import logging
+# 导入random和time实现带随机抖动的重试等待
+import random
+import time
+
+from django.db import DatabaseError, connection, transaction
+
+from carts.models import CartItem, StockReservation
+from products.inventory import lock_products, release_stock_many, reserve_stock_many
+from products.models import Product, StockMovement
+from products.movements import stock_movements
+from .models import CheckoutRequest, Order, OrderItem
+from .tasks import enqueue
+
+logger = logging.getLogger(__name__)
+
+# 死锁重试的最多执行次数（含第一次）
+DEADLOCK_RETRY_ATTEMPTS = 3
+# 第一次重试前的最长等待时间（秒），之后每次翻倍，实际等待在0到该值之间随机
+DEADLOCK_RETRY_BASE_DELAY = 0.05
+# MySQL错误码: 1213 死锁，1205 锁等待超时
+RETRYABLE_MYSQL_ERRORS = (1205, 1213)
+# SQLSTATE: 40001 序列化失败，40P01 死锁（PostgreSQL等）
+RETRYABLE_SQLSTATES = ('40001', '40P01')
+
+
+def is_retryable_error(exc):
+    """判断数据库异常是否为死锁、锁等待超时或序列化失败，整个事务重新执行即可成功"""
+    if not isinstance(exc, DatabaseError):
+        return False
+    cause = exc.__cause__ or exc
+    if getattr(cause, 'pgcode', None) in RETRYABLE_SQLSTATES or getattr(cause, 'sqlstate', None) in RETRYABLE_SQLSTATES:
+        return True
+    return bool(exc.args) and exc.args[0] in RETRYABLE_MYSQL_ERRORS
+
+
+def retry_on_deadlock(func):
+    """事务函数的装饰器: 遇到死锁等可重试错误时重新执行整个事务
+
+    必须装饰在 transaction.atomic 外层，重试前事务已整体回滚；
+    在外层事务中调用时不重试（只重试内层没有意义），异常直接抛给调用方。
+    最多执行 DEADLOCK_RETRY_ATTEMPTS 次，两次之间按指数退避并加入随机抖动，
+    避免互相冲突的请求在同一时刻再次冲突。
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(1, DEADLOCK_RETRY_ATTEMPTS + 1):
+            try:
+                return func(*args, **kwargs)
+            except DatabaseError as exc:
+                if connection.in_atomic_block or attempt == DEADLOCK_RETRY_ATTEMPTS or not is_retryable_error(exc):
+                    raise
+                delay = random.uniform(0, DEADLOCK_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+                logger.warning(f'{func.__name__} 第 {attempt} 次执行遇到可重试的数据库错误: {exc}，{delay:.3f} 秒后重试')
+                time.sleep(delay)
+    return wrapper
+
+
+def place_order(user, cart_items, full_name, phone, address, request_key=None):
+    """用购物车创建订单并清空购物车（需在事务中调用，cart_items应已加锁）
+
+    加入购物车时已通过库存预留扣减库存；预留被清理任务归还的购物车项在这里按差额重新扣减。
+
+    参数:
+        user: 下单用户
+        cart_items: 已加锁的购物车项列表（带line_total小计并预加载商品）
+        full_name: 收件人姓名
+        phone: 联系电话
+        address: 收货地址
+        request_key: 结算表单的请求键；已被使用时抛出IntegrityError，本函数的修改全部回滚
+
+    返回:
+        (订单, 库存不足的购物车项列表)；库存不足时订单为None，本函数的修改全部回滚
+    """
+    cart_items = list(cart_items)
+    # 保存点: 库存不足时只回滚本函数的修改
+    with transaction.atomic(), stock_movements(StockMovement.REASON_CHECKOUT) as movements:
+        # 按商品汇总已预留数量与购物车数量的差额
+        reserved = dict(
+            StockReservation.objects.select_for_update()
+            .filter(cart_item_id__in=[item.id for item in cart_items])
+            .values_list('cart_item_id', 'quantity')
+        )
+        to_reserve, to_release = {}, {}
+        for item in cart_items:
+            difference = item.quantity - reserved.get(item.id, 0)
+            if difference > 0:
+                to_reserve[item.product_id] = to_reserve.get(item.product_id, 0) + difference
+            elif difference < 0:
+                to_release[item.product_id] = to_release.get(item.product_id, 0) - difference
+
+        # 先按ID升序锁定要修改库存的商品，并发结算按相同顺序加锁，不会互相死锁
+        lock_products(to_reserve.keys() | to_release.keys())
+        # 一条条件UPDATE扣减全部差额，任一商品库存不足时不做任何修改
+        if not reserve_stock_many(to_reserve):
+            return None, _short_items(cart_items, to_reserve)
+        release_stock_many(to_release)
+
+        total_price = sum(item.line_total for item in cart_items)
+        order = Order.objects.create(
+            user=user,
+            full_name=full_name,
+            phone=phone,
+            address=address,
+            total_price=total_price,  # 直接使用购物车计算的正确金额
+            status='pending'  # 初始状态为待付款
+        )
+        movements.ref_id = order.id
+        if request_key:
+            # (用户, 请求键) 唯一索引保证同一次提交只能创建一个订单
+            CheckoutRequest.objects.create(user=user, key=request_key, order=order)
+
+        # 一条INSERT创建全部订单项，价格使用商品的最终价格（考虑折扣）
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=item.product, price=item.product.get_final_price(), quantity=item.quantity)
+            for item in cart_items
+        ])
+
+        # 清空购物车（预留随购物车项一起删除，预留的库存随订单转为已售出）
+        CartItem.objects.filter(id__in=[item.id for item in cart_items]).delete()
+
+        # 订单日志等后续工作在事务提交后交给后台任务，结算请求不等待它们完成
+        enqueue('orders.order_created', order_id=order.id)
+    return order, []
+
+
+def find_replayed_order(user, request_key):
+    """按请求键查找已创建的订单ID（一次唯一索引查询），没有时返回None"""
+    if not request_key:
+        return None
+    return CheckoutRequest.objects.filter(user=user, key=request_key).values_list('order_id', flat=True).first()
+
+
+def _short_items(cart_items, to_reserve):
+    """找出库存不足以补足差额的购物车项（不会为空）
+
+    Product.stock只用于指出哪些商品不足: 并发归还或分片商品的展示值滞后时可能一个也找不出，
+    此时返回全部需要补扣的购物车项
+    """
+    stock = dict(Product.objects.filter(id__in=to_reserve).values_list('id', 'stock'))
+    needed = [item for item in cart_items if item.product_id in to_reserve]
+    short = [item for item in needed if stock.get(item.product_id, 0) < to_reserve[item.product_id]]
+    return short or needed
@@ -0,0 +1,150 @@
+"""后台任务队列
+
+订单创建后的日志、统计、通知等后续工作不在结算事务中同步执行，而是作为后台任务排队:
+
+    enqueue('orders.order_created', order_id=order.id)
+
+enqueue 通过 transaction.on_commit 在事务提交后才写入BackgroundTask表，
+事务回滚时任务不会产生；结算请求在订单提交后立即返回。
+
+python manage.py run_tasks 工作进程循环领取到期的任务（SELECT ... FOR UPDATE SKIP LOCKED，
+多个工作进程不会领到同一任务），在线程池中执行:
+- 成功的任务直接删除
+- 失败的任务按指数退避加随机抖动推迟后重试，达到最多执行次数后标记为已失败并保留错误信息
+- 领取后长时间未完成的任务（工作进程崩溃）会被重新领取
+
+任务处理函数用 register_task 注册，必须是可重复执行的（同一任务可能因重试执行多次）。
+"""
+import logging
+# 导入random为重试时间加入随机抖动
+import random
+# 导入traceback记录失败任务的错误堆栈
+import traceback
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import BackgroundTask, Order
+
+logger = logging.getLogger(__name__)
+
+# 第一次重试前的等待时间（秒），之后每次翻倍
+RETRY_BASE_DELAY = 10
+# 重试等待时间的上限（秒）
+RETRY_MAX_DELAY = 3600
+# 领取后超过这么多秒仍未完成的任务视为工作进程已崩溃，可被重新领取
+TASK_TIMEOUT = 600
+
+# 已注册的任务: 任务名称 -> 处理函数
+_registry = {}
+
+
+def register_task(name):
+    """注册任务处理函数的装饰器
+
+    参数:
+        name: 任务名称，按"应用.动作"命名，如 orders.order_created
+    """
+    def decorator(func):
+        _registry[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, max_attempts=5, delay=0, **payload):
+    """在当前事务提交后把任务加入队列（不在事务中时立即写入）
+
+    参数:
+        name: 已注册的任务名称
+        max_attempts: 最多执行次数
+        delay: 延迟多少秒后才可被领取执行
+        payload: 传给处理函数的关键字参数，必须可以JSON序列化
+    """
+    if name not in _registry:
+        raise ValueError(f'未注册的后台任务: {name}')
+    run_at = timezone.now() + timedelta(seconds=delay)
+
+    def create_task():
+        BackgroundTask.objects.create(name=name, payload=payload, max_attempts=max_attempts, run_at=run_at)
+
+    # robust: 事务已提交（如订单已创建），写入任务失败只由Django记录错误日志，不让请求返回错误
+    # （Django记录日志时使用回调的__qualname__，因此不能用functools.partial）
+    transaction.on_commit(create_task, robust=True)
+
+
+def claim_tasks(limit):
+    """领取最多limit个到期的任务并标记为执行中
+
+    返回:
+        领取到的BackgroundTask列表
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        tasks = list(
+            BackgroundTask.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=BackgroundTask.STATUS_PENDING, run_at__lte=now)
+                | Q(status=BackgroundTask.STATUS_RUNNING, locked_at__lt=now - timedelta(seconds=TASK_TIMEOUT))
+            )
+            .order_by('run_at')[:limit]
+        )
+        if tasks:
+            BackgroundTask.objects.filter(id__in=[task.id for task in tasks]).update(
+                status=BackgroundTask.STATUS_RUNNING, locked_at=now,
+            )
+    return tasks
+
+
+def run_task(task):
+    """执行一个已领取的任务并记录结果（在工作线程中调用）
+
+    返回:
+        成功返回True，失败返回False
+    """
+    # 工作线程各自使用数据库连接，执行前后关闭失效的连接
+    close_old_connections()
+    attempts = task.attempts + 1
+    try:
+        handler = _registry.get(task.name)
+        if handler is None:
+            raise LookupError(f'未注册的后台任务: {task.name}')
+        handler(**task.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if attempts >= task.max_attempts:
+            logger.error(f'后台任务 {task} 第 {attempts} 次执行失败，不再重试:\n{error}')
+            status, run_at = BackgroundTask.STATUS_FAILED, task.run_at
+        else:
+            delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+            # 加入随机抖动，避免同时失败的任务在同一时刻重试
+            delay = random.uniform(delay / 2, delay)
+            logger.warning(f'后台任务 {task} 第 {attempts} 次执行失败，{delay:.0f} 秒后重试:\n{error}')
+            status, run_at = BackgroundTask.STATUS_PENDING, timezone.now() + timedelta(seconds=delay)
+        BackgroundTask.objects.filter(id=task.id).update(
+            status=status, attempts=attempts, run_at=run_at, locked_at=None, last_error=error,
+        )
+        return False
+    else:
+        BackgroundTask.objects.filter(id=task.id).delete()
+        return True
+    finally:
+        close_old_connections()
+
+
+@register_task('orders.order_created')
+def order_created(order_id):
+    """订单创建后的后续工作: 记录订单日志（之后的通知、统计在这里追加）"""
+    order = (
+        Order.objects.filter(id=order_id).select_related('user')
+        .annotate(item_count=Count('items'), quantity_total=Sum('items__quantity'))
+        .first()
+    )
+    if order is None:
+        # 订单已被删除，无需处理
+        return
+    logger.info(
+        f'用户 {order.user.username} 创建订单 {order.id} 成功，'
+        f'总金额: {order.total_price}, 商品行数: {order.item_count}, 商品件数: {order.quantity_total}'
+    )
@@ -1,3 +1,380 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+import json
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.test import Client, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from carts.models import CartItem
+from products.facets import get_facet_counts
+from products.models import Category, Product, StockMovement, StockShard
+from .models import BackgroundTask, CheckoutRequest, Order, OrderItem
+from .services import place_order
+from .tasks import RETRY_BASE_DELAY, TASK_TIMEOUT, claim_tasks, enqueue, register_task, run_task
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """并发结算测试
+
+    多个用户的购物车都包含同样的两个商品（加入顺序相反），库存不足以满足所有人，
+    预留均已到期归还，结算时必须重新扣减库存。
+    在多个线程中同时提交结算，断言库存不会超卖、成功的订单数与库存一致。
+    需要支持行锁的数据库（MySQL），SQLite下跳过。
+    """
+    # 参与结算的用户数
+    BUYERS = 12
+    # 每个商品的库存
+    STOCK = 5
+
+    def setUp(self):
+        category = Category.objects.create(name='抢购', slug='flash', is_active=True)
+        self.products = [
+            Product.objects.create(
+                name=f'商品{index}', slug=f'flash-{index}', category=category,
+                price=Decimal('10.00'), stock=self.STOCK, is_active=True,
+            )
+            for index in range(2)
+        ]
+        self.users = []
+        for index in range(self.BUYERS):
+            user = User.objects.create_user(f'buyer{index}', password='password')
+            # 一半用户先加第一个商品，另一半先加第二个商品，结算时涉及的商品顺序不同
+            products = self.products if index % 2 else self.products[::-1]
+            for product in products:
+                CartItem.objects.create(user=user, product=product, quantity=1)
+            self.users.append(user)
+
+    def _checkout(self, user, barrier):
+        """在独立线程中以指定用户提交结算，返回响应状态码"""
+        client = Client()
+        client.force_login(user)
+        try:
+            barrier.wait()
+            response = client.post('/orders/checkout/', {
+                'full_name': user.username,
+                'phone': '13800000000',
+                'address': '测试地址',
+            })
+            return response.status_code
+        finally:
+            # 每个线程使用自己的数据库连接，结束时关闭
+            connection.close()
+
+    def test_parallel_checkouts_do_not_oversell(self):
+        barrier = threading.Barrier(self.BUYERS)
+        with ThreadPoolExecutor(max_workers=self.BUYERS) as executor:
+            statuses = list(executor.map(lambda user: self._checkout(user, barrier), self.users))
+
+        # 每个请求都正常结束（成功重定向到订单或库存不足重定向到购物车），没有未处理的死锁
+        self.assertEqual(statuses, [302] * self.BUYERS)
+        for product in self.products:
+            product.refresh_from_db()
+            sold = sum(OrderItem.objects.filter(product=product).values_list('quantity', flat=True))
+            self.assertGreaterEqual(product.stock, 0)
+            self.assertEqual(sold + product.stock, self.STOCK)
+        # 库存只够STOCK个用户，每个订单同时包含两个商品
+        self.assertEqual(Order.objects.count(), self.STOCK)
+        self.assertEqual(OrderItem.objects.count(), self.STOCK * 2)
+
+
+class CheckoutTests(TestCase):
+    """结算: 创建订单、扣减库存、重复提交幂等"""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='手机', slug='phones', is_active=True)
+        self.products = [
+            Product.objects.create(
+                name=f'手机{index}', slug=f'phone-{index}', category=category,
+                price=Decimal('100.00'), stock=5, is_active=True,
+            )
+            for index in range(6)
+        ]
+        self.user = User.objects.create_user('buyer', password='password')
+        self.client.force_login(self.user)
+
+    def add_to_cart(self, products, quantity=2):
+        """通过批量接口加入购物车（同时预留库存）"""
+        operations = [{'op': 'add', 'product_id': product.id, 'quantity': quantity} for product in products]
+        response = self.client.post(
+            '/cart/batch/', json.dumps({'operations': operations}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def checkout_data(self):
+        """打开结算页面，取得表单中生成的请求键"""
+        response = self.client.get('/orders/checkout/')
+        self.assertEqual(response.status_code, 200)
+        return {
+            'full_name': '买家',
+            'phone': '13800000000',
+            'address': '测试地址',
+            'checkout_key': response.context['form'].initial['checkout_key'],
+        }
+
+    def test_checkout_creates_order(self):
+        self.add_to_cart(self.products[:2])
+        data = self.checkout_data()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/orders/checkout/', data)
+
+        order = Order.objects.get(user=self.user)
+        self.assertRedirects(response, f'/orders/{order.id}/', fetch_redirect_response=False)
+        self.assertEqual(order.total_price, Decimal('400.00'))
+        self.assertEqual(
+            sorted(order.items.values_list('product_id', 'quantity')),
+            [(self.products[0].id, 2), (self.products[1].id, 2)],
+        )
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+        # 库存在加入购物车时已扣减，结算不重复扣减
+        stock = Product.objects.filter(id__in=[product.id for product in self.products[:2]]).order_by('id')
+        self.assertEqual(list(stock.values_list('stock', flat=True)), [3, 3])
+        # 订单日志在事务提交后作为后台任务排队
+        task = BackgroundTask.objects.get()
+        self.assertEqual((task.name, task.payload), ('orders.order_created', {'order_id': order.id}))
+
+    def test_repeated_submit_returns_same_order(self):
+        self.add_to_cart(self.products[:1])
+        data = self.checkout_data()
+        first = self.client.post('/orders/checkout/', data)
+        # 购物车已清空，重复提交同一表单仍然指向第一次创建的订单
+        self.add_to_cart(self.products[1:2])
+        second = self.client.post('/orders/checkout/', data)
+
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(first['Location'], second['Location'])
+        self.assertEqual(CheckoutRequest.objects.get(user=self.user, key=data['checkout_key']).order, order)
+        # 第二次提交没有执行结算，后来加入的商品仍在购物车中
+        remaining = CartItem.objects.filter(user=self.user).values_list('product_id', flat=True)
+        self.assertEqual(list(remaining), [self.products[1].id])
+
+    def test_expired_reservation_without_stock_fails(self):
+        # 预留已到期归还，其他人买走了全部库存
+        CartItem.objects.create(user=self.user, product=self.products[0], quantity=2)
+        Product.objects.filter(id=self.products[0].id).update(stock=1)
+        response = self.client.post('/orders/checkout/', self.checkout_data())
+
+        self.assertRedirects(response, '/cart/', fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 2)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 1)
+
+    def test_stale_sharded_stock_reports_shortage(self):
+        # 分片已空，但Product.stock展示值尚未同步
+        product = self.products[0]
+        Product.objects.filter(id=product.id).update(stock=100, stock_shard_count=2)
+        StockShard.objects.bulk_create([StockShard(product=product, shard=shard, stock=0) for shard in range(2)])
+        CartItem.objects.create(user=self.user, product=product, quantity=1)
+        response = self.client.post('/orders/checkout/', self.checkout_data())
+
+        self.assertRedirects(response, '/cart/', fetch_redirect_response=False)
+        self.assertEqual(
+            [str(message) for message in get_messages(response.wsgi_request)],
+            [f'{product.name} 库存不足，请减少购买数量'],
+        )
+        self.assertFalse(Order.objects.exists())
+
+    def place_order_queries(self, products):
+        """以指定商品组成的购物车调用place_order，返回执行的SQL语句数"""
+        CartItem.objects.filter(user=self.user).delete()
+        self.add_to_cart(products, quantity=1)
+        with CaptureQueriesContext(connection) as queries, transaction.atomic():
+            cart_items = list(CartItem.objects.filter(user=self.user).with_totals().select_for_update())
+            order, short_items = place_order(self.user, cart_items, '买家', '13800000000', '测试地址')
+        self.assertIsNotNone(order)
+        self.assertEqual(order.items.count(), len(products))
+        return len(queries)
+
+    def test_place_order_query_count_does_not_grow_with_cart(self):
+        self.assertEqual(self.place_order_queries(self.products[:2]), self.place_order_queries(self.products[2:]))
+
+
+class OrderCancelTests(TestCase):
+    """取消订单: 归还库存、更新时间和分面计数，重复取消不重复归还"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='手机', slug='phones', is_active=True)
+        # 最后一件已被下单，商品已售罄
+        self.product = Product.objects.create(
+            name='手机A', slug='phone-a', category=self.category,
+            price=Decimal('999.00'), stock=0, is_active=True,
+        )
+        self.user = User.objects.create_user('buyer', password='password')
+        self.order = Order.objects.create(
+            user=self.user, full_name='买家', phone='13800000000', address='测试地址',
+            total_price=Decimal('999.00'), status='pending',
+        )
+        OrderItem.objects.create(order=self.order, product=self.product, price=Decimal('999.00'), quantity=1)
+        self.client.force_login(self.user)
+
+    def cancel(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/orders/{self.order.id}/cancel/')
+
+    def in_stock_count(self):
+        queryset = Product.objects.filter(category=self.category, is_active=True)
+        return get_facet_counts(queryset, self.category)['in_stock']
+
+    def test_cancel_restores_stock(self):
+        self.assertEqual(self.in_stock_count(), 0)
+        updated_at = self.order.updated_at
+
+        response = self.cancel()
+        self.assertRedirects(response, f'/orders/{self.order.id}/', fetch_redirect_response=False)
+        self.order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(self.order.status, 'cancelled')
+        self.assertGreater(self.order.updated_at, updated_at)
+        self.assertEqual(self.product.stock, 1)
+        self.assertEqual(
+            list(StockMovement.objects.values_list('product_id', 'delta', 'reason', 'ref_id')),
+            [(self.product.id, 1, StockMovement.REASON_ORDER_CANCEL, self.order.id)],
+        )
+        # 商品恢复有货，分面计数随之更新
+        self.assertEqual(self.in_stock_count(), 1)
+
+    def test_cancel_twice_restores_stock_once(self):
+        self.cancel()
+        response = self.cancel()
+        self.assertRedirects(response, f'/orders/{self.order.id}/', fetch_redirect_response=False)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+        self.assertEqual(StockMovement.objects.filter(reason=StockMovement.REASON_ORDER_CANCEL).count(), 1)
+
+
+class OrderPageQueryTests(TestCase):
+    """订单列表和详情页的查询数量不随订单数和订单项数增长"""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='手机', slug='phones', is_active=True)
+        self.products = [
+            Product.objects.create(
+                name=f'手机{index}', slug=f'phone-{index}', category=category,
+                price=Decimal('100.00'), stock=5, is_active=True,
+            )
+            for index in range(4)
+        ]
+        self.user = User.objects.create_user('buyer', password='password')
+        self.client.force_login(self.user)
+        # 先请求一次，填充购物车摘要、分类等缓存，只比较与订单相关的查询
+        self.client.get('/orders/')
+
+    def create_order(self, products):
+        """创建包含指定商品的订单"""
+        order = Order.objects.create(
+            user=self.user, full_name='买家', phone='13800000000', address='测试地址',
+            total_price=Decimal('100.00') * len(products), status='pending',
+        )
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, product=product, price=product.price, quantity=1) for product in products]
+        )
+        return order
+
+    def page_queries(self, url):
+        """请求页面，返回执行的SQL语句数"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_order_list_query_count_does_not_grow_with_orders(self):
+        self.create_order(self.products[:1])
+        single = self.page_queries('/orders/')
+        for index in range(3):
+            self.create_order(self.products[index:])
+        self.assertEqual(self.page_queries('/orders/'), single)
+
+    def test_order_detail_query_count_does_not_grow_with_items(self):
+        small = self.create_order(self.products[:1])
+        large = self.create_order(self.products)
+        self.assertEqual(self.page_queries(f'/orders/{large.id}/'), self.page_queries(f'/orders/{small.id}/'))
+
+
+@register_task('tests.flaky')
+def flaky_task(fail=True):
+    """测试用任务: fail为True时抛出异常"""
+    if fail:
+        raise RuntimeError('任务执行失败')
+
+
+class TaskQueueTests(TestCase):
+    """后台任务队列: 入队、领取、重试"""
+
+    def test_enqueue_failure_does_not_break_request(self):
+        with mock.patch.object(BackgroundTask.objects, 'create', side_effect=DatabaseError('写入失败')):
+            with self.assertLogs(level='ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    enqueue('tests.flaky', fail=False)
+        self.assertFalse(BackgroundTask.objects.exists())
+
+    def create_task(self, fail=True, max_attempts=5, **fields):
+        """直接写入一个任务（测试不在事务提交后入队）"""
+        fields.setdefault('run_at', timezone.now())
+        return BackgroundTask.objects.create(
+            name='tests.flaky', payload={'fail': fail}, max_attempts=max_attempts, **fields,
+        )
+
+    def test_claim_marks_due_tasks_running(self):
+        task = self.create_task()
+        self.create_task(run_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual([claimed.id for claimed in claim_tasks(10)], [task.id])
+        task.refresh_from_db()
+        self.assertEqual(task.status, BackgroundTask.STATUS_RUNNING)
+        self.assertIsNotNone(task.locked_at)
+        # 执行中的任务不会被再次领取
+        self.assertEqual(claim_tasks(10), [])
+
+    def test_timed_out_task_is_reclaimed(self):
+        task = self.create_task(
+            status=BackgroundTask.STATUS_RUNNING,
+            locked_at=timezone.now() - timedelta(seconds=TASK_TIMEOUT - 60),
+        )
+        self.assertEqual(claim_tasks(10), [])
+        BackgroundTask.objects.filter(id=task.id).update(
+            locked_at=timezone.now() - timedelta(seconds=TASK_TIMEOUT + 60),
+        )
+        self.assertEqual([claimed.id for claimed in claim_tasks(10)], [task.id])
+
+    def test_successful_task_is_deleted(self):
+        self.create_task(fail=False)
+        [task] = claim_tasks(10)
+        self.assertTrue(run_task(task))
+        self.assertFalse(BackgroundTask.objects.exists())
+
+    def test_failed_task_retries_until_max_attempts(self):
+        self.create_task(max_attempts=3)
+        for attempt in range(1, 3):
+            [task] = claim_tasks(10)
+            with self.assertLogs('orders.tasks', level='WARNING'):
+                self.assertFalse(run_task(task))
+            task.refresh_from_db()
+            self.assertEqual((task.status, task.attempts), (BackgroundTask.STATUS_PENDING, attempt))
+            self.assertIsNone(task.locked_at)
+            self.assertIn('任务执行失败', task.last_error)
+            # 指数退避加随机抖动，等待时间在[delay/2, delay]之间
+            delay = (task.run_at - timezone.now()).total_seconds()
+            self.assertGreater(delay, RETRY_BASE_DELAY * 2 ** (attempt - 1) / 2 - 5)
+            self.assertLessEqual(delay, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            self.assertEqual(claim_tasks(10), [])
+            BackgroundTask.objects.filter(id=task.id).update(run_at=timezone.now())
+
+        [task] = claim_tasks(10)
+        with self.assertLogs('orders.tasks', level='ERROR'):
+            self.assertFalse(run_task(task))
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (BackgroundTask.STATUS_FAILED, 3))
+        self.assertIn('任务执行失败', task.last_error)
+        # 已失败的任务不再被领取
+        self.assertEqual(claim_tasks(10), [])
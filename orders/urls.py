@@ -5,4 +5,5 @@ urlpatterns = [
     path('checkout/', views.checkout, name='checkout'),
     path('', views.order_list, name='order_list'),
     path('<int:order_id>/', views.order_detail, name='order_detail'),
+    path('<int:order_id>/cancel/', views.order_cancel, name='order_cancel'),
 ]
\ No newline at end of file
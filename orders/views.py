@@ -1,14 +1,27 @@
 from django.db import transaction, IntegrityError
+from django.db.models import Count, Prefetch, Sum
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.utils import timezone
+from django.views.decorators.http import require_POST
 from django import forms
+from carts.cart import DatabaseCart
 from carts.models import CartItem
+from products.inventory import release_stock_many
+from products.models import StockMovement
+from products.movements import stock_movements
+from products.pagination import KeysetPaginator
 from .models import Order, OrderItem
+from .services import find_replayed_order, is_retryable_error, place_order, retry_on_deadlock
 import logging
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# 订单历史每页显示的订单数量
+ORDERS_PER_PAGE = 10
+
 class CheckoutForm(forms.Form):
     """结算表单类
     用于验证用户的收货信息
@@ -19,6 +32,8 @@ class CheckoutForm(forms.Form):
     phone = forms.CharField(max_length=20, label="联系电话")
     # 收货地址，使用Textarea小部件允许多行输入
     address = forms.CharField(widget=forms.Textarea, label="收货地址")
+    # 请求键，结算页面渲染时生成，重复提交同一表单时据此返回已创建的订单
+    checkout_key = forms.CharField(widget=forms.HiddenInput, max_length=64, required=False)
 
     def clean_phone(self):
         """自定义电话号码验证
@@ -30,13 +45,24 @@ class CheckoutForm(forms.Form):
         return phone
 
 
+def _redirect_replayed(request):
+    """POST携带的请求键已创建过订单时，重定向到该订单；否则返回None"""
+    order_id = find_replayed_order(request.user, request.POST.get('checkout_key'))
+    if order_id is None:
+        return None
+    messages.info(request, '订单已提交，请勿重复提交')
+    return redirect('order_detail', order_id=order_id)
+
+
 @login_required
-@transaction.atomic
 def checkout(request):
     """结算页面视图
 
-    处理用户的订单创建流程，包括库存检查、表单验证、订单创建、
-    库存扣减和购物车清空等操作
+    处理用户的订单创建流程，包括表单验证、订单创建和购物车清空等操作
+    库存在加入购物车时已通过库存预留扣减，结算时只为预留已到期归还的购物车项重新扣减，
+    订单创建由 orders.services.place_order 批量完成
+
+    表单中的请求键使重复提交幂等: 已创建过订单的请求键直接重定向到该订单，不再执行结算事务
 
     参数:
         request: HTTP请求对象
@@ -44,28 +70,36 @@ def checkout(request):
     返回:
         渲染后的结算页面或重定向到其他页面
     """
-    # 加行级锁，防止并发库存问题
-    # select_related('product')用于提前加载关联的product对象，减少数据库查询
-    cart_items = CartItem.objects.filter(user=request.user).select_related('product').select_for_update()
+    if request.method == 'POST':
+        replayed = _redirect_replayed(request)
+        if replayed is not None:
+            return replayed
+    return _checkout(request)
+
 
-    # 检查购物车是否为空
-    if not cart_items.exists():
+@retry_on_deadlock
+@transaction.atomic
+def _checkout(request):
+    """结算事务: 锁定购物车、校验表单并创建订单（遇到死锁时整体重试）"""
+    # 加行级锁，防止同一购物车被并发重复结算
+    # with_totals()预加载关联的product对象并在数据库中计算每行小计，一条查询取回整个购物车
+    cart_items = CartItem.objects.filter(user=request.user).with_totals().select_for_update()
+
+    # 检查购物车是否为空（同时执行查询并缓存结果）
+    if not cart_items:
+        # 并发的重复提交在等待购物车锁期间，第一次提交已创建订单并清空了购物车
+        replayed = _redirect_replayed(request) if request.method == 'POST' else None
+        if replayed is not None:
+            return replayed
         messages.warning(request, '您的购物车是空的')
         return redirect('cart_detail')
 
-    # 检查每个商品的库存是否足够
-    for item in cart_items:
-        if item.quantity > item.product.stock:
-            messages.error(
-                request,
-                f'{item.product.name} 库存不足（当前库存: {item.product.stock}），请减少购买数量'
-            )
-            return redirect('cart_detail')
+    # 加入购物车时库存已经通过库存预留扣减，这里不再和商品剩余库存比较
 
-    # 计算订单总金额
-    total_price = sum(item.get_total_price() for item in cart_items)
-    # 初始化结算表单
-    form = CheckoutForm()
+    # 计算订单总金额，直接累加已加锁读取的各行小计，不再单独查询
+    total_price = sum(item.line_total for item in cart_items)
+    # 初始化结算表单，生成本次结算的请求键
+    form = CheckoutForm(initial={'checkout_key': uuid.uuid4().hex})
 
     # 处理POST请求
     if request.method == 'POST':
@@ -81,48 +115,29 @@ def checkout(request):
             })
 
         try:
-            # 获取表单数据
-            full_name = form.cleaned_data['full_name']
-            phone = form.cleaned_data['phone']
-            address = form.cleaned_data['address']
-
-            # 创建订单
-            order = Order.objects.create(
-                user=request.user,
-                full_name=full_name,
-                phone=phone,
-                address=address,
-                total_price=total_price,  # 直接使用购物车计算的正确金额
-                status='pending'  # 初始状态为待付款
+            # 创建订单、订单项并清空购物车，语句数量与购物车行数无关
+            order, short_items = place_order(
+                request.user,
+                cart_items,
+                full_name=form.cleaned_data['full_name'],
+                phone=form.cleaned_data['phone'],
+                address=form.cleaned_data['address'],
+                request_key=form.cleaned_data['checkout_key'],
             )
-            logger.info(
-                f'用户 {request.user.username} 创建订单 {order.id} 成功，'
-                f'总金额: {total_price}, 商品数量: {len(cart_items)}'
-            )
-
-            # 创建订单项并扣减库存
-            for item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item.product,
-                    price=item.product.get_final_price(),  # 使用商品的最终价格（考虑折扣）
-                    quantity=item.quantity
-                )
-
-                # 扣减库存
-                item.product.stock -= item.quantity
-                item.product.save()
-                logger.info(
-                    f'商品 {item.product.name} 库存更新: {item.product.stock + item.quantity} → {item.product.stock}'
-                )
-
-            # 清空购物车
-            cart_items.delete()
+            if order is None:
+                names = '、'.join(item.product.name for item in short_items)
+                messages.error(request, f'{names} 库存不足，请减少购买数量')
+                return redirect('cart_detail')
+            DatabaseCart(request.user, request.session).refresh_summary()
 
             messages.success(request, '订单创建成功，请尽快付款')
             return redirect('order_detail', order_id=order.id)
 
         except IntegrityError as e:
+            # 请求键已被并发的同一提交使用（订单创建已整体回滚），返回那次提交创建的订单
+            replayed = _redirect_replayed(request)
+            if replayed is not None:
+                return replayed
             if "Duplicate entry" in str(e) and "PRIMARY" in str(e):
                 # 处理主键冲突（自增序列异常）
                 logger.error(
@@ -136,6 +151,9 @@ def checkout(request):
                 messages.error(request, '创建订单失败，请刷新页面重试')
             return redirect('checkout')
         except Exception as e:
+            # 死锁等可重试错误交给retry_on_deadlock回滚后重新执行整个事务
+            if is_retryable_error(e):
+                raise
             # 处理其他异常
             logger.error(f'订单创建失败: {str(e)}, 用户: {request.user.username}', exc_info=True)
             messages.error(request, '系统错误，请稍后重试')
@@ -155,7 +173,8 @@ def checkout(request):
 def order_list(request):
     """订单列表视图
 
-    显示当前登录用户的所有订单
+    分页显示当前登录用户的订单，每页的查询数量固定:
+    一条查询取当前页订单并在数据库中统计商品行数和件数，一条查询预加载这些订单的订单项及商品
 
     参数:
         request: HTTP请求对象
@@ -163,16 +182,22 @@ def order_list(request):
     返回:
         渲染后的订单列表页面
     """
-    # 获取当前用户的所有订单，按创建时间降序排序
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = (
+        Order.objects.filter(user=request.user)
+        .annotate(item_count=Count('items'), quantity_total=Sum('items__quantity'))
+        .prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+    )
+    # 键集分页，按创建时间降序（最新的订单在前）
+    paginator = KeysetPaginator(orders, ordering=('-created_at', '-id'), per_page=ORDERS_PER_PAGE)
+    page = paginator.page_from_request(request)
     # 渲染模板并返回响应
-    return render(request, 'orders_list.html', {'orders': orders})
+    return render(request, 'orders_list.html', {'orders': page, 'page': page})
 
 @login_required
 def order_detail(request, order_id):
     """订单详情视图
 
-    显示指定订单的详细信息和订单项
+    显示指定订单的详细信息和订单项，订单项与商品一条查询取回，查询数量与商品行数无关
 
     参数:
         request: HTTP请求对象
@@ -183,7 +208,43 @@ def order_detail(request, order_id):
     """
     # 获取指定ID的订单，如果不存在则返回404错误
     order = get_object_or_404(Order, id=order_id, user=request.user)
-    # 获取该订单的所有订单项
-    order_items = OrderItem.objects.filter(order=order)
+    # 获取该订单的所有订单项，同时加载商品供模板显示名称和链接
+    order_items = OrderItem.objects.filter(order=order).select_related('product')
     # 渲染模板并返回响应
-    return render(request, 'orders_detail.html', {'order': order, 'order_items': order_items})
\ No newline at end of file
+    return render(request, 'orders_detail.html', {'order': order, 'order_items': order_items})
+
+@login_required
+@require_POST
+@transaction.atomic
+def order_cancel(request, order_id):
+    """取消订单视图
+
+    只能取消待付款的订单，取消后订单中的商品库存用一条UPDATE全部归还
+
+    参数:
+        request: HTTP请求对象
+        order_id: 订单ID
+
+    返回:
+        重定向到订单详情页面
+    """
+    order = get_object_or_404(Order, id=order_id, user=request.user)
+    # 条件更新订单状态，并发的重复取消只有一个能成功，库存不会被重复归还
+    # 条件UPDATE不会自动更新auto_now字段，显式写入更新时间
+    cancelled = Order.objects.filter(id=order.id, status='pending').update(
+        status='cancelled', updated_at=timezone.now(),
+    )
+    if not cancelled:
+        messages.error(request, '只能取消待付款的订单')
+        return redirect('order_detail', order_id=order.id)
+
+    # 按商品汇总订单项数量，一条语句归还全部库存，并登记库存流水
+    quantities = dict(
+        OrderItem.objects.filter(order=order).values('product_id')
+        .annotate(quantity=Sum('quantity')).values_list('product_id', 'quantity')
+    )
+    with stock_movements(StockMovement.REASON_ORDER_CANCEL, ref_id=order.id):
+        release_stock_many(quantities)
+    logger.info(f'用户 {request.user.username} 取消订单 {order.id}，归还 {len(quantities)} 个商品的库存')
+    messages.success(request, '订单已取消')
+    return redirect('order_detail', order_id=order.id)
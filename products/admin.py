@@ -5,4 +5,19 @@ from django.contrib import admin
 from .models import Category, Product
 
 admin.site.register(Category)
-admin.site.register(Product)
\ No newline at end of file
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    """商品管理
+
+    库存模式由 python manage.py shard_stock 切换，分片数量不可在后台修改；
+    分片库存商品的库存在分片中，Product.stock只是定期同步的展示值，修改会被下次同步覆盖，因此只读
+    """
+    readonly_fields = ('stock_shard_count',)
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly_fields = super().get_readonly_fields(request, obj)
+        if obj is not None and obj.stock_shard_count:
+            return (*readonly_fields, 'stock')
+        return readonly_fields
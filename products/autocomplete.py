@@ -0,0 +1,183 @@
+"""搜索框自动补全
+
+在进程内维护一个按键排序的数组，对上架商品名称和分类名称做前缀匹配（bisect二分查找），
+每次按键的查询只访问内存，不访问数据库。
+
+- 索引在第一次查询时构建
+- 本进程内的商品/分类变化由信号处理器增量更新
+- 其他进程通过缓存中的版本号感知变化，版本号不连续时整体重建
+"""
+# 导入bisect进行二分查找和有序插入
+import bisect
+# 导入itertools串联分类和商品两个数据源
+import itertools
+# 导入线程锁，保证构建和更新索引时的线程安全
+import threading
+# 导入Django缓存框架
+from django.core.cache import cache
+# 导入reverse生成补全项的跳转地址
+from django.urls import reverse
+
+from .cache import get_version
+
+# 自动补全索引版本号在缓存中的键
+AUTOCOMPLETE_VERSION_KEY = 'products:autocomplete_version'
+# 默认返回的补全条数
+DEFAULT_LIMIT = 10
+
+
+def _index_keys(name):
+    """生成名称的所有索引键
+
+    除完整名称外，名称中每个单词的起始位置也作为一个键，
+    这样输入"iph"也能匹配到"Apple iPhone 15"
+    """
+    normalized = ' '.join(name.lower().split())
+    keys = [normalized]
+    for index, char in enumerate(normalized):
+        if char == ' ' and index + 1 < len(normalized):
+            keys.append(normalized[index + 1:])
+    return keys
+
+
+class PrefixIndex:
+    """有序数组前缀索引
+
+    _entries 是按 (键, 类型, id) 排序的列表，前缀查询用bisect定位第一个不小于前缀的位置，
+    再向后扫描直到键不再以该前缀开头；_items 保存每个对象的显示信息和索引键，用于增量删除。
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._items = {}
+
+    def load(self, items):
+        """批量载入对象（用于完整构建，索引应为空）
+
+        先收集全部索引项再排序一次，避免逐条有序插入时反复移动数组元素
+
+        参数:
+            items: 可迭代的 (类型, id, 显示名称, 跳转地址)
+        """
+        for kind, object_id, label, url in items:
+            keys = _index_keys(label)
+            self._items[(kind, object_id)] = {'label': label, 'type': kind, 'url': url, 'keys': keys}
+            self._entries.extend((key, kind, object_id) for key in keys)
+        self._entries.sort()
+
+    def add(self, kind, object_id, label, url):
+        """添加或更新一个对象（增量更新）"""
+        self.remove(kind, object_id)
+        keys = _index_keys(label)
+        self._items[(kind, object_id)] = {'label': label, 'type': kind, 'url': url, 'keys': keys}
+        for key in keys:
+            bisect.insort(self._entries, (key, kind, object_id))
+
+    def remove(self, kind, object_id):
+        """删除一个对象，不存在时忽略"""
+        item = self._items.pop((kind, object_id), None)
+        if item is None:
+            return
+        for key in item['keys']:
+            entry = (key, kind, object_id)
+            position = bisect.bisect_left(self._entries, entry)
+            if position < len(self._entries) and self._entries[position] == entry:
+                del self._entries[position]
+
+    def lookup(self, prefix, limit=DEFAULT_LIMIT):
+        """返回以prefix开头的对象，分类排在商品前面"""
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+        matches = {}
+        position = bisect.bisect_left(self._entries, (prefix,))
+        while position < len(self._entries) and len(matches) < limit * 2:
+            key, kind, object_id = self._entries[position]
+            if not key.startswith(prefix):
+                break
+            matches.setdefault((kind, object_id), self._items[(kind, object_id)])
+            position += 1
+        results = sorted(matches.values(), key=lambda item: (item['type'] != 'category', item['label']))
+        return [{'label': item['label'], 'type': item['type'], 'url': item['url']} for item in results[:limit]]
+
+
+class AutocompleteIndex:
+    """进程内的自动补全索引（带版本同步）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+
+    def _build(self, version):
+        """从数据库完整构建索引"""
+        # 延迟导入模型以避免循环引用问题
+        from .models import Category, Product
+        categories = Category.objects.filter(is_active=True).values_list('id', 'name', 'slug')
+        products = Product.objects.filter(is_active=True).values_list('id', 'name', 'slug')
+        index = PrefixIndex()
+        index.load(itertools.chain(
+            (
+                ('category', category_id, name, reverse('product_list_by_category', args=[slug]))
+                for category_id, name, slug in categories
+            ),
+            (
+                ('product', product_id, name, reverse('product_detail', args=[product_id, slug]))
+                for product_id, name, slug in products.iterator(chunk_size=2000)
+            ),
+        ))
+        self._index = index
+        self._version = version
+
+    def lookup(self, prefix, limit=DEFAULT_LIMIT):
+        """前缀查询；索引未构建或版本落后时先（重新）构建"""
+        version = get_version(AUTOCOMPLETE_VERSION_KEY)
+        with self._lock:
+            if self._index is None or self._version != version:
+                self._build(version)
+            return self._index.lookup(prefix, limit)
+
+    def _apply(self, update):
+        """在本进程索引上执行增量更新，并递增共享版本号通知其他进程"""
+        with self._lock:
+            try:
+                new_version = cache.incr(AUTOCOMPLETE_VERSION_KEY)
+            except ValueError:
+                new_version = None
+            if self._index is None:
+                return
+            if new_version is not None and self._version is not None and new_version == self._version + 1:
+                # 期间没有其他进程修改，增量更新后本进程保持最新
+                update(self._index)
+                self._version = new_version
+            else:
+                # 错过了其他进程的修改，下次查询时整体重建
+                self._index = None
+
+    def update_product(self, product):
+        """商品新增、修改或下架后更新索引"""
+        if product.is_active:
+            url = reverse('product_detail', args=[product.id, product.slug])
+            self._apply(lambda index: index.add('product', product.id, product.name, url))
+        else:
+            self._apply(lambda index: index.remove('product', product.id))
+
+    def remove_product(self, product_id):
+        """商品删除后更新索引"""
+        self._apply(lambda index: index.remove('product', product_id))
+
+    def update_category(self, category):
+        """分类新增、修改或停用后更新索引"""
+        if category.is_active:
+            url = reverse('product_list_by_category', args=[category.slug])
+            self._apply(lambda index: index.add('category', category.id, category.name, url))
+        else:
+            self._apply(lambda index: index.remove('category', category.id))
+
+    def remove_category(self, category_id):
+        """分类删除后更新索引"""
+        self._apply(lambda index: index.remove('category', category_id))
+
+
+# 进程内单例
+autocomplete_index = AutocompleteIndex()
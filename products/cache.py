@@ -0,0 +1,132 @@
+"""商品模块的缓存层
+
+分类数据几乎每个页面都要用到（导航栏、首页、列表页），但很少变化。
+这里把分类列表缓存在进程内存中，并在Django缓存框架里保存一个版本号:
+    - 读取时只取一次版本号（缓存读取，不访问数据库），版本未变则直接返回进程内的副本
+    - Category保存或删除时由信号处理器递增版本号，所有进程在下次读取时重新加载
+首页推荐商品区块同样按"目录版本号"缓存渲染好的HTML片段，见get_featured_products_html。
+多进程部署时，CACHES必须配置为共享缓存（Redis/Memcached），版本号才能在进程间同步。
+"""
+# 导入time用于生成初始版本号
+import time
+# 导入Django缓存框架
+from django.core.cache import cache
+# 导入模板渲染函数用于生成HTML片段
+from django.template.loader import render_to_string
+# 导入mark_safe用于标记从缓存取出的HTML片段
+from django.utils.safestring import mark_safe
+
+# 分类版本号在缓存中的键
+CATEGORY_VERSION_KEY = 'products:category_version'
+
+# 进程内的分类缓存: (版本号, 分类元组)
+_category_cache = (None, ())
+
+
+def _initial_version():
+    """生成初始版本号
+
+    使用毫秒时间戳而不是从1开始，避免缓存被清空后新版本号
+    与某个进程内仍持有的旧版本号碰巧相同
+    """
+    return int(time.time() * 1000)
+
+
+def get_version(key):
+    """读取缓存中的版本号，不存在时初始化"""
+    version = cache.get(key)
+    if version is None:
+        # add只在键不存在时写入，避免并发初始化互相覆盖
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    """递增缓存中的版本号，使依赖该版本号的缓存全部失效"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # 键不存在（被淘汰或缓存重启），重新初始化
+        cache.set(key, _initial_version(), timeout=None)
+
+
+def get_active_categories():
+    """获取所有激活的分类
+
+    返回:
+        按名称排序的分类元组；热进程上只有一次缓存读取，不访问数据库
+    """
+    global _category_cache
+    version = get_version(CATEGORY_VERSION_KEY)
+    cached_version, categories = _category_cache
+    if cached_version != version:
+        # 延迟导入模型以避免循环引用问题
+        from .models import Category
+        categories = tuple(Category.objects.filter(is_active=True))
+        # 整体替换元组，其他线程要么看到旧值要么看到新值
+        _category_cache = (version, categories)
+    return categories
+
+
+def get_active_category(slug, categories=None):
+    """按别名从缓存中查找激活的分类
+
+    参数:
+        slug: 分类的URL别名
+        categories: 已取回的激活分类，省略时调用get_active_categories获取
+
+    返回:
+        匹配的分类，不存在时返回None
+    """
+    if categories is None:
+        categories = get_active_categories()
+    for category in categories:
+        if category.slug == slug:
+            return category
+    return None
+
+
+def invalidate_categories():
+    """使分类缓存失效（所有进程）"""
+    bump_version(CATEGORY_VERSION_KEY)
+
+
+# 商品目录版本号在缓存中的键，推荐商品等目录展示数据变化时递增
+CATALOG_VERSION_KEY = 'products:catalog_version'
+# 首页推荐商品HTML片段在缓存中的键
+FEATURED_FRAGMENT_KEY = 'products:home_featured'
+# 推荐商品片段的缓存时间（秒），版本号变化会使其提前失效
+FEATURED_FRAGMENT_TIMEOUT = 60 * 60
+# 首页展示的推荐商品数量
+FEATURED_PRODUCTS_LIMIT = 8
+
+
+def get_featured_products_html():
+    """获取首页推荐商品区块的HTML
+
+    片段与生成它时的目录版本号一起缓存。读取时用get_many一次取回版本号和片段，
+    版本一致即直接返回，因此热缓存下首页推荐区块只需一次缓存往返、零数据库查询。
+
+    返回:
+        渲染好的HTML（SafeString）
+    """
+    values = cache.get_many([CATALOG_VERSION_KEY, FEATURED_FRAGMENT_KEY])
+    version = values.get(CATALOG_VERSION_KEY)
+    fragment = values.get(FEATURED_FRAGMENT_KEY)
+    if version is not None and fragment is not None and fragment[0] == version:
+        return mark_safe(fragment[1])
+
+    if version is None:
+        version = get_version(CATALOG_VERSION_KEY)
+    # 延迟导入模型以避免循环引用问题
+    from .models import Product
+    featured_products = Product.objects.filter(is_active=True, is_featured=True)[:FEATURED_PRODUCTS_LIMIT]
+    html = render_to_string('products_featured_block.html', {'featured_products': featured_products})
+    cache.set(FEATURED_FRAGMENT_KEY, (version, str(html)), FEATURED_FRAGMENT_TIMEOUT)
+    return html
+
+
+def invalidate_catalog():
+    """使依赖目录版本号的缓存失效（所有进程）"""
+    bump_version(CATALOG_VERSION_KEY)
@@ -1,5 +1,7 @@
 def categories(request):
-    """分类上下文处理器"""
-    from .models import Category
-    return {'categories': Category.objects.filter(is_active=True)}
-    
\ No newline at end of file
+    """分类上下文处理器
+
+    分类列表来自进程内缓存，热进程上不产生数据库查询
+    """
+    from .cache import get_active_categories
+    return {'categories': get_active_categories()}
@@ -0,0 +1,174 @@
+"""商品列表页的分面筛选
+
+支持三类筛选: 价格区间、仅看有货、仅看折扣。
+各分面的计数用一条带条件聚合的查询一次算出，结果按分类缓存，
+分类下商品的价格、上下架、有货状态变化时由信号处理器递增该分类的分面版本号。
+"""
+# 导入Django缓存框架
+from django.core.cache import cache
+# 导入聚合和查询条件
+from django.db.models import Count, Q
+
+from .cache import bump_version, get_version
+
+# 价格区间: (参数值, 显示名称, 下限(含), 上限(不含))
+PRICE_RANGES = (
+    ('0-100', '¥100以下', None, 100),
+    ('100-500', '¥100-500', 100, 500),
+    ('500-1000', '¥500-1000', 500, 1000),
+    ('1000-5000', '¥1000-5000', 1000, 5000),
+    ('5000-', '¥5000以上', 5000, None),
+)
+# 筛选使用的GET参数名
+PRICE_PARAM = 'price'
+IN_STOCK_PARAM = 'in_stock'
+ON_SALE_PARAM = 'on_sale'
+# 分面计数的缓存时间（秒），作为批量更新等不触发信号场景的兜底
+FACET_TIMEOUT = 10 * 60
+
+
+def _price_range_q(low, high):
+    """价格区间对应的查询条件，基于带索引的final_price冗余列"""
+    condition = Q()
+    if low is not None:
+        condition &= Q(final_price__gte=low)
+    if high is not None:
+        condition &= Q(final_price__lt=high)
+    return condition
+
+
+def compute_facets(queryset):
+    """用一条条件聚合查询计算所有分面的计数
+
+    参数:
+        queryset: 分类下的上架商品查询集
+
+    返回:
+        {'price': {区间参数值: 数量}, 'in_stock': 数量, 'on_sale': 数量, 'total': 数量}
+    """
+    aggregates = {
+        f'price_{index}': Count('id', filter=_price_range_q(low, high))
+        for index, (_, _, low, high) in enumerate(PRICE_RANGES)
+    }
+    aggregates['in_stock'] = Count('id', filter=Q(stock__gt=0))
+    aggregates['on_sale'] = Count('id', filter=Q(discount_price__gt=0))
+    aggregates['total'] = Count('id')
+    row = queryset.order_by().aggregate(**aggregates)
+    return {
+        'price': {key: row[f'price_{index}'] for index, (key, _, _, _) in enumerate(PRICE_RANGES)},
+        'in_stock': row['in_stock'],
+        'on_sale': row['on_sale'],
+        'total': row['total'],
+    }
+
+
+def facet_version_key(category_id):
+    """分类分面版本号的缓存键，category_id为None表示全部商品"""
+    return f'products:facet_version:{category_id or "all"}'
+
+
+def get_facet_counts(queryset, category=None):
+    """获取分类的分面计数（带缓存）
+
+    与首页推荐片段相同，计数和版本号一起缓存，用get_many一次取回并比较版本
+
+    参数:
+        queryset: 分类下的上架商品查询集（未应用筛选条件）
+        category: 当前分类，None表示全部商品
+    """
+    category_id = category.id if category else None
+    version_key = facet_version_key(category_id)
+    facets_key = f'products:facets:{category_id or "all"}'
+    values = cache.get_many([version_key, facets_key])
+    version = values.get(version_key)
+    cached = values.get(facets_key)
+    if version is not None and cached is not None and cached[0] == version:
+        return cached[1]
+
+    if version is None:
+        version = get_version(version_key)
+    facets = compute_facets(queryset)
+    cache.set(facets_key, (version, facets), FACET_TIMEOUT)
+    return facets
+
+
+def invalidate_facets(*category_ids):
+    """使指定分类以及全部商品的分面计数失效"""
+    for category_id in set(category_ids):
+        bump_version(facet_version_key(category_id))
+    bump_version(facet_version_key(None))
+
+
+def parse_facet_filters(params):
+    """从GET参数中解析筛选条件
+
+    返回:
+        {'price': 区间参数值或None, 'in_stock': bool, 'on_sale': bool}
+    """
+    valid_prices = {key for key, _, _, _ in PRICE_RANGES}
+    price = params.get(PRICE_PARAM)
+    return {
+        'price': price if price in valid_prices else None,
+        'in_stock': params.get(IN_STOCK_PARAM) == '1',
+        'on_sale': params.get(ON_SALE_PARAM) == '1',
+    }
+
+
+def apply_facet_filters(queryset, filters):
+    """将筛选条件应用到商品查询集"""
+    if filters['price']:
+        for key, _, low, high in PRICE_RANGES:
+            if key == filters['price']:
+                queryset = queryset.filter(_price_range_q(low, high))
+    if filters['in_stock']:
+        queryset = queryset.filter(stock__gt=0)
+    if filters['on_sale']:
+        queryset = queryset.filter(discount_price__gt=0)
+    return queryset
+
+
+def _toggle_query(params, name, value):
+    """生成切换某个筛选项后的查询字符串，同时去掉分页游标"""
+    params = params.copy()
+    for cursor_param in ('after', 'before'):
+        params.pop(cursor_param, None)
+    if params.get(name) == value:
+        params.pop(name, None)
+    else:
+        params[name] = value
+    return params.urlencode()
+
+
+def build_facet_options(params, facets, filters):
+    """生成模板使用的分面选项列表
+
+    参数:
+        params: request.GET
+        facets: get_facet_counts的返回值
+        filters: parse_facet_filters的返回值
+
+    返回:
+        [{'label', 'count', 'selected', 'query'}, ...]
+    """
+    options = [
+        {
+            'label': label,
+            'count': facets['price'][key],
+            'selected': filters['price'] == key,
+            'query': _toggle_query(params, PRICE_PARAM, key),
+        }
+        for key, label, _, _ in PRICE_RANGES
+    ]
+    options.append({
+        'label': '仅看有货',
+        'count': facets['in_stock'],
+        'selected': filters['in_stock'],
+        'query': _toggle_query(params, IN_STOCK_PARAM, '1'),
+    })
+    options.append({
+        'label': '仅看折扣',
+        'count': facets['on_sale'],
+        'selected': filters['on_sale'],
+        'query': _toggle_query(params, ON_SALE_PARAM, '1'),
+    })
+    return options
@@ -0,0 +1,376 @@
+"""库存服务
+
+所有库存变更都通过这里的函数完成，统一使用条件UPDATE语句:
+    UPDATE products_product SET stock = stock - n WHERE id = ? AND stock >= n
+库存是否足够由数据库在同一条语句中判断，以受影响行数表示成功与否，
+不需要先读出商品、在Python中修改再save()整行写回，
+并发购买同一商品时行锁只在这一条语句执行期间持有，也不可能出现超卖。
+
+分片库存模式（抢购商品）:
+    商品库存拆分到多行StockShard中，扣减时按随机顺序逐个分片尝试条件UPDATE，
+    并发请求分散在不同的行锁上；单个分片都不够时锁定全部分片合并扣减。
+    此时 Product.stock 只是各分片之和的定期同步值（每个商品最多每 STOCK_SHARD_SYNC_SECONDS 秒同步一次，
+    间隔内后续的变更由后台任务在间隔结束后补充同步，需要运行 python manage.py run_tasks），
+    用于页面展示和有货筛选。用 python manage.py shard_stock 切换商品的库存模式。
+    哪些商品启用了分片从缓存读取；普通模式的UPDATE都带有 stock_shard_count = 0 条件，
+    缓存过期前的误判只会导致更新0行，随后按数据库中的实际模式重试，不会算错库存。
+
+每次成功的扣减和归还都通过 products.movements.record_movements 登记为库存流水。
+条件UPDATE不触发post_save信号，库存在有货/缺货之间切换的商品由这里在事务提交后使分面计数失效。
+"""
+# 导入random随机选择分片
+import random
+
+from django.conf import settings
+# 导入Django缓存框架，缓存分片商品和同步节流标记
+from django.core.cache import cache
+from django.db import transaction
+# 导入F表达式，在数据库端基于当前值计算
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+# 导入timezone用于同步更新时间
+from django.utils import timezone
+
+from .facets import invalidate_facets
+from .models import Product, StockShard
+from .movements import record_movements
+
+# 分片商品 {商品ID: 分片数} 在缓存中的键
+SHARDED_PRODUCTS_KEY = 'products:sharded_products'
+# 分片商品的缓存时间（秒）
+SHARDED_PRODUCTS_TIMEOUT = 60
+
+
+def sharded_products():
+    """启用分片库存的商品 {商品ID: 分片数}（带缓存）"""
+    products = cache.get(SHARDED_PRODUCTS_KEY)
+    if products is None:
+        products = dict(Product.objects.filter(stock_shard_count__gt=0).values_list('id', 'stock_shard_count'))
+        cache.set(SHARDED_PRODUCTS_KEY, products, SHARDED_PRODUCTS_TIMEOUT)
+    return products
+
+
+def invalidate_sharded_products():
+    """商品切换库存模式后使分片商品缓存失效"""
+    cache.delete(SHARDED_PRODUCTS_KEY)
+
+
+def _quantity_case(quantities, field='id'):
+    """按商品ID取对应数量的CASE表达式: CASE WHEN id=1 THEN 2 WHEN id=5 THEN 1 ... END"""
+    return Case(
+        *[When(**{field: product_id}, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def _invalidate_stock_facets(products):
+    """事务提交后使给定商品所属分类的分面计数失效（在库存修改后、同一事务中调用）
+
+    参数:
+        products: 库存刚变为0或刚从0恢复的商品查询集
+    """
+    category_ids = set(products.values_list('category_id', flat=True))
+    if category_ids:
+        # 保存点回滚时回调随之丢弃，不会误使缓存失效
+        transaction.on_commit(lambda: invalidate_facets(*category_ids))
+
+
+def _newly_sharded(product_ids):
+    """普通模式的UPDATE少更新了行时，查询其中实际已切换为分片模式的商品 {商品ID: 分片数}"""
+    invalidate_sharded_products()
+    return dict(
+        Product.objects.filter(id__in=product_ids, stock_shard_count__gt=0).values_list('id', 'stock_shard_count')
+    )
+
+
+def sync_sharded_stock(product_id):
+    """把分片之和同步到Product.stock，展示值在有货/缺货之间切换时使分面计数失效"""
+    total = (
+        StockShard.objects.filter(product=OuterRef('pk')).order_by()
+        .values('product').annotate(total=Sum('stock')).values('total')
+    )
+    product = Product.objects.filter(id=product_id, stock_shard_count__gt=0)
+    old_stock = product.values_list('stock', flat=True).first()
+    if old_stock is None:
+        return
+    product.update(stock=Subquery(total), updated_at=timezone.now())
+    new_stock = product.values_list('stock', flat=True).first() or 0
+    if (old_stock > 0) != (new_stock > 0):
+        _invalidate_stock_facets(Product.objects.filter(id=product_id))
+
+
+def _sync_sharded_stock(product_id):
+    """事务提交后把分片之和同步到Product.stock（每个商品最多每隔几秒执行一次）
+
+    展示值允许短暂滞后，换来的是抢购期间不再每次扣减都锁商品行。
+    间隔内的第一次变更在提交后立即同步；之后的变更不会丢失，而是安排一次
+    间隔结束后执行的后台任务（products.sync_sharded_stock），每个间隔最多安排一次。
+    """
+    interval = getattr(settings, 'STOCK_SHARD_SYNC_SECONDS', 5)
+    # add只在键不存在时写入成功，起到节流作用
+    if cache.add(f'products:stock_shard_sync:{product_id}', 1, interval):
+        transaction.on_commit(lambda: sync_sharded_stock(product_id))
+        return
+    if cache.add(f'products:stock_shard_sync_trailing:{product_id}', 1, interval):
+        # 延迟导入: 任务模块依赖本模块
+        from .tasks import schedule_sharded_stock_sync
+        schedule_sharded_stock_sync(product_id, delay=interval)
+
+
+def _reserve_sharded(product_id, quantity, shard_count):
+    """从分片中扣减库存
+
+    先按随机顺序逐个分片做条件UPDATE，任一分片足够即成功；
+    都不够时（库存分散在多个分片上）锁定该商品的全部分片，总量足够则依次扣减。
+
+    返回:
+        成功True，库存不足False，商品没有分片（已切换回普通模式）None
+    """
+    shards = list(range(shard_count))
+    random.shuffle(shards)
+    for shard in shards:
+        updated = StockShard.objects.filter(product_id=product_id, shard=shard, stock__gte=quantity).update(
+            stock=F('stock') - quantity,
+        )
+        if updated:
+            _sync_sharded_stock(product_id)
+            return True
+
+    with transaction.atomic():
+        # 按分片编号顺序加锁，避免并发的合并扣减互相死锁
+        locked = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('shard'))
+        if not locked:
+            return None
+        if sum(shard.stock for shard in locked) < quantity:
+            return False
+        remaining = quantity
+        for shard in locked:
+            taken = min(shard.stock, remaining)
+            if taken:
+                StockShard.objects.filter(id=shard.id).update(stock=F('stock') - taken)
+                remaining -= taken
+    _sync_sharded_stock(product_id)
+    return True
+
+
+def _release_sharded(quantities, shard_counts):
+    """把库存归还到随机分片，选中同一分片编号的商品合并为一条UPDATE
+
+    返回:
+        没有分片的商品（已切换回普通模式）{商品ID: 数量}，由调用方按普通库存归还
+    """
+    by_shard = {}
+    for product_id, quantity in quantities.items():
+        by_shard.setdefault(random.randrange(shard_counts[product_id]), {})[product_id] = quantity
+    missing = {}
+    for shard, shard_quantities in by_shard.items():
+        shards = StockShard.objects.filter(product_id__in=shard_quantities, shard=shard)
+        updated = shards.update(stock=F('stock') + _quantity_case(shard_quantities, 'product_id'))
+        if updated != len(shard_quantities):
+            existing = set(shards.values_list('product_id', flat=True))
+            missing.update({
+                product_id: quantity for product_id, quantity in shard_quantities.items() if product_id not in existing
+            })
+    for product_id in quantities:
+        if product_id not in missing:
+            _sync_sharded_stock(product_id)
+    if missing:
+        invalidate_sharded_products()
+    return missing
+
+
+def _reserve_one(product_id, quantity):
+    """扣减一个商品的库存，按商品的库存模式选择商品行或分片（不登记流水）"""
+    shard_count = sharded_products().get(product_id)
+    if shard_count:
+        result = _reserve_sharded(product_id, quantity, shard_count)
+        if result is not None:
+            return result
+        invalidate_sharded_products()
+
+    updated = Product.objects.filter(id=product_id, stock__gte=quantity, stock_shard_count=0).update(
+        stock=F('stock') - quantity,
+        # 详情页的ETag和商品数据接口的增量同步都依赖updated_at
+        updated_at=timezone.now(),
+    )
+    if updated:
+        _invalidate_stock_facets(Product.objects.filter(id=product_id, stock=0))
+        return True
+    # 库存不足，或商品刚切换为分片模式而缓存尚未更新
+    shard_count = _newly_sharded([product_id]).get(product_id)
+    return bool(shard_count and _reserve_sharded(product_id, quantity, shard_count))
+
+
+def reserve_stock(product_id, quantity):
+    """扣减库存（库存不足时不做任何修改）
+
+    参数:
+        product_id: 商品ID
+        quantity: 扣减数量
+
+    返回:
+        扣减成功返回True，库存不足或商品不存在返回False
+    """
+    if quantity <= 0:
+        return True
+    if not _reserve_one(product_id, quantity):
+        _sync_failed_sharded([product_id])
+        return False
+    record_movements({product_id: -quantity})
+    return True
+
+
+def reserve_stock_many(quantities):
+    """用一条条件UPDATE同时扣减多个商品的库存
+
+        UPDATE ... SET stock = stock - CASE id ... END
+        WHERE id IN (...) AND stock >= CASE id ... END
+
+    全部商品库存足够时才生效: 受影响行数少于商品数时回滚这条语句，不做任何修改。
+    分片库存的商品逐个从分片扣减，同样在任一失败时一起回滚。
+
+    参数:
+        quantities: {商品ID: 扣减数量}
+
+    返回:
+        全部扣减成功返回True，任一商品库存不足或不存在返回False
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return True
+    if not _reserve_all(quantities):
+        _sync_failed_sharded(quantities)
+        return False
+    record_movements({product_id: -quantity for product_id, quantity in quantities.items()})
+    return True
+
+
+def _sync_failed_sharded(product_ids):
+    """扣减失败后同步其中分片商品的展示库存
+
+    失败说明分片中的库存已不足，展示值可能仍然大于0。
+    在扣减使用的保存点之外调用，保存点回滚不会丢弃同步
+    """
+    sharded = sharded_products()
+    for product_id in product_ids:
+        if product_id in sharded:
+            _sync_sharded_stock(product_id)
+
+
+def _reserve_all(quantities):
+    """reserve_stock_many的实现（不登记流水）"""
+    sharded = sharded_products()
+    regular = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in sharded}
+    # 保存点: 部分商品库存不足时只回滚本函数的修改，不影响调用方事务中的其他修改
+    with transaction.atomic():
+        amount = _quantity_case(regular)
+        updated = Product.objects.filter(id__in=regular, stock__gte=amount, stock_shard_count=0).update(
+            stock=F('stock') - amount,
+            updated_at=timezone.now(),
+        ) if regular else 0
+        if updated == len(regular):
+            if regular:
+                # 扣减后售罄的商品
+                _invalidate_stock_facets(Product.objects.filter(id__in=regular, stock=0))
+            for product_id, quantity in quantities.items():
+                if product_id in sharded and not _reserve_one(product_id, quantity):
+                    transaction.set_rollback(True)
+                    return False
+            return True
+        transaction.set_rollback(True)
+    # 库存不足，或缓存中的分片商品已过期: 后者逐个按数据库中的实际模式重试
+    return bool(_newly_sharded(regular)) and _reserve_each(quantities)
+
+
+def _reserve_each(quantities):
+    """逐个商品扣减库存，任一失败时全部回滚"""
+    with transaction.atomic():
+        for product_id, quantity in quantities.items():
+            if not _reserve_one(product_id, quantity):
+                transaction.set_rollback(True)
+                return False
+    return True
+
+
+def release_stock(product_id, quantity):
+    """归还库存
+
+    参数:
+        product_id: 商品ID
+        quantity: 归还数量
+    """
+    release_stock_many({product_id: quantity})
+
+
+def release_stock_many(quantities):
+    """用一条UPDATE同时归还多个商品的库存
+
+        UPDATE ... SET stock = stock + CASE id WHEN 1 THEN 2 WHEN 5 THEN 1 ... END
+        WHERE id IN (...)
+
+    清空购物车、移除购物车项、清理到期预留、取消订单和库存修复脚本都通过它归还库存，
+    无论涉及多少商品都只执行一条语句（分片库存的商品另按分片编号分组归还）。
+
+    参数:
+        quantities: {商品ID: 归还数量}
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    record_movements(quantities)
+    sharded = sharded_products()
+    regular = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in sharded}
+    to_shards = {product_id: quantity for product_id, quantity in quantities.items() if product_id in sharded}
+    if to_shards:
+        regular.update(_release_sharded(to_shards, sharded))
+    if not regular:
+        return
+
+    amount = _quantity_case(regular)
+    updated = Product.objects.filter(id__in=regular, stock_shard_count=0).update(
+        stock=F('stock') + amount,
+        updated_at=timezone.now(),
+    )
+    # 归还后库存恰好等于归还数量的商品（归还前已售罄）
+    _invalidate_stock_facets(Product.objects.filter(id__in=regular, stock=amount))
+    if updated != len(regular):
+        # 部分商品刚切换为分片模式而缓存尚未更新，改为归还到分片
+        switched = _newly_sharded(regular)
+        if switched:
+            _release_sharded({product_id: regular[product_id] for product_id in switched}, switched)
+
+
+def lock_products(product_ids):
+    """按ID升序锁定一组普通库存商品的行（需在事务中调用）
+
+    同时修改多个商品库存的事务（如结算）先调用它，所有事务都按相同顺序取得行锁，
+    共享商品的并发事务只会排队等待，不会互相持有对方需要的锁而死锁。
+    分片库存商品不锁商品行，其库存在分片中按分片编号顺序加锁。
+
+    参数:
+        product_ids: 商品ID集合
+
+    返回:
+        已锁定的商品ID列表
+    """
+    sharded = sharded_products()
+    product_ids = sorted(product_id for product_id in set(product_ids) if product_id not in sharded)
+    if not product_ids:
+        return []
+    return list(
+        Product.objects.select_for_update().filter(id__in=product_ids).order_by('id').values_list('id', flat=True)
+    )
+
+
+def adjust_reserved_stock(product_id, old_quantity, new_quantity):
+    """购物车数量从old_quantity改为new_quantity时调整库存
+
+    数量增加时按差额扣减（库存不足则失败），数量减少时归还差额
+
+    返回:
+        调整成功返回True，库存不足返回False
+    """
+    difference = new_quantity - old_quantity
+    if difference > 0:
+        return reserve_stock(product_id, difference)
+    release_stock(product_id, -difference)
+    return True
@@ -0,0 +1,41 @@
+from django.conf import settings
+# 导入管理命令基类
+from django.core.management.base import BaseCommand
+
+from products.movements import SETTLE_SECONDS, compact_movements, verify_stock
+
+
+class Command(BaseCommand):
+    """把库存流水合并到库存快照，并按需核对库存
+
+    建议由cron定期执行（如每小时一次）；--verify 用快照加上之后的流水核对每个商品的库存。
+
+    用法:
+        python manage.py compact_stock_movements
+        python manage.py compact_stock_movements --keep-days 30 --verify
+    """
+    help = '把库存流水合并到库存快照'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-days', type=int, default=getattr(settings, 'STOCK_MOVEMENT_KEEP_DAYS', 90),
+            help='已合并的流水保留天数，负数表示不删除',
+        )
+        parser.add_argument('--settle-seconds', type=int, default=SETTLE_SECONDS, help='只合并写入超过这么多秒的流水')
+        parser.add_argument('--verify', action='store_true', help='合并后核对全部商品的库存')
+
+    def handle(self, *args, **options):
+        keep_days = options['keep_days']
+        if keep_days is not None and keep_days < 0:
+            keep_days = None
+        products, deleted = compact_movements(settle_seconds=options['settle_seconds'], keep_days=keep_days)
+        self.stdout.write(f'已合并 {products} 个商品的库存流水，删除 {deleted} 条旧流水')
+
+        if options['verify']:
+            mismatches = verify_stock()
+            for product_id, expected, actual in mismatches:
+                self.stdout.write(self.style.WARNING(f'商品 {product_id}: 流水计算库存 {expected}，实际库存 {actual}'))
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f'{len(mismatches)} 个商品的库存与流水不一致'))
+            else:
+                self.stdout.write(self.style.SUCCESS('全部商品的库存与流水一致'))
@@ -0,0 +1,55 @@
+# 导入进程池用于并行生成缩略图（图片编码是CPU密集型任务，多进程才能用满多核）
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+
+import django
+# 导入管理命令基类
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+from products.thumbnails import generate_thumbnails
+
+
+def _init_worker():
+    """子进程初始化: spawn方式启动的子进程（如Windows）需要重新加载Django"""
+    django.setup()
+
+
+class Command(BaseCommand):
+    """为已有商品图片补生成缩略图
+
+    用法:
+        python manage.py generate_thumbnails --workers 4
+        python manage.py generate_thumbnails --force   # 重新生成已存在的缩略图
+    """
+    help = '并行为已有商品图片生成缩略图'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='并行进程数')
+        parser.add_argument('--force', action='store_true', help='覆盖已存在的缩略图')
+
+    def handle(self, *args, **options):
+        # 只取图片路径，多个商品共用同一张图片时只处理一次
+        image_names = sorted(set(
+            Product.objects.exclude(image='').values_list('image', flat=True)
+        ))
+        if not image_names:
+            self.stdout.write('没有需要处理的商品图片')
+            return
+
+        self.stdout.write(f'共 {len(image_names)} 张图片，使用 {options["workers"]} 个进程')
+        generated = 0
+        failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as executor:
+            futures = {
+                executor.submit(generate_thumbnails, name, options['force']): name
+                for name in image_names
+            }
+            for future in as_completed(futures):
+                try:
+                    generated += future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'处理 {futures[future]} 失败: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'缩略图生成完成，新生成 {generated} 个文件，失败 {failed} 张'))
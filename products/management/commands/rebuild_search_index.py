@@ -0,0 +1,43 @@
+# 导入管理命令基类
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+from products.search import get_search_backend
+
+
+class Command(BaseCommand):
+    """重建商品搜索索引
+
+    按主键顺序分批读取商品并写入当前配置的搜索后端，
+    内存占用与批大小成正比，与商品总数无关。
+
+    用法:
+        python manage.py rebuild_search_index --batch-size 500
+    """
+    help = '分批重建商品搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批索引的商品数量')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        backend = get_search_backend()
+        self.stdout.write(f'使用搜索后端: {backend.__class__.__name__}')
+
+        # 清空旧索引
+        backend.clear()
+
+        # 按主键分批读取，只加载建立索引所需的字段
+        queryset = Product.objects.only('id', 'name', 'description').order_by('id')
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            backend.index_products(batch)
+            last_id = batch[-1].id
+            total += len(batch)
+            self.stdout.write(f'已索引 {total} 个商品')
+
+        self.stdout.write(self.style.SUCCESS(f'搜索索引重建完成，共 {total} 个商品'))
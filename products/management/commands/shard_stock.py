@@ -0,0 +1,95 @@
+# 导入管理命令基类
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from products.inventory import invalidate_sharded_products
+from products.models import Product, StockShard
+
+
+class Command(BaseCommand):
+    """切换商品的库存模式
+
+    enable: 把商品当前库存平均拆分到N个分片，适用于抢购等同一商品高并发下单的场景
+    disable: 把各分片的库存合并回商品表，恢复普通库存模式
+    status: 列出所有分片库存商品及各分片库存
+
+    用法:
+        python manage.py shard_stock enable 12 15 --shards 8
+        python manage.py shard_stock disable 12
+        python manage.py shard_stock status
+    """
+    help = '切换商品的分片库存模式'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['enable', 'disable', 'status'], help='操作')
+        parser.add_argument('product_ids', nargs='*', type=int, help='商品ID')
+        parser.add_argument('--shards', type=int, default=8, help='分片数量（enable时使用）')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'status':
+            self._status()
+            return
+        if not options['product_ids']:
+            raise CommandError('请指定商品ID')
+        if action == 'enable' and not 1 < options['shards'] <= 64:
+            raise CommandError('分片数量必须在2到64之间')
+
+        for product_id in options['product_ids']:
+            if action == 'enable':
+                self._enable(product_id, options['shards'])
+            else:
+                self._disable(product_id)
+        # 通知各进程重新读取分片商品列表
+        invalidate_sharded_products()
+
+    @transaction.atomic
+    def _enable(self, product_id, shard_count):
+        """拆分库存: 锁定商品行后按当前库存创建分片，之后普通模式的扣减不会再命中该商品"""
+        product = Product.objects.select_for_update().filter(id=product_id).first()
+        if product is None:
+            raise CommandError(f'商品 {product_id} 不存在')
+        if product.stock_shard_count:
+            self.stdout.write(f'商品 {product_id} 已是分片库存（{product.stock_shard_count} 个分片），跳过')
+            return
+
+        base, extra = divmod(product.stock, shard_count)
+        StockShard.objects.bulk_create([
+            StockShard(product=product, shard=shard, stock=base + (1 if shard < extra else 0))
+            for shard in range(shard_count)
+        ])
+        Product.objects.filter(id=product_id).update(stock_shard_count=shard_count, updated_at=timezone.now())
+        self.stdout.write(self.style.SUCCESS(
+            f'商品 {product_id} 已启用分片库存: {product.stock} 件拆分为 {shard_count} 个分片'
+        ))
+
+    @transaction.atomic
+    def _disable(self, product_id):
+        """合并库存: 锁定商品行和全部分片，分片之和写回商品表后删除分片"""
+        product = Product.objects.select_for_update().filter(id=product_id).first()
+        if product is None:
+            raise CommandError(f'商品 {product_id} 不存在')
+        if not product.stock_shard_count:
+            self.stdout.write(f'商品 {product_id} 不是分片库存，跳过')
+            return
+
+        shards = StockShard.objects.select_for_update().filter(product_id=product_id).order_by('shard')
+        total = sum(shard.stock for shard in shards)
+        shards.delete()
+        Product.objects.filter(id=product_id).update(stock=total, stock_shard_count=0, updated_at=timezone.now())
+        self.stdout.write(self.style.SUCCESS(f'商品 {product_id} 已恢复普通库存: {total} 件'))
+
+    def _status(self):
+        """列出分片库存商品"""
+        products = Product.objects.filter(stock_shard_count__gt=0).annotate(shard_total=Sum('stock_shards__stock'))
+        if not products:
+            self.stdout.write('没有启用分片库存的商品')
+            return
+        for product in products:
+            shards = StockShard.objects.filter(product=product).order_by('shard').values_list('stock', flat=True)
+            self.stdout.write(
+                f'{product.id} {product.name}: 分片合计 {product.shard_total}，'
+                f'展示库存 {product.stock}，各分片 {list(shards)}'
+            )
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_fulltext_structures(apps, schema_editor):
+    """按数据库类型创建全文检索结构
+
+    sqlite: 创建FTS5虚拟表，存放预先切分好的词元（见SQLiteFTS5Backend）
+    mysql:  在商品表上创建ngram解析器的FULLTEXT索引（见MySQLFulltextBackend）
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts USING fts5(name, description)'
+        )
+    elif vendor == 'mysql':
+        schema_editor.execute(
+            'ALTER TABLE products_product ADD FULLTEXT INDEX product_name_ft (name) WITH PARSER ngram'
+        )
+        schema_editor.execute(
+            'ALTER TABLE products_product '
+            'ADD FULLTEXT INDEX product_name_desc_ft (name, description) WITH PARSER ngram'
+        )
+
+
+def drop_fulltext_structures(apps, schema_editor):
+    """回滚时删除全文检索结构"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS products_product_fts')
+    elif vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE products_product DROP INDEX product_name_ft')
+        schema_editor.execute('ALTER TABLE products_product DROP INDEX product_name_desc_ft')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32, verbose_name='词元')),
+                ('weight', models.PositiveIntegerField(default=1, verbose_name='权重')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='products.product', verbose_name='商品')),
+            ],
+            options={
+                'verbose_name': '商品搜索索引',
+                'verbose_name_plural': '商品搜索索引',
+                'unique_together': {('token', 'product')},
+            },
+        ),
+        migrations.RunPython(create_fulltext_structures, drop_fulltext_structures),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.11 on 2026-10-18 04:56
+
+from django.db import migrations, models
+from django.db.models import Case, F, When
+
+
+def backfill_final_price(apps, schema_editor):
+    """用一条UPDATE语句为已有商品回填实际售价"""
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(
+        final_price=Case(
+            When(discount_price__gt=0, then=F('discount_price')),
+            default=F('price'),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='final_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='实际售价'),
+        ),
+        migrations.RunPython(backfill_final_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'category', 'final_price'], name='product_active_cat_price'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'final_price'], name='product_active_price'),
+        ),
+    ]
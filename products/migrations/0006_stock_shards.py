@@ -0,0 +1,33 @@
+# Generated by Django 4.2.11 on 2026-10-18 05:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_final_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_shard_count',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='库存分片数'),
+        ),
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(verbose_name='分片编号')),
+                ('stock', models.PositiveIntegerField(default=0, verbose_name='库存')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_shards', to='products.product', verbose_name='商品')),
+            ],
+            options={
+                'verbose_name': '库存分片',
+                'verbose_name_plural': '库存分片',
+                'unique_together': {('product', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.11 on 2026-10-18 05:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def snapshot_current_stock(apps, schema_editor):
+    """以当前库存作为每个商品的初始快照，之后的变更从流水累加（分片库存商品取各分片之和）"""
+    Product = apps.get_model('products', 'Product')
+    StockSnapshot = apps.get_model('products', 'StockSnapshot')
+    products = (
+        Product.objects.order_by('id').annotate(shard_total=models.Sum('stock_shards__stock'))
+        .values_list('id', 'stock', 'stock_shard_count', 'shard_total')
+    )
+    StockSnapshot.objects.bulk_create(
+        (
+            StockSnapshot(product_id=product_id, stock=(shard_total or 0) if shard_count else stock, movement_id=0)
+            for product_id, stock, shard_count, shard_total in products.iterator(chunk_size=2000)
+        ),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_stock_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.IntegerField(default=0, verbose_name='库存')),
+                ('movement_id', models.BigIntegerField(default=0, verbose_name='流水ID')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshot', to='products.product', verbose_name='商品')),
+            ],
+            options={
+                'verbose_name': '库存快照',
+                'verbose_name_plural': '库存快照',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('delta', models.IntegerField(verbose_name='变化量')),
+                ('reason', models.CharField(choices=[('cart', '购物车预留'), ('reservation_expired', '预留到期归还'), ('checkout', '结算'), ('order_cancel', '取消订单'), ('adjustment', '库存调整')], max_length=20, verbose_name='原因')),
+                ('ref_id', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='关联ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='products.product', verbose_name='商品')),
+            ],
+            options={
+                'verbose_name': '库存流水',
+                'verbose_name_plural': '库存流水',
+                'indexes': [models.Index(fields=['product', 'id'], name='stock_movement_product_id'), models.Index(fields=['created_at'], name='stock_movement_created_at')],
+            },
+        ),
+        migrations.RunPython(snapshot_current_stock, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,9 @@
 # 导入Django模型基类
 from django.db import models
+# 导入条件表达式，用于在数据库中计算实际售价
+from django.db.models import Case, F, Value, When
+from django.db.models.expressions import Combinable
+from django.db.models.lookups import GreaterThan
 # 导入slugify函数用于生成URL友好的字符串
 from django.utils.text import slugify
 # 导入uuid模块用于生成唯一标识符
@@ -45,6 +49,70 @@ class Category(models.Model):
         super().save(*args, **kwargs)
 
 
+def final_price_expression(price=None, discount_price=None):
+    """实际售价的数据库表达式，与Product.get_final_price保持一致
+
+    有折扣价（大于0）时取折扣价，否则取原价。
+    price/discount_price为None时使用当前列值，否则使用传入的新值（字面量或表达式）
+    """
+    price = F('price') if price is None else price
+    discount_price = F('discount_price') if discount_price is None else discount_price
+    return Case(
+        When(GreaterThan(discount_price, 0), then=discount_price),
+        default=price,
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+class ProductQuerySet(models.QuerySet):
+    """商品查询集
+
+    final_price是price/discount_price的冗余列，这里覆盖批量写入方法使其保持同步，
+    Product.save之外的批量更新路径也不会产生过期的实际售价
+    """
+
+    # 参与计算实际售价的字段
+    PRICE_FIELDS = ('price', 'discount_price')
+
+    def _as_expression(self, name, value):
+        """将update()传入的字面量转换为表达式"""
+        if hasattr(value, 'resolve_expression') or isinstance(value, Combinable):
+            return value
+        field = self.model._meta.get_field(name)
+        return Value(field.to_python(value), output_field=field)
+
+    def update(self, **kwargs):
+        """批量更新价格时在同一条UPDATE语句中同步final_price"""
+        if 'final_price' not in kwargs and any(name in kwargs for name in self.PRICE_FIELDS):
+            final_price = final_price_expression(
+                price=self._as_expression('price', kwargs['price']) if 'price' in kwargs else None,
+                discount_price=(
+                    self._as_expression('discount_price', kwargs['discount_price'])
+                    if 'discount_price' in kwargs else None
+                ),
+            )
+            # final_price放在SET子句最前面: MySQL按从左到右的顺序赋值，
+            # 之后的表达式会读到已更新的列值，放在最前面保证各数据库都基于旧值计算
+            kwargs = {'final_price': final_price, **kwargs}
+        return super().update(**kwargs)
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        """批量更新价格字段时同时写入重新计算的final_price"""
+        fields = list(fields)
+        if 'final_price' not in fields and any(name in fields for name in self.PRICE_FIELDS):
+            for obj in objs:
+                obj.final_price = obj.get_final_price()
+            fields.append('final_price')
+        return super().bulk_update(objs, fields, batch_size=batch_size)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """批量创建时计算final_price（bulk_create不会调用save）"""
+        objs = list(objs)
+        for obj in objs:
+            obj.final_price = obj.get_final_price()
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Product(models.Model):
     """商品模型
     存储商品的详细信息
@@ -61,8 +129,13 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="价格")
     # 折扣价，可以为空
     discount_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="折扣价")
+    # 实际售价（折扣价或原价）的冗余列，保存时自动计算，用于按价格排序和区间筛选
+    final_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False, verbose_name="实际售价")
     # 商品库存，非负整数
+    # 分片库存模式下实际库存保存在StockShard中，这里是各分片之和的定期同步值，仅用于展示和筛选
     stock = models.PositiveIntegerField(default=0, verbose_name="库存")
+    # 库存分片数，0表示普通库存模式（python manage.py shard_stock 切换）
+    stock_shard_count = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name="库存分片数")
     # 商品图片，上传到products/目录，可以为空
     image = models.ImageField(upload_to='products/', blank=True, verbose_name="商品图片")
     # 商品描述
@@ -76,25 +149,74 @@ class Product(models.Model):
     # 更新时间，自动更新
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
 
+    # 自定义查询集，批量更新价格时同步final_price
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         # 模型的单数和复数名称
         verbose_name = "商品"
         verbose_name_plural = "商品"
         # 按创建时间降序排序（最新的商品在前）
         ordering = ['-created_at']
+        # 组合索引，配合键集分页使列表页的每一页都是一次索引范围扫描
+        # InnoDB二级索引隐式包含主键，因此 (created_at, id) 的游标定位同样走索引
+        indexes = [
+            # 分类列表页: WHERE is_active AND category_id ORDER BY created_at
+            models.Index(fields=['is_active', 'category', 'created_at'], name='product_active_cat_created'),
+            # 首页推荐: WHERE is_active AND is_featured ORDER BY created_at
+            models.Index(fields=['is_active', 'is_featured', 'created_at'], name='product_active_feat_created'),
+            # 商品数据接口增量同步: WHERE updated_at > ? ORDER BY updated_at, id
+            models.Index(fields=['updated_at'], name='product_updated_at'),
+            # 分类列表页按价格排序/价格区间筛选: WHERE is_active AND category_id ORDER BY final_price
+            models.Index(fields=['is_active', 'category', 'final_price'], name='product_active_cat_price'),
+            # 全部商品按价格排序: WHERE is_active ORDER BY final_price
+            models.Index(fields=['is_active', 'final_price'], name='product_active_price'),
+        ]
 
     def __str__(self):
         """对象的字符串表示"""
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """从数据库加载实例时记录原始字段值，供信号处理器判断字段是否变化"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def has_changed(self, *field_names):
+        """判断指定字段自加载以来是否被修改
+
+        新建的实例或未加载该字段时，一律视为已修改
+        """
+        loaded_values = getattr(self, '_loaded_values', None)
+        if loaded_values is None:
+            return True
+        for name in field_names:
+            attname = self._meta.get_field(name).attname
+            if attname not in loaded_values or loaded_values[attname] != getattr(self, attname):
+                return True
+        return False
+
     def save(self, *args, **kwargs):
         """重写save方法，在slug为空时自动生成唯一slug"""
         if not self.slug:
             base_slug = slugify(self.name) or 'product'
             # 添加随机字符串确保唯一性
             self.slug = f'{base_slug}-{uuid.uuid4().hex[:6]}'
+        # 同步实际售价冗余列；只更新部分字段且包含价格时，一并写入final_price
+        self.final_price = self.get_final_price()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(ProductQuerySet.PRICE_FIELDS) & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'final_price'}
         # 调用父类的save方法
         super().save(*args, **kwargs)
+        # 保存后刷新原始值快照（跳过延迟加载的字段），post_save信号处理器已在此之前执行
+        self._loaded_values = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
 
     def get_final_price(self):
         """获取最终价格(折扣价或原价)
@@ -102,4 +224,121 @@ class Product(models.Model):
         """
         if self.discount_price:
             return self.discount_price
-        return self.price
\ No newline at end of file
+        return self.price
+
+
+class ProductSearchToken(models.Model):
+    """商品搜索倒排索引
+    每行记录一个词元（中文单字/二元组或英文前缀）在某个商品中的加权词频，
+    由NgramIndexBackend在商品保存/删除时维护
+    """
+    # 词元
+    token = models.CharField(max_length=32, verbose_name="词元")
+    # 关联的商品，商品删除时索引随之删除
+    product = models.ForeignKey(Product, related_name='search_tokens', on_delete=models.CASCADE, verbose_name="商品")
+    # 加权词频：名称中出现的权重高于描述
+    weight = models.PositiveIntegerField(default=1, verbose_name="权重")
+
+    class Meta:
+        verbose_name = "商品搜索索引"
+        verbose_name_plural = "商品搜索索引"
+        # (token, product) 唯一，同时作为按词元查找的索引
+        unique_together = ('token', 'product')
+
+    def __str__(self):
+        """对象的字符串表示"""
+        return f"{self.token} -> {self.product_id}"
+
+
+
+class StockShard(models.Model):
+    """分片库存计数器
+    抢购商品的库存拆分到多行，扣减时随机选择一个分片做条件UPDATE，
+    并发请求分散在不同的行锁上，不再全部排队等待商品行的锁
+    """
+    # 关联的商品，商品删除时分片随之删除
+    product = models.ForeignKey(Product, related_name='stock_shards', on_delete=models.CASCADE, verbose_name="商品")
+    # 分片编号，从0开始
+    shard = models.PositiveSmallIntegerField(verbose_name="分片编号")
+    # 分片中的库存
+    stock = models.PositiveIntegerField(default=0, verbose_name="库存")
+
+    class Meta:
+        verbose_name = "库存分片"
+        verbose_name_plural = "库存分片"
+        # (product, shard) 唯一，同时作为按商品查找分片的索引
+        unique_together = ('product', 'shard')
+
+    def __str__(self):
+        """对象的字符串表示"""
+        return f"{self.product_id}#{self.shard}: {self.stock}"
+
+
+class StockMovement(models.Model):
+    """库存流水（只追加）
+    每次库存变更在所在事务结束前按商品合并后批量写入一行，记录变化量、原因和关联对象ID，
+    由 products.movements 写入，定期由 compact_stock_movements 命令合并到StockSnapshot
+    """
+    # 变更原因
+    REASON_CART = 'cart'
+    REASON_RESERVATION_EXPIRED = 'reservation_expired'
+    REASON_CHECKOUT = 'checkout'
+    REASON_ORDER_CANCEL = 'order_cancel'
+    REASON_ADJUSTMENT = 'adjustment'
+    REASON_CHOICES = (
+        (REASON_CART, '购物车预留'),
+        (REASON_RESERVATION_EXPIRED, '预留到期归还'),
+        (REASON_CHECKOUT, '结算'),
+        (REASON_ORDER_CANCEL, '取消订单'),
+        (REASON_ADJUSTMENT, '库存调整'),
+    )
+
+    # 自增ID同时作为流水的顺序号，快照记录已合并到的ID
+    id = models.BigAutoField(primary_key=True)
+    # 关联的商品
+    product = models.ForeignKey(Product, related_name='stock_movements', on_delete=models.CASCADE, verbose_name="商品")
+    # 库存变化量，扣减为负数，归还为正数
+    delta = models.IntegerField(verbose_name="变化量")
+    # 变更原因
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, verbose_name="原因")
+    # 关联对象ID: 购物车为用户ID，结算和取消订单为订单ID（与BigAutoField主键范围一致）
+    ref_id = models.PositiveBigIntegerField(null=True, blank=True, verbose_name="关联ID")
+    # 写入时间
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    class Meta:
+        verbose_name = "库存流水"
+        verbose_name_plural = "库存流水"
+        indexes = [
+            # 按商品查询快照之后的流水
+            models.Index(fields=['product', 'id'], name='stock_movement_product_id'),
+            # 压缩任务按时间确定合并范围和清理旧流水
+            models.Index(fields=['created_at'], name='stock_movement_created_at'),
+        ]
+
+    def __str__(self):
+        """对象的字符串表示"""
+        return f"{self.product_id} {self.delta:+d} ({self.reason})"
+
+
+class StockSnapshot(models.Model):
+    """库存快照
+    记录每个商品截至某条流水（movement_id，含）为止的库存，
+    当前库存应等于快照库存加上之后所有流水的变化量，核对时不必从头扫描全部流水
+    """
+    # 关联的商品，每个商品一行
+    product = models.OneToOneField(Product, related_name='stock_snapshot', on_delete=models.CASCADE, verbose_name="商品")
+    # 快照时的库存
+    stock = models.IntegerField(default=0, verbose_name="库存")
+    # 已合并到快照的最后一条流水ID
+    movement_id = models.BigIntegerField(default=0, verbose_name="流水ID")
+    # 快照更新时间
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+
+    class Meta:
+        verbose_name = "库存快照"
+        verbose_name_plural = "库存快照"
+
+    def __str__(self):
+        """对象的字符串表示"""
+        return f"{self.product_id}: {self.stock} @ {self.movement_id}"
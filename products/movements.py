@@ -0,0 +1,186 @@
+"""库存流水
+
+库存服务（products.inventory）的每次变更都在这里登记为StockMovement。
+视图和任务用登记块包住一次事务中的库存操作:
+
+    with transaction.atomic(), stock_movements(StockMovement.REASON_CART, ref_id=user.id):
+        ...
+
+块内的变更按商品合并，在块结束时（仍在事务内）用一条bulk_create写入，与库存修改一起提交或回滚；
+块内抛出异常或事务已标记回滚时不写入。没有登记块时每次变更立即写入，原因记为库存调整。
+
+流水只追加不修改。compact_movements() 定期把较早的流水累加到StockSnapshot，
+verify_stock() 用快照加上之后的流水计算每个商品应有的库存并与实际库存比较，
+核对的工作量只与快照之后的流水数量有关。
+"""
+# 导入contextvars保存当前的登记块，线程和协程之间互不影响
+import contextvars
+from contextlib import contextmanager
+# 导入timedelta计算压缩和清理的时间界限
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from .models import Product, StockMovement, StockSnapshot
+
+# 只压缩写入超过这么多秒的流水，给仍未提交的事务留出时间（自增ID在插入时分配，提交顺序可能不同）
+SETTLE_SECONDS = 300
+# 压缩时每条UPDATE包含的商品数量
+COMPACT_BATCH_SIZE = 500
+
+# 当前上下文中的登记块
+_current_log = contextvars.ContextVar('stock_movement_log', default=None)
+
+
+class StockMovementLog:
+    """一个登记块内收集的库存变更
+
+    属性:
+        reason: 变更原因（StockMovement.REASON_*）
+        ref_id: 关联对象ID，可在块结束前修改（如结算时订单创建后才有订单ID）
+        deltas: {商品ID: 合并后的变化量}
+    """
+
+    def __init__(self, reason, ref_id=None):
+        self.reason = reason
+        self.ref_id = ref_id
+        self.deltas = {}
+
+    def add(self, deltas):
+        """累加一组变化量 {商品ID: 变化量}"""
+        for product_id, delta in deltas.items():
+            self.deltas[product_id] = self.deltas.get(product_id, 0) + delta
+
+    def flush(self):
+        """写入合并后的流水，变化量合计为0的商品（如先扣后还）不写入"""
+        movements = [
+            StockMovement(product_id=product_id, delta=delta, reason=self.reason, ref_id=self.ref_id)
+            for product_id, delta in self.deltas.items() if delta
+        ]
+        self.deltas = {}
+        # 所在事务已标记回滚时库存修改不会生效，流水也不写入（此时也不能再执行查询）
+        if movements and not (connection.in_atomic_block and transaction.get_rollback()):
+            StockMovement.objects.bulk_create(movements)
+
+
+@contextmanager
+def stock_movements(reason, ref_id=None):
+    """登记块: 收集块内的库存变更，正常结束时批量写入
+
+    参数:
+        reason: 变更原因（StockMovement.REASON_*）
+        ref_id: 关联对象ID
+
+    返回:
+        StockMovementLog对象
+    """
+    log = StockMovementLog(reason, ref_id)
+    token = _current_log.set(log)
+    try:
+        yield log
+    finally:
+        _current_log.reset(token)
+    log.flush()
+
+
+def record_movements(deltas):
+    """登记库存变更，由库存服务在每次修改成功后调用
+
+    参数:
+        deltas: {商品ID: 变化量}，扣减为负数，归还为正数
+    """
+    log = _current_log.get()
+    if log is None:
+        # 不在登记块中（如管理后台或脚本直接调用库存服务），立即写入
+        log = StockMovementLog(StockMovement.REASON_ADJUSTMENT)
+        log.add(deltas)
+        log.flush()
+        return
+    log.add(deltas)
+
+
+def compact_movements(settle_seconds=SETTLE_SECONDS, keep_days=None, now=None):
+    """把上次压缩之后、写入超过settle_seconds秒的流水累加到库存快照
+
+    所有快照共用同一个合并位置（movement_id），每次压缩:
+        1. 取本次合并的最后一条流水ID
+        2. 按商品汇总区间内的变化量，按批用CASE表达式更新已有快照，没有快照的商品新建快照
+        3. 可选地删除已合并且早于keep_days天的流水
+    更新快照时带有 movement_id = 上次位置 的条件，同时运行的两次压缩不会重复累加。
+
+    参数:
+        settle_seconds: 只合并写入超过这么多秒的流水
+        keep_days: 保留最近几天的流水，None表示不删除
+        now: 当前时间，默认为timezone.now()
+
+    返回:
+        (合并的商品数, 删除的流水数)
+    """
+    # 延迟导入以避免与库存服务循环引用
+    from .inventory import _quantity_case
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        last = StockSnapshot.objects.aggregate(last=Max('movement_id'))['last'] or 0
+        cutoff = StockMovement.objects.filter(
+            id__gt=last, created_at__lte=now - timedelta(seconds=settle_seconds),
+        ).aggregate(cutoff=Max('id'))['cutoff']
+        totals = {}
+        if cutoff is not None:
+            totals = dict(
+                StockMovement.objects.filter(id__gt=last, id__lte=cutoff).order_by()
+                .values('product_id').annotate(total=Sum('delta')).values_list('product_id', 'total')
+            )
+            existing = set(StockSnapshot.objects.filter(product_id__in=totals).values_list('product_id', flat=True))
+            changed = [(product_id, total) for product_id, total in totals.items() if product_id in existing and total]
+            for start in range(0, len(changed), COMPACT_BATCH_SIZE):
+                batch = dict(changed[start:start + COMPACT_BATCH_SIZE])
+                StockSnapshot.objects.filter(product_id__in=batch, movement_id=last).update(
+                    stock=F('stock') + _quantity_case(batch, 'product_id'),
+                )
+            # 全部快照前移到本次位置
+            StockSnapshot.objects.filter(movement_id=last).update(movement_id=cutoff, updated_at=now)
+            StockSnapshot.objects.bulk_create([
+                StockSnapshot(product_id=product_id, stock=total, movement_id=cutoff)
+                for product_id, total in totals.items() if product_id not in existing
+            ])
+            last = cutoff
+
+        deleted = 0
+        if keep_days is not None:
+            # 只删除已合并到快照的流水
+            deleted, _ = StockMovement.objects.filter(
+                id__lte=last, created_at__lt=now - timedelta(days=keep_days),
+            ).delete()
+    return len(totals), deleted
+
+
+def verify_stock():
+    """用快照和之后的流水核对全部商品的库存
+
+    在一个事务中读取（MySQL InnoDB的一致性读），快照、流水和商品库存来自同一时间点。
+    分片库存商品的实际库存取各分片之和（Product.stock只是定期同步的展示值）。
+
+    返回:
+        不一致的商品 [(商品ID, 应有库存, 实际库存), ...]
+    """
+    with transaction.atomic():
+        snapshots = dict(StockSnapshot.objects.values_list('product_id', 'stock'))
+        last = StockSnapshot.objects.aggregate(last=Max('movement_id'))['last'] or 0
+        pending = dict(
+            StockMovement.objects.filter(id__gt=last).order_by()
+            .values('product_id').annotate(total=Sum('delta')).values_list('product_id', 'total')
+        )
+        products = (
+            Product.objects.order_by('id').annotate(shard_total=Sum('stock_shards__stock'))
+            .values_list('id', 'stock', 'stock_shard_count', 'shard_total')
+        )
+        mismatches = []
+        for product_id, stock, shard_count, shard_total in products:
+            expected = snapshots.get(product_id, 0) + pending.get(product_id, 0)
+            actual = (shard_total or 0) if shard_count else stock
+            if expected != actual:
+                mismatches.append((product_id, expected, actual))
+    return mismatches
@@ -0,0 +1,248 @@
+# 导入base64和json用于游标的编码与解码
+import base64
+import binascii
+import json
+# 导入ValidationError用于捕获游标值类型转换失败
+from django.core.exceptions import ValidationError
+# 导入Q对象用于构建"越过游标"的组合查询条件
+from django.db.models import Q
+
+
+class KeysetPage:
+    """键集分页的单页结果
+
+    属性:
+        object_list: 当前页的对象列表
+        has_next: 是否存在下一页
+        has_previous: 是否存在上一页
+        next_cursor: 下一页的游标（没有下一页时为None）
+        previous_cursor: 上一页的游标（没有上一页时为None）
+        base_query: 去掉分页参数后的查询字符串，供模板拼接翻页链接
+    """
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor, base_query=''):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.base_query = base_query
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        """是否需要显示翻页导航"""
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """键集（游标）分页器
+
+    与OFFSET分页不同，键集分页记住上一页最后一行的排序键值，
+    下一页直接用 WHERE (created_at, id) < (游标值) 定位，
+    因此无论翻到第几页，数据库都只需在索引上做一次范围扫描。
+
+    参数:
+        queryset: 待分页的查询集
+        ordering: 排序字段元组，最后一个字段必须唯一（通常为id），
+                  以'-'开头表示降序
+        per_page: 每页数量
+    """
+
+    # 分页使用的GET参数名
+    after_param = 'after'
+    before_param = 'before'
+
+    def __init__(self, queryset, ordering=('-created_at', '-id'), per_page=20):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        # 拆分出字段名和方向，便于构建查询条件
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+
+    def encode_cursor(self, obj):
+        """将对象的排序键值编码为URL安全的游标字符串"""
+        values = []
+        for name in self.fields:
+            value = getattr(obj, name)
+            # 日期时间用ISO格式，Decimal等类型统一转为字符串
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """解码游标字符串，返回排序键值列表；游标无效时返回None"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                return None
+            # 借助模型字段的to_python将字符串还原为正确的Python类型
+            model = self.queryset.model
+            return [model._meta.get_field(name).to_python(value) for name, value in zip(self.fields, values)]
+        except (ValueError, TypeError, binascii.Error, ValidationError):
+            return None
+
+    def _seek_filter(self, values, reverse=False):
+        """构建越过游标的查询条件
+
+        对于排序 (a DESC, b DESC) 和游标 (va, vb)，生成:
+            a < va OR (a = va AND b < vb)
+        reverse为True时方向取反，用于向前翻页
+        """
+        condition = Q()
+        for index, name in enumerate(self.fields):
+            # 前面的字段全部相等
+            equal = Q(**{self.fields[i]: values[i] for i in range(index)})
+            descending = self.descending[index] != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': values[index]})
+        return condition
+
+    def _order_by(self, reverse=False):
+        """返回实际使用的排序表达式"""
+        if not reverse:
+            return self.ordering
+        return tuple(name.lstrip('-') if desc else f'-{name}' for name, desc in zip(self.fields, self.descending))
+
+    def _page_query(self, after, before):
+        """构建一页数据的查询
+
+        返回:
+            (多取一条的切片查询集, 解码后的after游标值, 是否向前翻页)
+        """
+        after_values = self.decode_cursor(after) if after else None
+        before_values = self.decode_cursor(before) if before else None
+
+        if before_values is not None:
+            # 向前翻页：反向排序后取per_page+1条，结果在_build_page中翻转回来
+            queryset = self.queryset.filter(self._seek_filter(before_values, reverse=True))
+            return queryset.order_by(*self._order_by(reverse=True))[:self.per_page + 1], None, True
+
+        queryset = self.queryset
+        if after_values is not None:
+            queryset = queryset.filter(self._seek_filter(after_values))
+        # 多取一条用于判断是否还有下一页
+        return queryset.order_by(*self.ordering)[:self.per_page + 1], after_values, False
+
+    def _build_page(self, rows, after_values, backward, base_query):
+        """由查询结果构建KeysetPage"""
+        if backward:
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_next = True
+        else:
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = after_values is not None
+
+        next_cursor = self.encode_cursor(rows[-1]) if rows and has_next else None
+        previous_cursor = self.encode_cursor(rows[0]) if rows and has_previous else None
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor, base_query)
+
+    def page(self, after=None, before=None, base_query=''):
+        """获取一页数据
+
+        参数:
+            after: 下一页游标，返回位于该游标之后的数据
+            before: 上一页游标，返回位于该游标之前的数据
+            base_query: 透传给KeysetPage的查询字符串
+
+        返回:
+            KeysetPage对象
+        """
+        queryset, after_values, backward = self._page_query(after, before)
+        return self._build_page(list(queryset), after_values, backward, base_query)
+
+    async def apage(self, after=None, before=None, base_query=''):
+        """page的异步版本，供异步视图使用"""
+        queryset, after_values, backward = self._page_query(after, before)
+        return self._build_page([obj async for obj in queryset], after_values, backward, base_query)
+
+    def _cursors_from_request(self, request):
+        """从请求中取出after/before游标和去掉分页参数后的查询字符串"""
+        params = request.GET.copy()
+        after = params.pop(self.after_param, [None])[-1]
+        before = params.pop(self.before_param, [None])[-1]
+        return {'after': after, 'before': before, 'base_query': params.urlencode()}
+
+    def page_from_request(self, request):
+        """根据请求中的after/before参数获取对应页"""
+        return self.page(**self._cursors_from_request(request))
+
+    async def apage_from_request(self, request):
+        """page_from_request的异步版本"""
+        return await self.apage(**self._cursors_from_request(request))
+
+
+class RankedPaginator:
+    """按相关度排序的结果分页器
+
+    搜索后端返回的是按相关度排好序的id列表，无法用排序键在数据库中定位，
+    因此游标记录上一页边界对象的id，在列表中定位后切片，再按id批量加载当前页。
+    对外接口与KeysetPaginator一致，模板无需区分。
+
+    参数:
+        ranked_ids: 按相关度降序排列的id列表
+        queryset: 用于加载当前页对象的查询集
+        per_page: 每页数量
+    """
+
+    after_param = KeysetPaginator.after_param
+    before_param = KeysetPaginator.before_param
+
+    def __init__(self, ranked_ids, queryset, per_page=20):
+        self.ranked_ids = list(ranked_ids)
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def _position(self, cursor):
+        """返回游标对应id在列表中的位置；游标无效时返回None"""
+        try:
+            return self.ranked_ids.index(int(cursor))
+        except (TypeError, ValueError):
+            return None
+
+    def _page_ids(self, after, before):
+        """计算当前页的id列表和是否有上一页/下一页"""
+        before_position = self._position(before) if before else None
+        after_position = self._position(after) if after else None
+
+        if before_position is not None:
+            start = max(before_position - self.per_page, 0)
+            end = before_position
+        elif after_position is not None:
+            start = after_position + 1
+            end = start + self.per_page
+        else:
+            start, end = 0, self.per_page
+        return self.ranked_ids[start:end], end < len(self.ranked_ids), start > 0
+
+    def _build_page(self, page_ids, objects, has_next, has_previous, base_query):
+        """按相关度顺序排列批量加载的对象，构建KeysetPage"""
+        rows = [objects[pk] for pk in page_ids if pk in objects]
+        next_cursor = str(page_ids[-1]) if page_ids and has_next else None
+        previous_cursor = str(page_ids[0]) if page_ids and has_previous else None
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor, base_query)
+
+    def page(self, after=None, before=None, base_query=''):
+        """获取一页数据，参数与KeysetPaginator.page相同"""
+        page_ids, has_next, has_previous = self._page_ids(after, before)
+        # 按id批量加载，再恢复相关度顺序
+        objects = self.queryset.in_bulk(page_ids)
+        return self._build_page(page_ids, objects, has_next, has_previous, base_query)
+
+    async def apage(self, after=None, before=None, base_query=''):
+        """page的异步版本，供异步视图使用"""
+        page_ids, has_next, has_previous = self._page_ids(after, before)
+        objects = await self.queryset.ain_bulk(page_ids)
+        return self._build_page(page_ids, objects, has_next, has_previous, base_query)
+
+    _cursors_from_request = KeysetPaginator._cursors_from_request
+    page_from_request = KeysetPaginator.page_from_request
+    apage_from_request = KeysetPaginator.apage_from_request
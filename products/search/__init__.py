@@ -0,0 +1,37 @@
+"""商品全文搜索
+
+通过settings.PRODUCT_SEARCH_BACKEND指定后端类的导入路径；未配置时按数据库类型选择:
+    mysql  -> MySQLFulltextBackend（FULLTEXT + ngram解析器）
+    sqlite -> SQLiteFTS5Backend（FTS5虚拟表）
+    其他   -> NgramIndexBackend（通用倒排索引表）
+"""
+# 导入lru_cache用于缓存后端实例
+from functools import lru_cache
+# 导入settings读取后端配置
+from django.conf import settings
+# 导入数据库连接用于判断数据库类型
+from django.db import connection
+# 导入import_string用于按路径加载后端类
+from django.utils.module_loading import import_string
+
+from .backends import BaseSearchBackend, MySQLFulltextBackend, NgramIndexBackend, SQLiteFTS5Backend
+
+# 自定义后端可继承 products.search.BaseSearchBackend
+__all__ = [
+    'BaseSearchBackend', 'MySQLFulltextBackend', 'NgramIndexBackend', 'SQLiteFTS5Backend', 'get_search_backend',
+]
+
+# 各数据库默认使用的搜索后端
+DEFAULT_BACKENDS = {
+    'mysql': MySQLFulltextBackend,
+    'sqlite': SQLiteFTS5Backend,
+}
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """获取当前配置的搜索后端实例（进程内单例）"""
+    backend_path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    return DEFAULT_BACKENDS.get(connection.vendor, NgramIndexBackend)()
@@ -0,0 +1,221 @@
+# 导入Counter用于统计词频
+from collections import Counter
+# 导入正则模块用于清理MySQL布尔检索的特殊字符
+import re
+# 导入数据库连接，FTS5和FULLTEXT检索需要执行原生SQL
+from django.db import connection
+# 导入聚合函数用于倒排索引的相关度计算
+from django.db.models import Case, Count, Q, Sum, Value, When
+
+from .tokenizer import tokenize_document, tokenize_query
+
+# 商品名称相对于描述的权重
+NAME_WEIGHT = 5
+DESCRIPTION_WEIGHT = 1
+
+
+class BaseSearchBackend:
+    """商品搜索后端接口
+
+    所有后端都实现相同的方法，由settings.PRODUCT_SEARCH_BACKEND选择具体实现
+    """
+
+    def index_products(self, products):
+        """为一批商品建立（或重建）索引
+
+        参数:
+            products: Product实例列表，至少需要加载id、name、description
+        """
+        raise NotImplementedError
+
+    def remove_products(self, product_ids):
+        """从索引中移除一批商品"""
+        raise NotImplementedError
+
+    def clear(self):
+        """清空整个索引，重建索引前调用"""
+        raise NotImplementedError
+
+    def search(self, query, limit=1000):
+        """按相关度搜索上架商品
+
+        参数:
+            query: 用户输入的关键词
+            limit: 最多返回的结果数
+
+        返回:
+            按相关度降序排列的商品id列表
+        """
+        raise NotImplementedError
+
+
+class NgramIndexBackend(BaseSearchBackend):
+    """基于ProductSearchToken倒排索引表的搜索后端
+
+    不依赖任何数据库特性，可在所有数据库上使用。
+    查询时要求命中全部词元，按加权词频之和排序。
+    """
+
+    def _weighted_tokens(self, product):
+        """统计商品名称和描述中各词元的加权词频"""
+        weights = Counter()
+        for token in tokenize_document(product.name):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize_document(product.description):
+            weights[token] += DESCRIPTION_WEIGHT
+        return weights
+
+    def index_products(self, products):
+        from ..models import ProductSearchToken
+        products = list(products)
+        if not products:
+            return
+        # 先删除旧索引，再批量写入新索引
+        self.remove_products([product.id for product in products])
+        ProductSearchToken.objects.bulk_create(
+            [
+                ProductSearchToken(token=token, product_id=product.id, weight=weight)
+                for product in products
+                for token, weight in self._weighted_tokens(product).items()
+            ],
+            batch_size=1000,
+        )
+
+    def remove_products(self, product_ids):
+        from ..models import ProductSearchToken
+        ProductSearchToken.objects.filter(product_id__in=list(product_ids)).delete()
+
+    def clear(self):
+        from ..models import ProductSearchToken
+        ProductSearchToken.objects.all().delete()
+
+    def search(self, query, limit=1000):
+        from ..models import ProductSearchToken
+        tokens = tokenize_query(query)
+        if not tokens:
+            return []
+        rows = (
+            ProductSearchToken.objects
+            .filter(token__in=tokens, product__is_active=True)
+            .values('product_id')
+            .annotate(hits=Count('id'), score=Sum('weight'))
+            # 必须命中全部词元，相当于原来的子串匹配
+            .filter(hits=len(tokens))
+            .order_by('-score', '-product_id')
+            .values_list('product_id', flat=True)[:limit]
+        )
+        return list(rows)
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    """基于SQLite FTS5虚拟表的搜索后端
+
+    FTS5默认分词器无法切分中文，因此写入前先用tokenize_document切分，
+    以空格连接的词元形式存入虚拟表；排序使用bm25并给名称列更高权重。
+    虚拟表由迁移products.0003创建。
+    """
+
+    table_name = 'products_product_fts'
+
+    def index_products(self, products):
+        products = list(products)
+        if not products:
+            return
+        self.remove_products([product.id for product in products])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table_name} (rowid, name, description) VALUES (%s, %s, %s)',
+                [
+                    (
+                        product.id,
+                        ' '.join(tokenize_document(product.name)),
+                        ' '.join(tokenize_document(product.description)),
+                    )
+                    for product in products
+                ],
+            )
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table_name} WHERE rowid IN ({placeholders})', product_ids)
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table_name}')
+
+    def search(self, query, limit=1000):
+        tokens = tokenize_query(query)
+        if not tokens:
+            return []
+        # 每个词元作为一个短语，空格连接表示必须全部命中
+        match = ' '.join('"%s"' % token for token in tokens)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT fts.rowid FROM {self.table_name} AS fts '
+                f'INNER JOIN products_product AS p ON p.id = fts.rowid '
+                f'WHERE {self.table_name} MATCH %s AND p.is_active '
+                f'ORDER BY bm25({self.table_name}, %s, %s), fts.rowid DESC '
+                f'LIMIT %s',
+                [match, float(NAME_WEIGHT), float(DESCRIPTION_WEIGHT), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class MySQLFulltextBackend(BaseSearchBackend):
+    """基于MySQL FULLTEXT索引（ngram解析器）的搜索后端
+
+    迁移products.0003在products_product表上创建 WITH PARSER ngram 的全文索引，
+    InnoDB会随写入自动维护索引，因此索引维护方法均为空操作。
+    ngram索引中最短的词元为ngram_token_size（InnoDB默认2）个字符，
+    更短的关键词（如单个汉字"手"）无法命中全文索引，改用子串匹配。
+    """
+
+    # 布尔检索模式下的特殊字符
+    operator_re = re.compile(r'[+\-<>()~*"@]+')
+    # 与MySQL服务器的ngram_token_size配置保持一致
+    ngram_token_size = 2
+
+    def index_products(self, products):
+        # 全文索引由InnoDB自动维护
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, query, limit=1000):
+        words = self.operator_re.sub(' ', query or '').split()
+        if not words:
+            return []
+        if any(len(word) < self.ngram_token_size for word in words):
+            return self._search_substring(words, limit)
+        # 布尔模式下每个词都必须命中；ngram解析器会把词再切分为短语检索
+        boolean_query = ' '.join(f'+{word}' for word in words)
+        natural_query = ' '.join(words)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT id FROM products_product '
+                'WHERE is_active AND MATCH(name, description) AGAINST (%s IN BOOLEAN MODE) '
+                'ORDER BY MATCH(name) AGAINST (%s) * %s + MATCH(name, description) AGAINST (%s) DESC, id DESC '
+                'LIMIT %s',
+                [boolean_query, natural_query, NAME_WEIGHT, natural_query, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _search_substring(self, words, limit):
+        """子串匹配（无法使用全文索引的短关键词），每个词都必须出现在名称或描述中，名称命中的排在前面"""
+        from ..models import Product
+        products = Product.objects.filter(is_active=True)
+        name_hits = Value(0)
+        for word in words:
+            products = products.filter(Q(name__icontains=word) | Q(description__icontains=word))
+            name_hits = name_hits + Case(When(name__icontains=word, then=Value(1)), default=Value(0))
+        return list(
+            products.annotate(name_hits=name_hits).order_by('-name_hits', '-id').values_list('id', flat=True)[:limit]
+        )
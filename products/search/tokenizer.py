@@ -0,0 +1,66 @@
+# 导入正则模块用于切分中英文文本
+import re
+
+# 中日韩统一表意文字（含扩展A区和兼容区）
+CJK_CHARS = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+# 匹配连续的中文片段或连续的英文/数字片段
+RUN_RE = re.compile(f'[{CJK_CHARS}]+|[0-9a-z]+')
+# 判断片段是否为中文
+CJK_RE = re.compile(f'^[{CJK_CHARS}]')
+# 单个词元的最大长度，与索引表字段长度保持一致
+MAX_TOKEN_LENGTH = 32
+# 英文单词前缀索引的最短长度
+MIN_PREFIX_LENGTH = 2
+
+
+def _cjk_bigrams(run):
+    """将中文片段切分为相邻二元组，例如"苹果手机" -> 苹果 果手 手机"""
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def tokenize_document(text):
+    """切分待索引的文本
+
+    中文同时产出单字和二元组，使单字查询和多字查询都能命中；
+    英文/数字单词产出所有长度不小于2的前缀，使输入半个单词也能命中。
+
+    参数:
+        text: 商品名称或描述
+
+    返回:
+        词元列表（可能包含重复，调用方据此统计词频）
+    """
+    tokens = []
+    for run in RUN_RE.findall((text or '').lower()):
+        if CJK_RE.match(run):
+            tokens.extend(run)
+            tokens.extend(_cjk_bigrams(run))
+        else:
+            word = run[:MAX_TOKEN_LENGTH]
+            if len(word) < MIN_PREFIX_LENGTH:
+                tokens.append(word)
+            else:
+                tokens.extend(word[:i] for i in range(MIN_PREFIX_LENGTH, len(word) + 1))
+    return tokens
+
+
+def tokenize_query(text):
+    """切分搜索关键词
+
+    中文片段长度为1时使用单字，否则使用二元组；英文单词按原样使用，
+    与tokenize_document产出的前缀词元相匹配。
+
+    参数:
+        text: 用户输入的搜索关键词
+
+    返回:
+        去重后的词元列表，保持出现顺序
+    """
+    tokens = []
+    for run in RUN_RE.findall((text or '').lower()):
+        if CJK_RE.match(run):
+            tokens.extend(_cjk_bigrams(run) if len(run) > 1 else [run])
+        else:
+            tokens.append(run[:MAX_TOKEN_LENGTH])
+    # 去重但保持顺序
+    return list(dict.fromkeys(tokens))
@@ -0,0 +1,183 @@
+# 导入transaction用于在事务提交后再使缓存失效
+from django.db import transaction
+# 导入模型信号
+from django.db.models.signals import post_delete, post_save
+# 导入receiver装饰器用于注册信号处理器
+from django.dispatch import receiver
+
+from .autocomplete import autocomplete_index
+from .cache import invalidate_catalog, invalidate_categories
+from .facets import invalidate_facets
+from .models import Category, Product
+from .movements import record_movements
+from .search import get_search_backend
+from .thumbnails import schedule_thumbnails
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def clear_category_cache(sender, **kwargs):
+    """分类保存或删除后使分类缓存失效
+
+    在事务提交后再递增版本号，避免其他进程在提交前重新加载到旧数据
+    """
+    transaction.on_commit(invalidate_categories)
+
+
+# 推荐商品卡片上展示的字段，推荐商品的这些字段变化时需要刷新首页缓存
+FEATURED_CARD_FIELDS = ('name', 'slug', 'image', 'price', 'discount_price', 'is_active', 'is_featured')
+# 价格相关字段，任何商品的价格变化都会递增目录版本号
+PRICE_FIELDS = ('price', 'discount_price')
+
+
+@receiver(post_save, sender=Product)
+def clear_catalog_cache(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """商品保存后按需递增目录版本号
+
+    只有推荐商品（保存前或保存后）的展示字段变化，或任意商品的价格变化时才失效，
+    库存等字段的频繁更新不会影响首页缓存
+    """
+    if raw:
+        return
+    if update_fields is not None and not set(FEATURED_CARD_FIELDS) & set(update_fields):
+        return
+    was_featured = getattr(instance, '_loaded_values', {}).get('is_featured', False)
+    if created:
+        changed = instance.is_featured
+    else:
+        changed = (
+            (instance.is_featured or was_featured) and instance.has_changed(*FEATURED_CARD_FIELDS)
+        ) or instance.has_changed(*PRICE_FIELDS)
+    if changed:
+        transaction.on_commit(invalidate_catalog)
+
+
+@receiver(post_delete, sender=Product)
+def clear_catalog_cache_on_delete(sender, instance, **kwargs):
+    """推荐商品删除后递增目录版本号"""
+    if instance.is_featured:
+        transaction.on_commit(invalidate_catalog)
+
+
+# 影响分面计数的字段
+FACET_FIELDS = ('price', 'discount_price', 'is_active', 'category', 'stock')
+
+
+@receiver(post_save, sender=Product)
+def clear_facet_cache(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """商品保存后按需使所属分类的分面计数失效
+
+    库存只在有货/缺货状态切换时才影响分面，普通的库存增减不会使缓存失效
+    """
+    if raw:
+        return
+    if update_fields is not None and not set(FACET_FIELDS) & set(update_fields):
+        return
+    loaded_values = getattr(instance, '_loaded_values', {})
+    old_category_id = loaded_values.get('category_id', instance.category_id)
+    if created:
+        changed = True
+    elif instance.has_changed('price', 'discount_price', 'is_active', 'category'):
+        changed = True
+    else:
+        old_stock = loaded_values.get('stock', instance.stock)
+        changed = (old_stock > 0) != (instance.stock > 0)
+    if changed:
+        new_category_id = instance.category_id
+        transaction.on_commit(lambda: invalidate_facets(old_category_id, new_category_id))
+
+
+@receiver(post_delete, sender=Product)
+def clear_facet_cache_on_delete(sender, instance, **kwargs):
+    """商品删除后使所属分类的分面计数失效"""
+    category_id = instance.category_id
+    transaction.on_commit(lambda: invalidate_facets(category_id))
+
+
+@receiver(post_save, sender=Product)
+def record_stock_adjustment(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """商品保存时库存被直接修改（新建商品、管理后台改库存）时登记库存流水
+
+    购物车和订单的库存变更走库存服务的条件UPDATE，不会触发这里
+    """
+    if raw or instance.stock_shard_count:
+        # 分片库存商品的Product.stock只是展示值，实际库存在分片中
+        return
+    if update_fields is not None and 'stock' not in update_fields:
+        return
+    loaded_values = getattr(instance, '_loaded_values', {})
+    if created:
+        delta = instance.stock
+    elif 'stock' in loaded_values:
+        delta = instance.stock - loaded_values['stock']
+    else:
+        return
+    if delta:
+        record_movements({instance.id: delta})
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """商品保存后更新搜索索引
+
+    只有名称或描述发生变化时才重建该商品的索引，
+    避免库存等字段的频繁更新带来额外的索引写入
+    """
+    # 加载fixture时跳过
+    if raw:
+        return
+    if update_fields is not None and not {'name', 'description'} & set(update_fields):
+        return
+    if created or instance.has_changed('name', 'description'):
+        get_search_backend().index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    """商品删除后移除搜索索引"""
+    get_search_backend().remove_products([instance.id])
+
+
+@receiver(post_save, sender=Product)
+def generate_product_thumbnails(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """商品图片上传或更换后，在事务提交后提交后台缩略图生成任务"""
+    if raw or not instance.image:
+        return
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if created or instance.has_changed('image'):
+        image_name = instance.image.name
+        transaction.on_commit(lambda: schedule_thumbnails(image_name))
+
+
+@receiver(post_save, sender=Product)
+def update_autocomplete_product(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """商品名称、别名或上下架状态变化后增量更新自动补全索引"""
+    if raw:
+        return
+    if update_fields is not None and not {'name', 'slug', 'is_active'} & set(update_fields):
+        return
+    if created or instance.has_changed('name', 'slug', 'is_active'):
+        transaction.on_commit(lambda: autocomplete_index.update_product(instance))
+
+
+@receiver(post_delete, sender=Product)
+def remove_autocomplete_product(sender, instance, **kwargs):
+    """商品删除后从自动补全索引中移除"""
+    product_id = instance.id
+    transaction.on_commit(lambda: autocomplete_index.remove_product(product_id))
+
+
+@receiver(post_save, sender=Category)
+def update_autocomplete_category(sender, instance, raw=False, **kwargs):
+    """分类保存后更新自动补全索引"""
+    if raw:
+        return
+    transaction.on_commit(lambda: autocomplete_index.update_category(instance))
+
+
+@receiver(post_delete, sender=Category)
+def remove_autocomplete_category(sender, instance, **kwargs):
+    """分类删除后从自动补全索引中移除"""
+    category_id = instance.id
+    transaction.on_commit(lambda: autocomplete_index.remove_category(category_id))
@@ -0,0 +1,15 @@
+"""商品模块的后台任务（由 python manage.py run_tasks 执行，见 orders.tasks）"""
+from orders.tasks import enqueue, register_task
+
+from .inventory import sync_sharded_stock
+
+
+@register_task('products.sync_sharded_stock')
+def sync_sharded_stock_task(product_id):
+    """把分片库存商品的分片之和同步到Product.stock"""
+    sync_sharded_stock(product_id)
+
+
+def schedule_sharded_stock_sync(product_id, delay):
+    """在当前事务提交后安排一次延迟delay秒的分片库存同步"""
+    enqueue('products.sync_sharded_stock', delay=delay, product_id=product_id)
@@ -0,0 +1,66 @@
+# 导入模板库
+from django import template
+# 导入默认存储用于生成缩略图URL
+from django.core.files.storage import default_storage
+# 导入format_html安全地拼接HTML
+from django.utils.html import format_html
+
+from products.thumbnails import THUMBNAIL_SIZES, thumbnail_name, thumbnails_ready
+
+register = template.Library()
+
+# 不同展示位置对应的sizes属性，告诉浏览器图片的实际显示宽度
+DISPLAY_SIZES = {
+    'small': '(max-width: 768px) 100vw, 300px',
+    'medium': '(max-width: 768px) 100vw, 600px',
+}
+
+
+def _srcset(image_name, extension):
+    """生成某个格式全部尺寸的srcset字符串"""
+    return ', '.join(
+        f'{default_storage.url(thumbnail_name(image_name, size, extension))} {width}w'
+        for size, (width, _) in sorted(THUMBNAIL_SIZES.items(), key=lambda item: item[1])
+    )
+
+
+@register.simple_tag
+def product_image(product, size='small', css_class='', style=''):
+    """输出商品图片
+
+    缩略图就绪时输出带WebP和JPEG两组srcset的<picture>元素，浏览器按屏幕宽度和
+    格式支持选择最合适的文件；缩略图尚未生成时回退到原图；没有图片时使用占位图。
+
+    用法:
+        {% load product_images %}
+        {% product_image product 'small' css_class='card-img-top' style='height: 200px;' %}
+
+    参数:
+        product: 商品对象
+        size: 展示尺寸，small(列表卡片) 或 medium(详情页)
+        css_class: img元素的class
+        style: img元素的style
+    """
+    width, height = THUMBNAIL_SIZES[size]
+    if not product.image:
+        return format_html(
+            '<img src="https://picsum.photos/{}/{}?random={}" class="{}" alt="{}" style="{}" loading="lazy">',
+            width, height, product.id, css_class, product.name, style,
+        )
+
+    image_name = product.image.name
+    if not thumbnails_ready(image_name):
+        return format_html(
+            '<img src="{}" class="{}" alt="{}" style="{}" loading="lazy">',
+            product.image.url, css_class, product.name, style,
+        )
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" class="{}" alt="{}" style="{}" loading="lazy">'
+        '</picture>',
+        _srcset(image_name, 'webp'), DISPLAY_SIZES[size],
+        default_storage.url(thumbnail_name(image_name, size, 'jpg')), _srcset(image_name, 'jpg'), DISPLAY_SIZES[size],
+        width, height, css_class, product.name, style,
+    )
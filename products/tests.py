@@ -1,3 +1,273 @@
+import base64
+import json
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.test import TestCase
+from django.utils import timezone
+
+from orders.models import BackgroundTask
+from orders.tasks import claim_tasks, run_task
+
+from .autocomplete import PrefixIndex
+from .facets import get_facet_counts
+from .inventory import release_stock_many, reserve_stock, reserve_stock_many
+from .models import Category, Product, StockShard
+from .pagination import KeysetPaginator
+from .search import MySQLFulltextBackend
+from .thumbnails import thumbnails_ready
+
+
+class StockFacetInvalidationTests(TestCase):
+    """库存服务的条件UPDATE不触发信号，售罄和补货时仍要使分面计数失效"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='手机', slug='phones', is_active=True)
+        self.product = Product.objects.create(
+            name='手机A', slug='phone-a', category=self.category,
+            price=Decimal('999.00'), stock=1, is_active=True,
+        )
+        self.other = Product.objects.create(
+            name='手机B', slug='phone-b', category=self.category,
+            price=Decimal('1999.00'), stock=5, is_active=True,
+        )
+
+    def in_stock_count(self):
+        queryset = Product.objects.filter(category=self.category, is_active=True)
+        return get_facet_counts(queryset, self.category)['in_stock']
+
+    def test_reserving_last_unit_invalidates_facets(self):
+        self.assertEqual(self.in_stock_count(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(reserve_stock(self.product.id, 1))
+        self.assertEqual(self.in_stock_count(), 1)
+
+    def test_batch_reserve_and_release_invalidate_facets(self):
+        self.assertEqual(self.in_stock_count(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(reserve_stock_many({self.product.id: 1, self.other.id: 1}))
+        self.assertEqual(self.in_stock_count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release_stock_many({self.product.id: 1})
+        self.assertEqual(self.in_stock_count(), 2)
+
+    def test_partial_reserve_keeps_facets(self):
+        self.assertEqual(self.in_stock_count(), 2)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertTrue(reserve_stock(self.other.id, 1))
+        # 库存仍大于0，不需要使缓存失效
+        self.assertEqual(callbacks, [])
+
+
+class ProductDetailConditionalGetTests(TestCase):
+    """商品详情页的条件请求"""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='手机', slug='phones', is_active=True)
+        self.product = Product.objects.create(
+            name='手机A', slug='phone-a', category=category,
+            price=Decimal('999.00'), stock=5, is_active=True,
+        )
+        self.url = f'/products/{self.product.id}/{self.product.slug}/'
+
+    def test_unchanged_page_returns_304(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_cart(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(f'/cart/add/{self.product.id}/')
+        # 取走加入购物车的提示消息
+        self.client.get('/cart/')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class CatalogFeedTests(TestCase):
+    """商品数据接口"""
+
+    def setUp(self):
+        category = Category.objects.create(name='手机', slug='phones', is_active=True)
+        self.product = Product.objects.create(
+            name='手机A', slug='phone-a', category=category,
+            price=Decimal('999.00'), stock=5, is_active=True,
+        )
+
+    def test_full_export(self):
+        response = self.client.get('/products/api/catalog/')
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.product.id])
+
+    def test_invalid_updated_since_returns_400(self):
+        for value in ('yesterday', '2024-13-45T00:00:00'):
+            response = self.client.get('/products/api/catalog/', {'updated_since': value})
+            self.assertEqual(response.status_code, 400)
+
+
+class PrefixIndexTests(TestCase):
+    """自动补全前缀索引"""
+
+    def test_load_matches_incremental_add(self):
+        items = [
+            ('product', 1, 'Apple iPhone 15', '/p/1/'),
+            ('product', 2, 'Xiaomi 14', '/p/2/'),
+            ('category', 3, '手机 配件', '/c/3/'),
+        ]
+        loaded, added = PrefixIndex(), PrefixIndex()
+        loaded.load(items)
+        for item in items:
+            added.add(*item)
+        self.assertEqual(loaded._entries, added._entries)
+        self.assertEqual([item['label'] for item in loaded.lookup('iph')], ['Apple iPhone 15'])
+        self.assertEqual([item['label'] for item in loaded.lookup('配')], ['手机 配件'])
+
+
+class ThumbnailsReadyTests(TestCase):
+    """缩略图就绪状态带缓存，渲染时不必每次访问存储"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_storage_checked_once(self):
+        with mock.patch.object(default_storage, 'exists', return_value=True) as exists:
+            self.assertTrue(thumbnails_ready('products/phone.png'))
+            self.assertTrue(thumbnails_ready('products/phone.png'))
+        self.assertEqual(exists.call_count, 1)
+
+    def test_pending_result_is_cached_briefly(self):
+        with mock.patch.object(default_storage, 'exists', return_value=False) as exists:
+            self.assertFalse(thumbnails_ready('products/phone.png'))
+            self.assertFalse(thumbnails_ready('products/phone.png'))
+        self.assertEqual(exists.call_count, 1)
+
+
+class ShardedStockSyncTests(TestCase):
+    """分片库存商品的展示库存同步"""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='抢购', slug='flash', is_active=True)
+        self.product = Product.objects.create(
+            name='抢购商品', slug='flash-a', category=category,
+            price=Decimal('99.00'), stock=0, is_active=True,
+        )
+        Product.objects.filter(id=self.product.id).update(stock=2, stock_shard_count=2)
+        StockShard.objects.bulk_create([StockShard(product=self.product, shard=shard, stock=1) for shard in range(2)])
+
+    def display_stock(self):
+        return Product.objects.values_list('stock', flat=True).get(id=self.product.id)
+
+    def test_changes_within_interval_are_synced_later(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(reserve_stock(self.product.id, 1))
+        self.assertEqual(self.display_stock(), 1)
+
+        # 同一间隔内的第二次扣减不立即同步，而是安排一次延迟的同步任务
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(reserve_stock(self.product.id, 1))
+        self.assertEqual(self.display_stock(), 1)
+        task = BackgroundTask.objects.get(name='products.sync_sharded_stock')
+        self.assertGreater(task.run_at, timezone.now())
+        self.assertEqual(claim_tasks(10), [])
+
+        BackgroundTask.objects.filter(id=task.id).update(run_at=timezone.now())
+        [task] = claim_tasks(10)
+        self.assertTrue(run_task(task))
+        self.assertEqual(self.display_stock(), 0)
+
+    def test_failed_reserve_syncs_stale_display(self):
+        StockShard.objects.filter(product=self.product).update(stock=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(reserve_stock_many({self.product.id: 1}))
+        self.assertEqual(self.display_stock(), 0)
+
+    def test_admin_stock_is_read_only_for_sharded_products(self):
+        product_admin = admin.site._registry[Product]
+        self.assertIn('stock', product_admin.get_readonly_fields(None, Product.objects.get(id=self.product.id)))
+        self.assertNotIn('stock', product_admin.get_readonly_fields(None, None))
+
+
+class MySQLFulltextBackendTests(TestCase):
+    """MySQL全文检索后端对短关键词回退到子串匹配（这部分不依赖MySQL）"""
+
+    def setUp(self):
+        category = Category.objects.create(name='手机', slug='phones', is_active=True)
+        self.phone = Product.objects.create(
+            name='小米手机', slug='phone', category=category, price=Decimal('999.00'), stock=5, is_active=True,
+        )
+        self.case = Product.objects.create(
+            name='保护壳', slug='case', category=category, price=Decimal('29.00'), stock=5, is_active=True,
+            description='适用于各种手机',
+        )
+
+    def test_single_character_query(self):
+        self.assertEqual(MySQLFulltextBackend().search('手'), [self.phone.id, self.case.id])
+        self.assertEqual(MySQLFulltextBackend().search('壳'), [self.case.id])
+
+
+class KeysetPaginatorTests(TestCase):
+    """键集分页: 游标编解码、排序键相同时按id区分、向前翻页、无效游标"""
+
+    def setUp(self):
+        category = Category.objects.create(name='手机', slug='phones', is_active=True)
+        for index in range(5):
+            Product.objects.create(
+                name=f'手机{index}', slug=f'phone-{index}', category=category,
+                price=Decimal('100.00'), stock=5, is_active=True,
+            )
+        # 全部商品的创建时间相同，只能靠id区分先后
+        self.created_at = timezone.now()
+        Product.objects.update(created_at=self.created_at)
+        self.ids = list(Product.objects.order_by('-id').values_list('id', flat=True))
+        self.paginator = KeysetPaginator(Product.objects.all(), per_page=2)
+
+    def ids_of(self, page):
+        return [product.id for product in page]
+
+    def test_cursor_round_trip(self):
+        product = Product.objects.get(id=self.ids[0])
+        cursor = self.paginator.encode_cursor(product)
+        self.assertEqual(self.paginator.decode_cursor(cursor), [self.created_at, product.id])
+
+    def test_ties_on_created_at_are_broken_by_id(self):
+        seen = []
+        page = self.paginator.page()
+        seen += self.ids_of(page)
+        while page.has_next:
+            page = self.paginator.page(after=page.next_cursor)
+            seen += self.ids_of(page)
+        self.assertEqual(seen, self.ids)
+        self.assertFalse(page.has_next)
+        self.assertTrue(page.has_previous)
+
+    def test_backward_paging(self):
+        first = self.paginator.page()
+        second = self.paginator.page(after=first.next_cursor)
+        third = self.paginator.page(after=second.next_cursor)
+        self.assertEqual(self.ids_of(third), self.ids[4:])
+
+        page = self.paginator.page(before=third.previous_cursor)
+        self.assertEqual(self.ids_of(page), self.ids[2:4])
+        self.assertTrue(page.has_next)
+        self.assertTrue(page.has_previous)
+        page = self.paginator.page(before=page.previous_cursor)
+        self.assertEqual(self.ids_of(page), self.ids[:2])
+        self.assertFalse(page.has_previous)
 
-# Create your tests here.
+    def test_invalid_cursor_returns_first_page(self):
+        wrong_length = KeysetPaginator(Product.objects.all(), ordering=('-id',)).encode_cursor(Product.objects.first())
+        wrong_type = base64.urlsafe_b64encode(b'["yesterday","x"]').decode('ascii')
+        for cursor in ('garbage!!', '%%%', wrong_length, wrong_type):
+            for page in (self.paginator.page(after=cursor), self.paginator.page(before=cursor)):
+                self.assertEqual(self.ids_of(page), self.ids[:2])
+                self.assertFalse(page.has_previous)
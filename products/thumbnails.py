@@ -0,0 +1,174 @@
+"""商品图片缩略图
+
+商品图片上传后，在后台线程池中生成固定尺寸的JPEG和WebP缩略图，
+存放在 MEDIA_ROOT/products/thumbs/ 下，文件名由原图名和尺寸决定:
+    products/phone.png -> products/thumbs/phone-png_300x200.jpg
+                          products/thumbs/phone-png_300x200.webp
+模板通过 {% product_image %} 标签输出带srcset的<picture>元素，
+缩略图尚未生成时回退到原图。缩略图是否就绪缓存在Django缓存中，
+列表页渲染时不必为每个商品卡片访问一次存储。
+"""
+# 导入hashlib生成缓存键（原图路径可能包含缓存后端不接受的字符）
+import hashlib
+# 导入io用于在内存中编码图片
+import io
+# 导入logging记录后台任务的异常
+import logging
+# 导入posixpath拼接存储路径（存储路径始终使用/分隔）
+import posixpath
+# 导入线程锁和线程池
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+# 导入Django缓存框架，缓存缩略图是否就绪
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+# 缩略图尺寸: 名称 -> (宽, 高)
+THUMBNAIL_SIZES = {
+    'small': (300, 200),
+    'medium': (600, 400),
+}
+# 输出格式: 扩展名 -> (Pillow格式名, 编码参数)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+# 缩略图存放目录（相对MEDIA_ROOT）
+THUMBNAIL_DIR = 'products/thumbs'
+# 缩略图已就绪的缓存时间（秒），生成完成时直接写入
+THUMBNAILS_READY_TIMEOUT = 24 * 60 * 60
+# 缩略图尚未就绪的缓存时间（秒），其他进程生成完成后最多这么久才会改用缩略图
+THUMBNAILS_PENDING_TIMEOUT = 60
+
+# 后台线程池，首次使用时创建
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def thumbnail_name(image_name, size, extension):
+    """计算缩略图在存储中的路径
+
+    参数:
+        image_name: 原图在存储中的路径，如 products/phone.png
+        size: THUMBNAIL_SIZES中的名称
+        extension: THUMBNAIL_FORMATS中的扩展名
+    """
+    width, height = THUMBNAIL_SIZES[size]
+    stem, original_extension = posixpath.splitext(posixpath.basename(image_name))
+    # 保留原扩展名，避免 phone.png 和 phone.jpg 的缩略图互相覆盖
+    if original_extension:
+        stem = f'{stem}-{original_extension[1:].lower()}'
+    return posixpath.join(THUMBNAIL_DIR, f'{stem}_{width}x{height}.{extension}')
+
+
+def _variants():
+    """按生成顺序列出所有(尺寸, 扩展名)组合
+
+    small的JPEG放在最后生成，模板以它是否存在判断整组缩略图是否就绪
+    """
+    variants = [
+        (size, extension)
+        for size in sorted(THUMBNAIL_SIZES, key=lambda name: THUMBNAIL_SIZES[name], reverse=True)
+        for extension in THUMBNAIL_FORMATS
+    ]
+    variants.remove(('small', 'jpg'))
+    variants.append(('small', 'jpg'))
+    return variants
+
+
+def _thumbnails_exist(image_name):
+    """检查存储中原图的缩略图是否已全部生成（访问存储，不使用缓存）"""
+    return default_storage.exists(thumbnail_name(image_name, 'small', 'jpg'))
+
+
+def _ready_cache_key(image_name):
+    """原图缩略图就绪状态的缓存键"""
+    return f'products:thumbnails_ready:{hashlib.md5(image_name.encode("utf-8")).hexdigest()}'
+
+
+def thumbnails_ready(image_name):
+    """判断原图的缩略图是否已全部生成（带缓存，供模板渲染时调用）"""
+    key = _ready_cache_key(image_name)
+    ready = cache.get(key)
+    if ready is None:
+        ready = _thumbnails_exist(image_name)
+        cache.set(key, ready, THUMBNAILS_READY_TIMEOUT if ready else THUMBNAILS_PENDING_TIMEOUT)
+    return ready
+
+
+def generate_thumbnails(image_name, force=False):
+    """为一张原图生成全部尺寸和格式的缩略图
+
+    参数:
+        image_name: 原图在存储中的路径
+        force: 为True时覆盖已存在的缩略图
+
+    返回:
+        本次生成的缩略图数量
+    """
+    # Pillow是ImageField的依赖，这里延迟导入以免影响不处理图片的进程
+    from PIL import Image, ImageOps
+
+    if not force and _thumbnails_exist(image_name):
+        cache.set(_ready_cache_key(image_name), True, THUMBNAILS_READY_TIMEOUT)
+        return 0
+
+    with default_storage.open(image_name, 'rb') as source:
+        original = Image.open(source)
+        original.load()
+    # 按EXIF方向旋转，避免手机照片缩略图方向错误
+    original = ImageOps.exif_transpose(original)
+
+    generated = 0
+    for size, extension in _variants():
+        pillow_format, options = THUMBNAIL_FORMATS[extension]
+        # 按目标比例居中裁剪后缩放，与页面上object-fit: cover的效果一致
+        thumbnail = ImageOps.fit(original, THUMBNAIL_SIZES[size], Image.LANCZOS)
+        if pillow_format == 'JPEG' and thumbnail.mode != 'RGB':
+            thumbnail = thumbnail.convert('RGB')
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, pillow_format, **options)
+
+        name = thumbnail_name(image_name, size, extension)
+        # 存储在同名文件存在时会自动改名，这里先删除以保证路径固定
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        default_storage.save(name, ContentFile(buffer.getvalue()))
+        generated += 1
+    # 全部生成后记录为就绪，模板不再访问存储
+    cache.set(_ready_cache_key(image_name), True, THUMBNAILS_READY_TIMEOUT)
+    return generated
+
+
+def _get_executor():
+    """获取后台线程池（进程内单例）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+                thread_name_prefix='thumbnails',
+            )
+    return _executor
+
+
+def _generate_in_background(image_name):
+    """线程池中执行的任务，异常只记录日志不向外抛出"""
+    try:
+        generate_thumbnails(image_name, force=True)
+    except Exception:
+        logger.exception(f'生成缩略图失败: {image_name}')
+        return
+    # 首页推荐片段可能已用原图渲染并缓存，缩略图就绪后使其失效
+    from .cache import invalidate_catalog
+    invalidate_catalog()
+
+
+def schedule_thumbnails(image_name):
+    """提交后台缩略图生成任务，立即返回"""
+    return _get_executor().submit(_generate_in_background, image_name)
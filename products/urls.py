@@ -23,4 +23,12 @@ urlpatterns = [
     # 商品搜索路由
     # 匹配搜索路径，调用product_search视图函数
     path('search/', views.product_search, name='product_search'),
+
+    # 搜索自动补全路由
+    # 根据输入前缀返回商品和分类建议，供导航栏搜索框使用
+    path('search/suggest/', views.product_suggest, name='product_suggest'),
+
+    # 商品数据接口路由
+    # 以NDJSON流式输出商品数据，支持updated_since增量同步
+    path('api/catalog/', views.catalog_feed, name='catalog_feed'),
 ]
\ No newline at end of file
@@ -1,13 +1,103 @@
+# 导入sync_to_async，在异步视图中调用同步代码（缓存读取、模板渲染）
+from asgiref.sync import sync_to_async
 # 导入Django的render函数，用于渲染模板
 from django.shortcuts import render
 # 导入get_object_or_404函数，用于获取对象或返回404错误
 from django.shortcuts import get_object_or_404
+# 导入hashlib用于生成ETag
+import hashlib
+# 导入datetime.timezone用于给不带时区的时间补上UTC
+import datetime
+# 导入json用于序列化商品数据
+import json
+# 导入Http404用于分类不存在时返回404错误
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+# 导入JSON编码器，支持Decimal和datetime
+from django.core.serializers.json import DjangoJSONEncoder
+# 导入Q对象用于构建分批读取的游标条件
+from django.db.models import Q
+# 导入reverse用于生成商品详情页地址
+from django.urls import reverse
+# 导入日期解析和时区工具
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+# 导入消息框架，有待显示的消息时不能返回304
+from django.contrib import messages
+# 导入条件请求和缓存控制装饰器
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 # 导入当前应用的模型
-from .models import Product, Category
+from .models import Product
+# 导入购物车接口，详情页的ETag包含导航栏的购物车摘要
+from carts.cart import get_cart
+# 导入分类缓存
+from .cache import get_active_categories, get_active_category
+# 导入键集分页器和相关度结果分页器
+from .pagination import KeysetPaginator, RankedPaginator
+# 导入搜索后端
+from .search import get_search_backend
+# 导入自动补全索引
+from .autocomplete import autocomplete_index
+# 导入分面筛选
+from .facets import apply_facet_filters, build_facet_options, get_facet_counts, parse_facet_filters
 
+# 列表页每页显示的商品数量
+PRODUCTS_PER_PAGE = 20
+# 列表页排序方式: 参数值 -> (显示名称, 排序键)
+# 排序键最后的id保证排序唯一，供键集分页定位；价格排序使用带索引的final_price列
+PRODUCT_SORTS = {
+    'newest': ('最新上架', ('-created_at', '-id')),
+    'price_asc': ('价格从低到高', ('final_price', 'id')),
+    'price_desc': ('价格从高到低', ('-final_price', '-id')),
+}
+# 默认排序方式
+DEFAULT_PRODUCT_SORT = 'newest'
+# 搜索结果的最大数量，超出部分不再分页展示
+SEARCH_MAX_RESULTS = 1000
 
-def product_list(request, category_slug=None):
-    """商品列表页，支持按分类筛选
+
+def _product_paginator(products, sort):
+    """按PRODUCT_SORTS中的排序方式创建键集分页器"""
+    ordering = PRODUCT_SORTS[sort][1]
+    return KeysetPaginator(products, ordering=ordering, per_page=PRODUCTS_PER_PAGE)
+
+
+def paginate_products(request, products, sort=DEFAULT_PRODUCT_SORT):
+    """对商品查询集做键集分页
+
+    参数:
+        request: HTTP请求对象，从中读取after/before游标
+        products: 待分页的商品查询集
+        sort: PRODUCT_SORTS中的排序方式
+
+    返回:
+        KeysetPage对象
+    """
+    return _product_paginator(products, sort).page_from_request(request)
+
+
+async def apaginate_products(request, products, sort=DEFAULT_PRODUCT_SORT):
+    """paginate_products的异步版本"""
+    return await _product_paginator(products, sort).apage_from_request(request)
+
+
+def build_sort_options(params, current):
+    """生成模板使用的排序选项，切换排序时去掉分页游标"""
+    options = []
+    for key, (label, _) in PRODUCT_SORTS.items():
+        query = params.copy()
+        for name in ('after', 'before'):
+            query.pop(name, None)
+        query['sort'] = key
+        options.append({'label': label, 'selected': key == current, 'query': query.urlencode()})
+    return options
+
+
+async def product_list(request, category_slug=None):
+    """商品列表页，支持按分类、价格区间、有货和折扣筛选，以及按价格排序
+
+    异步视图: 查询和模板渲染在Django的同步线程中依次执行（sync_to_async默认thread_sensitive），
+    等待期间不占用事件循环，但同一请求内的查询不会并行
 
     参数:
         request: HTTP请求对象
@@ -18,28 +108,100 @@ def product_list(request, category_slug=None):
     """
     # 初始化分类变量为None
     category = None
-    # 获取所有激活的分类
-    categories = Category.objects.filter(is_active=True)
+    # 获取所有激活的分类（来自缓存，版本号读取是同步的缓存调用）
+    categories = await sync_to_async(get_active_categories)()
     # 获取所有激活的商品
     products = Product.objects.filter(is_active=True)
 
     # 如果提供了分类别名，则筛选该分类下的商品
     if category_slug:
-        # 获取指定别名的分类，如果不存在则返回404错误
-        category = get_object_or_404(Category, slug=category_slug, is_active=True)
+        # 在已取回的分类中查找指定别名的分类，如果不存在则返回404错误
+        category = get_active_category(category_slug, categories)
+        if category is None:
+            raise Http404('分类不存在')
         # 筛选该分类下的商品
         products = products.filter(category=category)
 
+    # 解析价格区间、有货、折扣筛选
+    filters = parse_facet_filters(request.GET)
+
+    # 排序方式，无效参数时使用默认排序
+    sort = request.GET.get('sort')
+    if sort not in PRODUCT_SORTS:
+        sort = DEFAULT_PRODUCT_SORT
+
+    # 分面计数基于分类下的全部上架商品（带缓存），与当前筛选条件无关
+    facets = await sync_to_async(get_facet_counts)(products, category)
+    # 当前页商品用键集分页只取一页
+    page = await apaginate_products(request, apply_facet_filters(products, filters), sort)
+
     # 准备上下文数据
     context = {
         'category': category,       # 当前选中的分类
         'categories': categories,   # 所有激活的分类
-        'products': products        # 筛选后的商品列表
+        'products': page,           # 当前页的商品列表
+        'page': page,               # 分页信息
+        'facet_options': build_facet_options(request.GET, facets, filters),  # 分面筛选选项
+        'sort_options': build_sort_options(request.GET, sort)  # 排序选项
     }
-    # 渲染模板并返回响应
-    return render(request, 'products_list.html', context)
+    # 渲染模板并返回响应（上下文处理器会读取request.user，须在同步线程中执行）
+    return await sync_to_async(render)(request, 'products_list.html', context)
+
+
+def _product_freshness(request, id, slug):
+    """获取商品详情页的新鲜度信息
+
+    只查询商品和所属分类的updated_at两列，结果缓存在request上，
+    供ETag和Last-Modified两个函数共用，保证预检查只有一次查询
+
+    返回:
+        (商品更新时间, 分类更新时间)，商品不存在或有待显示的消息时返回None
+    """
+    if not hasattr(request, '_product_freshness'):
+        freshness = None
+        # 有待显示的消息时（如"该商品暂时缺货"）必须完整渲染页面
+        if not len(messages.get_messages(request)):
+            freshness = (
+                Product.objects.filter(id=id, slug=slug, is_active=True)
+                .values_list('updated_at', 'category__updated_at')
+                .first()
+            )
+        request._product_freshness = freshness
+    return request._product_freshness
+
+
+def product_detail_etag(request, id, slug):
+    """商品详情页的ETag
+
+    页面导航栏包含用户名和购物车徽标，因此ETag中包含用户id和购物车摘要，
+    不同用户互不命中，修改购物车后再访问也会重新渲染
+    （请求同时带有If-None-Match时Django不再比较If-Modified-Since，Last-Modified不会绕过这里）
+    """
+    freshness = _product_freshness(request, id, slug)
+    if freshness is None:
+        return None
+    product_updated_at, category_updated_at = freshness
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    # 与导航栏相同，读取会话中缓存的摘要
+    summary = get_cart(request).summary()
+    raw = (
+        f'{id}:{product_updated_at.timestamp()}:{category_updated_at.timestamp()}:{user_id}:'
+        f'{summary["lines"]}:{summary["items"]}:{summary["total"]}'
+    )
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
 
+def product_detail_last_modified(request, id, slug):
+    """商品详情页的Last-Modified，取商品和分类更新时间中较晚的一个"""
+    freshness = _product_freshness(request, id, slug)
+    if freshness is None:
+        return None
+    return max(freshness)
 
+
+# 客户端和中间缓存每次使用前都必须重新验证，验证通过时返回304
+@cache_control(max_age=0, must_revalidate=True)
+@condition(etag_func=product_detail_etag, last_modified_func=product_detail_last_modified)
 def product_detail(request, id, slug):
     """商品详情页
 
@@ -51,8 +213,9 @@ def product_detail(request, id, slug):
     返回:
         渲染后的商品详情页面
     """
-    # 获取指定ID和别名的商品，如果不存在则返回404错误
-    product = get_object_or_404(Product, id=id, slug=slug, is_active=True)
+    # 条件请求命中时condition装饰器已直接返回304，不会执行到这里
+    # 获取指定ID和别名的商品，如果不存在则返回404错误，同时加载分类供模板使用
+    product = get_object_or_404(Product.objects.select_related('category'), id=id, slug=slug, is_active=True)
 
     # 准备上下文数据
     context = {
@@ -62,9 +225,11 @@ def product_detail(request, id, slug):
     return render(request, 'products_detail.html', context)
 
 
-def product_search(request):
+async def product_search(request):
     """商品搜索功能
 
+    异步视图: 搜索、分页查询和模板渲染在Django的同步线程中依次执行，等待期间不占用事件循环
+
     参数:
         request: HTTP请求对象
 
@@ -72,24 +237,130 @@ def product_search(request):
         渲染后的搜索结果页面
     """
     # 从GET请求参数中获取搜索关键词，默认为空字符串
-    query = request.GET.get('q', '')
+    query = request.GET.get('q', '').strip()
 
-    # 如果有搜索关键词，则按名称模糊搜索
+    # 如果有搜索关键词，则交给搜索后端按相关度检索，再对排好序的结果分页
     if query:
-        products = Product.objects.filter(
-            is_active=True,
-            name__icontains=query  # 按商品名称不区分大小写模糊搜索
-        )
-    # 如果没有搜索关键词，则返回所有激活的商品
+        ranked_ids = await sync_to_async(get_search_backend().search)(query, limit=SEARCH_MAX_RESULTS)
+        paginator = RankedPaginator(ranked_ids, Product.objects.filter(is_active=True), per_page=PRODUCTS_PER_PAGE)
+        page = await paginator.apage_from_request(request)
+    # 如果没有搜索关键词，则按时间顺序分页显示所有激活的商品
     else:
-        products = Product.objects.filter(is_active=True)
+        page = await apaginate_products(request, Product.objects.filter(is_active=True))
 
-    # 获取所有激活的分类
-    categories = Category.objects.filter(is_active=True)
+    # 获取所有激活的分类（来自缓存）
+    categories = await sync_to_async(get_active_categories)()
 
     # 渲染模板并返回响应
-    return render(request, 'products_list.html', {
-        'products': products,   # 搜索结果商品列表
+    return await sync_to_async(render)(request, 'products_list.html', {
+        'products': page,       # 当前页的搜索结果商品列表
+        'page': page,           # 分页信息
         'categories': categories,  # 所有激活的分类
         'query': query          # 搜索关键词
-    })
\ No newline at end of file
+    })
+
+
+# 自动补全结果可被浏览器短暂缓存，连续输入相同前缀时不再发请求
+@cache_control(max_age=60)
+def product_suggest(request):
+    """搜索框自动补全
+
+    从进程内前缀索引中查询，不访问数据库
+
+    GET参数:
+        q: 用户已输入的前缀
+
+    返回:
+        JSON: {"query": 前缀, "suggestions": [{"label", "type", "url"}, ...]}
+    """
+    query = request.GET.get('q', '').strip()[:50]
+    suggestions = autocomplete_index.lookup(query) if query else []
+    return JsonResponse({'query': query, 'suggestions': suggestions}, json_dumps_params={'ensure_ascii': False})
+
+
+# 商品数据接口每批读取的行数
+FEED_BATCH_SIZE = 2000
+# 商品数据接口输出的字段
+FEED_FIELDS = (
+    'id', 'name', 'slug', 'category__slug', 'price', 'discount_price',
+    'final_price', 'stock', 'is_active', 'updated_at',
+)
+
+
+def _iter_feed_rows(queryset):
+    """按 (updated_at, id) 顺序分批读取商品字典
+
+    每批都用上一批最后一行的 (updated_at, id) 定位（键集分页），而不是一条
+    长时间打开的游标: MySQL驱动会把整个结果集读入内存，分批读取才能让内存占用
+    与商品总数无关。使用values()直接返回字典，不创建模型实例。
+    """
+    last = None
+    while True:
+        batch = queryset
+        if last is not None:
+            batch = batch.filter(
+                Q(updated_at__gt=last['updated_at']) | Q(updated_at=last['updated_at'], id__gt=last['id'])
+            )
+        rows = list(batch.order_by('updated_at', 'id').values(*FEED_FIELDS)[:FEED_BATCH_SIZE])
+        yield from rows
+        if len(rows) < FEED_BATCH_SIZE:
+            return
+        last = rows[-1]
+
+
+def _serialize_feed_row(request, row):
+    """将一行商品字典序列化为JSON字符串"""
+    row['category'] = row.pop('category__slug')
+    # 保留微秒精度（DjangoJSONEncoder会截断到毫秒），并用Z表示UTC，
+    # 合作方可直接把最后一行的值用作下次请求的updated_since
+    row['updated_at'] = row['updated_at'].astimezone(datetime.timezone.utc).isoformat().replace('+00:00', 'Z')
+    row['url'] = request.build_absolute_uri(reverse('product_detail', args=[row['id'], row['slug']]))
+    return json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+def catalog_feed(request):
+    """商品数据接口（只读，流式输出）
+
+    供比价合作方拉取商品数据，避免抓取HTML列表页。
+
+    GET参数:
+        updated_since: ISO 8601时间，只返回此后更新过的商品（含已下架商品，
+                       以is_active=false表示），用于增量同步；不传时返回全部上架商品
+        format: ndjson（默认，每行一个JSON对象）或 json（JSON数组）
+
+    返回:
+        StreamingHttpResponse，按 (updated_at, id) 升序输出
+    """
+    queryset = Product.objects.all()
+    updated_since = request.GET.get('updated_since')
+    if updated_since:
+        try:
+            since = parse_datetime(updated_since)
+        except ValueError:
+            # 格式正确但日期无效（如13月45日）时parse_datetime抛出ValueError
+            since = None
+        if since is None:
+            return HttpResponseBadRequest('updated_since参数格式错误，应为ISO 8601时间')
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since, datetime.timezone.utc)
+        queryset = queryset.filter(updated_at__gt=since)
+    else:
+        # 全量导出只包含上架商品
+        queryset = queryset.filter(is_active=True)
+
+    rows = (_serialize_feed_row(request, row) for row in _iter_feed_rows(queryset))
+
+    if request.GET.get('format') == 'json':
+        def stream():
+            yield '['
+            for index, line in enumerate(rows):
+                yield (',\n' if index else '\n') + line
+            yield '\n]\n'
+        content_type = 'application/json; charset=utf-8'
+    else:
+        def stream():
+            for line in rows:
+                yield line + '\n'
+        content_type = 'application/x-ndjson; charset=utf-8'
+
+    return StreamingHttpResponse(stream(), content_type=content_type)
@@ -41,6 +41,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',  # 处理常见请求/响应
     'django.middleware.csrf.CsrfViewMiddleware',  # CSRF保护中间件
     'django.contrib.auth.middleware.AuthenticationMiddleware',  # 认证中间件
+    'carts.middleware.CartCookieMiddleware',  # 匿名访客购物车Cookie中间件
     'django.contrib.messages.middleware.MessageMiddleware',  # 消息中间件
     'django.middleware.clickjacking.XFrameOptionsMiddleware',  # 防点击劫持中间件
 ]
@@ -90,6 +91,18 @@ DATABASES = {
     }
 }
 
+# 缓存配置
+# 开发环境使用进程内缓存；生产环境多进程部署时必须改为共享缓存（如Redis），
+# 否则分类等缓存的版本号无法在进程间同步，例如:
+# 'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+# 'LOCATION': 'redis://127.0.0.1:6379/1',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'taoduoduo',
+    }
+}
+
 # 密码验证规则
 # 定义用户密码的验证规则
 AUTH_PASSWORD_VALIDATORS = [
@@ -131,6 +144,27 @@ LOGIN_URL = 'login'
 # 登录成功后重定向的URL
 # LOGIN_REDIRECT_URL = 'home'
 
+# 购物车库存预留的有效期（分钟），到期后由 python manage.py release_expired_reservations 归还库存
+CART_RESERVATION_MINUTES = 30
+
+# 分片库存商品把各分片之和同步到商品表（用于展示和筛选）的最小间隔（秒）
+STOCK_SHARD_SYNC_SECONDS = 5
+
+# 库存流水合并到快照后保留的天数，由 python manage.py compact_stock_movements 清理（None表示不删除）
+STOCK_MOVEMENT_KEEP_DAYS = 90
+
+# 生成商品缩略图的后台线程数
+THUMBNAIL_WORKERS = 2
+
+# 后台任务工作进程（python manage.py run_tasks）的线程数
+TASK_WORKERS = 4
+
+# 商品搜索后端
+# 为None时按数据库类型自动选择（MySQL使用FULLTEXT ngram索引，SQLite使用FTS5），
+# 也可指定为 'products.search.backends.NgramIndexBackend' 使用通用倒排索引表
+# 切换后端或首次部署后需执行: python manage.py rebuild_search_index
+PRODUCT_SEARCH_BACKEND = None
+
 # 日志配置
 # 生产环境应配置详细的日志记录
 # LOGGING = {
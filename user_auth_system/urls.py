@@ -15,15 +15,15 @@ def home(request):
     """商城首页视图
     展示推荐商品和分类导航
     """
-    # 延迟导入模型以避免循环引用问题
-    from products.models import Product, Category
-    # 获取激活状态的推荐商品，最多8个
-    featured_products = Product.objects.filter(is_active=True, is_featured=True)[:8]
-    # 获取所有激活状态的分类
-    categories = Category.objects.filter(is_active=True)
+    # 延迟导入以避免循环引用问题
+    from products.cache import get_active_categories, get_featured_products_html
+    # 获取推荐商品区块的HTML片段（来自缓存，最多8个商品）
+    featured_products_html = get_featured_products_html()
+    # 获取所有激活状态的分类（来自缓存）
+    categories = get_active_categories()
     # 渲染首页模板并传递数据
     return render(request, 'home.html', {
-        'featured_products': featured_products,
+        'featured_products_html': featured_products_html,
         'categories': categories
     })
 